@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas
+from ..database import get_read_db
+from ..services import coalesce, history, latest, stats, timeseries
+from .auth import get_current_user
+import datetime
+import os
+
+router = APIRouter()
+
+DASHBOARD_WINDOW_HOURS = int(os.getenv("DASHBOARD_WINDOW_HOURS", "24"))
+DASHBOARD_POINTS = int(os.getenv("DASHBOARD_POINTS", "288"))
+
+@router.get("", response_model=schemas.Dashboard)
+async def get_dashboard(db: AsyncSession = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    # Everything the dashboard shows in one request: the token is decoded and
+    # the user loaded once, and without a replica every read below shares the
+    # session get_current_user used. An AsyncSession runs one statement at a
+    # time, so the reads are awaited in turn.
+    # Users still onboarding get their profile only, the client redirects them.
+    if not current_user.is_onboarded:
+        return {"user": current_user}
+    end = timeseries.to_epoch(datetime.datetime.utcnow())
+    start = end - DASHBOARD_WINDOW_HOURS * 3600
+
+    async def dashboard():
+        window = await stats.window_stats(db, current_user, start, end, percentiles=[])
+        return {
+            "user": current_user,
+            "current": await latest.reading(db, current_user),
+            "history": await history.read_history(db, current_user, start, end, DASHBOARD_POINTS),
+            "stats": window["total"],
+        }
+    # Every open dashboard refreshes at about the same time
+    return await coalesce.shared(("dashboard", current_user.id, end), schemas.Dashboard, dashboard)
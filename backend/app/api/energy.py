@@ -1,34 +1,152 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from .. import models, schemas, database
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas
+from ..database import get_db, get_read_db
+from ..services import adapters, coalesce, history, ingest, latest, response_cache, stats, timeseries
 from .auth import get_current_user
+from typing import Optional, Union
+import datetime
 
 router = APIRouter()
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.get("/current", response_model=schemas.EnergyData)
-def get_current_energy(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def get_current_energy(db: AsyncSession = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     if not current_user.is_onboarded:
         raise HTTPException(status_code=403, detail="Access denied. Complete onboarding first.")
     
     # Assuming "current" means the latest data point
-    latest = db.query(models.EnergyData).order_by(models.EnergyData.timestamp.desc()).first()
-    if not latest:
-        # Return a dummy if no data yet, or 404
-        raise HTTPException(status_code=404, detail="No energy data found")
-    return latest
-
-@router.get("/history", response_model=list[schemas.EnergyData])
-def get_energy_history(limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    async def newest():
+        reading = await latest.reading(db, current_user)
+        if not reading:
+            # Return a dummy if no data yet, or 404
+            raise HTTPException(status_code=404, detail="No energy data found")
+        return reading
+    return await coalesce.shared(("current", current_user.id), schemas.EnergyData, newest)
+
+@router.get("/history", response_model=Union[list[schemas.EnergyData], schemas.EnergyHistory])
+async def get_energy_history(
+    limit: int = 100,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    points: Optional[int] = None,
+    source_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    if not current_user.is_onboarded:
+        raise HTTPException(status_code=403, detail="Access denied. Complete onboarding first.")
+
+    if start is None and end is None and points is None:
+        # Returns last N records
+        return await coalesce.shared(("history", current_user.id, limit), list[schemas.EnergyData],
+                                     lambda: timeseries.recent_readings(db, current_user, limit))
+
+    # About `points` points over [start, end) (default: the 24 hours up to the next whole minute), read
+    # from whichever storage tier the planner estimates is cheapest
+    end = timeseries.to_utc(end) if end else response_cache.open_end()
+    start = timeseries.to_utc(start) if start else end - datetime.timedelta(days=1)
+    start_epoch, end_epoch = timeseries.to_epoch(start), timeseries.to_epoch(end)
+    if start_epoch >= end_epoch:
+        raise HTTPException(400, "start must be before end")
+    points = history.HISTORY_DEFAULT_POINTS if points is None else points
+    if not 1 <= points <= history.HISTORY_MAX_POINTS:
+        raise HTTPException(400, f"points must be between 1 and {history.HISTORY_MAX_POINTS}")
+    return await response_cache.cached(
+        ("history", current_user.id, start_epoch, end_epoch, points, source_id),
+        response_cache.Scope(current_user.id, source_id, start_epoch, end_epoch), schemas.EnergyHistory,
+        lambda: history.read_history(db, current_user, start_epoch, end_epoch, points, source_id)
+    )
+
+@router.get("/stats", response_model=schemas.EnergyStats)
+async def get_energy_stats(
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    bucket_seconds: Optional[int] = None,
+    source_id: Optional[int] = None,
+    percentiles: str = "50,95,99",
+    db: AsyncSession = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # Aggregates over [start, end) (default: the 24 hours up to the next whole minute), overall and per
+    # bucket_seconds bucket. Buckets are aligned to the epoch and empty ones omitted.
     if not current_user.is_onboarded:
         raise HTTPException(status_code=403, detail="Access denied. Complete onboarding first.")
+    end = timeseries.to_utc(end) if end else response_cache.open_end()
+    start = timeseries.to_utc(start) if start else end - datetime.timedelta(days=1)
+    start_epoch, end_epoch = timeseries.to_epoch(start), timeseries.to_epoch(end)
+    if start_epoch >= end_epoch:
+        raise HTTPException(400, "start must be before end")
+    if bucket_seconds is not None:
+        if bucket_seconds < 60:
+            raise HTTPException(400, "bucket_seconds must be at least 60")
+        if (end_epoch - start_epoch) / bucket_seconds > stats.STATS_MAX_BUCKETS:
+            raise HTTPException(400, f"Too many buckets, at most {stats.STATS_MAX_BUCKETS} per request")
+    try:
+        wanted = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        raise HTTPException(400, "percentiles must be a comma-separated list of numbers")
+    if any(not 0 < p <= 100 for p in wanted):
+        raise HTTPException(400, "percentiles must be in (0, 100]")
+
+    return await response_cache.cached(
+        ("stats", current_user.id, start_epoch, end_epoch, bucket_seconds, source_id, tuple(wanted)),
+        response_cache.Scope(current_user.id, source_id, start_epoch, end_epoch), schemas.EnergyStats,
+        lambda: stats.window_stats(db, current_user, start_epoch, end_epoch, bucket_seconds, source_id, wanted)
+    )
+
+@router.get("/sources", response_model=list[schemas.EnergySource])
+async def list_sources(db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    result = await db.execute(select(models.EnergySource).where(models.EnergySource.user_id == current_user.id).order_by(models.EnergySource.id))
+    return result.scalars().all()
+
+@router.post("/sources", response_model=schemas.EnergySource)
+async def create_source(payload: schemas.EnergySourceCreate, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    kinds = sorted(adapters.ADAPTERS) + [adapters.PUSH]
+    if payload.kind not in kinds:
+        raise HTTPException(400, f"Unknown source kind, expected one of {kinds}")
+    if payload.kind not in ("mock", adapters.PUSH) and not payload.endpoint_url:
+        raise HTTPException(400, "endpoint_url is required for this source kind")
+    try:
+        adapters.check_source(payload.kind, payload.endpoint_url, payload.credentials_ref)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if payload.unit not in adapters.UNIT_TO_MWH:
+        raise HTTPException(400, f"Unknown unit, expected one of {sorted(adapters.UNIT_TO_MWH)}")
+    if payload.interval_seconds < 1:
+        raise HTTPException(400, "interval_seconds must be at least 1")
+    if payload.deadband is not None and payload.deadband < 0:
+        raise HTTPException(400, "deadband must not be negative")
+
+    # Picked up by the scheduler on its next source sync
+    source = models.EnergySource(user_id=current_user.id, **payload.dict())
+    db.add(source)
+    await db.commit()
+    return source
+
+@router.post("/ingest")
+async def ingest_readings(source_id: int, request: Request, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    # Streams NDJSON lines or concatenated MessagePack maps of
+    # {"timestamp", "value", "unit"} into the given source, in MWh only
+    result = await db.execute(select(models.EnergySource).where(
+        models.EnergySource.id == source_id,
+        models.EnergySource.user_id == current_user.id
+    ))
+    source = result.scalars().first()
+    if not source:
+        raise HTTPException(status_code=404, detail="Source not found")
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ingest.NDJSON_TYPES:
+        items = ingest.ndjson_items(request.stream())
+    elif content_type in ingest.MSGPACK_TYPES:
+        items = ingest.msgpack_items(request.stream())
+    else:
+        raise HTTPException(415, "Send application/x-ndjson or application/msgpack")
 
-    # Returns last N records
-    history = db.query(models.EnergyData).order_by(models.EnergyData.timestamp.desc()).limit(limit).all()
-    return history
+    outcome = await ingest.ingest_stream(db, source, items)
+    if "error" in outcome:
+        # Batches before the error are already stored, see "accepted"
+        return JSONResponse(status_code=400, content=outcome)
+    return outcome
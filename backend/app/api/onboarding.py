@@ -1,35 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile
-from sqlalchemy.orm import Session
-from .. import models, schemas, database
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas
+from ..database import get_db
 from .auth import get_current_user
+import fcntl
+import hashlib
 import shutil
+import uuid
 import os
 
 router = APIRouter()
 
 UPLOAD_ROOT = "onboardingdoc"
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+# Resumable uploads are sent in chunks, so they are not bound by the single-request limit
+MAX_CHUNKED_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+MAX_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB
+PARTIAL_DIR = os.path.join(UPLOAD_ROOT, ".partial")
+UPLOAD_KINDS = {"energy_pic": "energy_source", "doc": "supporting_doc"}
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def validate_content_type(kind: str, content_type: str):
+    if kind == "energy_pic" and content_type.split("/")[0] != "image":
+        raise HTTPException(400, "Energy source file must be an image")
+    if kind == "doc" and content_type not in ["application/pdf", "image/jpeg", "image/png"]:
+        raise HTTPException(400, "Document must be PDF or image")
+
+async def ensure_default_source(db: AsyncSession, user: models.User):
+    # Onboarded users get a mock source to poll until they configure a real one
+    result = await db.execute(select(models.EnergySource.id).where(models.EnergySource.user_id == user.id).limit(1))
+    if result.first() is None:
+        db.add(models.EnergySource(user_id=user.id, name="Default source", kind="mock"))
+
+def save_file(upload: UploadFile, path: str):
+    with open(path, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
 
 @router.post("/upload")
-def submit_onboarding(
+async def submit_onboarding(
     energy_pic: UploadFile = None,
     doc: UploadFile = None,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Validate types if files are provided
-    if energy_pic and energy_pic.content_type.split("/")[0] != "image":
-        raise HTTPException(400, "Energy source file must be an image")
-    
-    if doc and doc.content_type not in ["application/pdf", "image/jpeg", "image/png"]:
-            raise HTTPException(400, "Document must be PDF or image")
+    if energy_pic:
+        validate_content_type("energy_pic", energy_pic.content_type)
+    if doc:
+        validate_content_type("doc", doc.content_type)
 
     # Validate size if files are provided
     for file in [f for f in [energy_pic, doc] if f]:
@@ -51,15 +70,13 @@ def submit_onboarding(
         pic_ext = os.path.splitext(energy_pic.filename)[1]
         pic_filename = f"energy_source{pic_ext}"
         pic_path = os.path.join(user_dir, pic_filename)
-        with open(pic_path, "wb") as buffer:
-            shutil.copyfileobj(energy_pic.file, buffer)
+        await run_in_threadpool(save_file, energy_pic, pic_path)
     
     if doc:
         doc_ext = os.path.splitext(doc.filename)[1]
         doc_filename = f"supporting_doc{doc_ext}"
         doc_path = os.path.join(user_dir, doc_filename)
-        with open(doc_path, "wb") as buffer:
-            shutil.copyfileobj(doc.file, buffer)
+        await run_in_threadpool(save_file, doc, doc_path)
 
     # Update user status
     if pic_path:
@@ -68,7 +85,181 @@ def submit_onboarding(
         current_user.supporting_doc = doc_path
         
     current_user.is_onboarded = True # Auto-approve for this demo
-    db.commit()
-    db.refresh(current_user)
+    await ensure_default_source(db, current_user)
+    await db.commit()
+    await db.refresh(current_user)
 
     return {"status": "onboarding_complete", "user": current_user.email}
+
+# Resumable chunked uploads: create a session, PATCH chunks at the current offset
+# (re-sending after a dropped connection), then finalize to verify and store the file.
+
+async def get_upload_session(upload_id: str, current_user: models.User, db: AsyncSession):
+    result = await db.execute(select(models.UploadSession).where(
+        models.UploadSession.id == upload_id,
+        models.UploadSession.user_id == current_user.id
+    ))
+    upload = result.scalars().first()
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+def partial_path(upload_id: str):
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.part")
+
+def open_partial(upload_id: str):
+    # The partial file, locked for writing, or None if another request holds it
+    buffer = open(partial_path(upload_id), "r+b")
+    try:
+        fcntl.flock(buffer, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        buffer.close()
+        return None
+    return buffer
+
+def file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(data)
+    return digest
+
+@router.post("/uploads", response_model=schemas.UploadSession)
+async def create_upload(
+    payload: schemas.UploadSessionCreate,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if payload.kind not in UPLOAD_KINDS:
+        raise HTTPException(400, "Upload kind must be 'energy_pic' or 'doc'")
+    validate_content_type(payload.kind, payload.content_type)
+    if payload.total_size <= 0:
+        raise HTTPException(400, "File is empty")
+    if payload.total_size > MAX_CHUNKED_FILE_SIZE:
+        raise HTTPException(400, "File too large (max 100MB)")
+
+    upload = models.UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=current_user.id,
+        kind=payload.kind,
+        filename=payload.filename,
+        content_type=payload.content_type,
+        total_size=payload.total_size,
+        received_size=0,
+        sha256=payload.sha256.lower() if payload.sha256 else None
+    )
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    open(partial_path(upload.id), "wb").close()
+    db.add(upload)
+    await db.commit()
+    return upload
+
+@router.get("/uploads/{upload_id}", response_model=schemas.UploadSession)
+async def get_upload(upload_id: str, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Clients resume by reading received_size and continuing from that offset
+    return await get_upload_session(upload_id, current_user, db)
+
+@router.patch("/uploads/{upload_id}", response_model=schemas.UploadSession)
+async def append_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    upload = await get_upload_session(upload_id, current_user, db)
+    if upload.status != "pending":
+        raise HTTPException(409, "Upload already finalized")
+
+    expected_hash = request.headers.get("x-chunk-sha256")
+    if offset < upload.received_size:
+        # A chunk we already stored being re-sent because its response was lost
+        result = await db.execute(select(models.UploadChunk).where(
+            models.UploadChunk.upload_id == upload.id,
+            models.UploadChunk.offset == offset
+        ))
+        chunk = result.scalars().first()
+        if chunk and (not expected_hash or expected_hash.lower() == chunk.sha256):
+            return upload
+    if offset != upload.received_size:
+        raise HTTPException(409, f"Chunk offset mismatch, expected offset {upload.received_size}")
+
+    # One writer per upload, across processes: a concurrent PATCH (a client
+    # retrying before the first attempt finished) is turned away rather than
+    # writing the same bytes twice
+    buffer = await run_in_threadpool(open_partial, upload.id)
+    if buffer is None:
+        raise HTTPException(409, "Another chunk of this upload is being written")
+    try:
+        # The other writer may have finished between the check above and the lock
+        await db.refresh(upload)
+        if offset != upload.received_size:
+            raise HTTPException(409, f"Chunk offset mismatch, expected offset {upload.received_size}")
+        await run_in_threadpool(buffer.seek, offset)
+        digest = hashlib.sha256()
+        size = 0
+        async for data in request.stream():
+            size += len(data)
+            if size > MAX_CHUNK_SIZE or offset + size > upload.total_size:
+                await run_in_threadpool(buffer.truncate, offset)
+                raise HTTPException(400, "Chunk exceeds the chunk size limit or the declared file size")
+            digest.update(data)
+            await run_in_threadpool(buffer.write, data)
+        if expected_hash and digest.hexdigest() != expected_hash.lower():
+            await run_in_threadpool(buffer.truncate, offset)
+            raise HTTPException(400, "Chunk checksum mismatch")
+        await run_in_threadpool(buffer.flush)
+
+        # Only moves forward from the offset this chunk was written at
+        moved = await db.execute(update(models.UploadSession).where(
+            models.UploadSession.id == upload.id,
+            models.UploadSession.received_size == offset
+        ).values(received_size=offset + size))
+        if moved.rowcount != 1:
+            await db.rollback()
+            raise HTTPException(409, "Upload offset changed while the chunk was written")
+        db.add(models.UploadChunk(upload_id=upload.id, offset=offset, size=size, sha256=digest.hexdigest()))
+        await db.commit()
+    finally:
+        await run_in_threadpool(buffer.close)
+    await db.refresh(upload)
+    return upload
+
+@router.post("/uploads/{upload_id}/finalize", response_model=schemas.UploadSession)
+async def finalize_upload(upload_id: str, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    upload = await get_upload_session(upload_id, current_user, db)
+    if upload.status != "pending":
+        raise HTTPException(409, "Upload already finalized")
+    if upload.received_size != upload.total_size:
+        raise HTTPException(409, f"Upload incomplete, received {upload.received_size} of {upload.total_size} bytes")
+
+    digest = await run_in_threadpool(file_sha256, partial_path(upload.id))
+    if upload.sha256 and digest.hexdigest() != upload.sha256:
+        raise HTTPException(400, "File checksum mismatch")
+
+    user_dir = os.path.join(UPLOAD_ROOT, str(current_user.id))
+    os.makedirs(user_dir, exist_ok=True)
+    ext = os.path.splitext(upload.filename)[1]
+    path = os.path.join(user_dir, f"{UPLOAD_KINDS[upload.kind]}{ext}")
+    os.replace(partial_path(upload.id), path)
+
+    if upload.kind == "energy_pic":
+        current_user.energy_source_pic = path
+    else:
+        current_user.supporting_doc = path
+    current_user.is_onboarded = True # Auto-approve for this demo, same as /upload
+    await ensure_default_source(db, current_user)
+
+    upload.sha256 = digest.hexdigest()
+    upload.status = "complete"
+    await db.commit()
+    return upload
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    upload = await get_upload_session(upload_id, current_user, db)
+    if upload.status == "pending" and os.path.exists(partial_path(upload.id)):
+        os.remove(partial_path(upload.id))
+    await db.delete(upload)
+    await db.commit()
+    return {"status": "aborted"}
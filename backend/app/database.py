@@ -1,14 +1,165 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from . import query_tracking
 import os
+import time
 
 # Use sqlite for simplicity in this demo, or postgres if env var set
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+# Optional read replica, read-only routes use it through get_read_db
+REPLICA_DATABASE_URL = os.getenv("DATABASE_REPLICA_URL")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {}
-)
+# Pool settings, shared by every engine below
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# SQLite pragmas, applied to every new connection
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+class PoolStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+pool_stats: dict[str, PoolStats] = {}
+
+class TimedPoolMixin:
+    # Measures how long callers wait for a connection to become available
+    stats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            if self.stats:
+                self.stats.timeouts += 1
+            raise
+        finally:
+            if self.stats:
+                self.stats.record_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+def to_async_url(url: str) -> str:
+    # Same database, async driver: aiosqlite for sqlite, asyncpg for postgres
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return url.replace(prefix, "postgresql+asyncpg://", 1)
+    return url
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def make_engine(url: str, name: str, is_async: bool = False):
+    options = {}
+    is_sqlite = "sqlite" in url
+    if is_sqlite:
+        options["connect_args"] = {"check_same_thread": False}
+    # In-memory SQLite lives in a single connection, pool settings do not apply
+    pooled = not (is_sqlite and (":memory:" in url or url.rstrip("/").endswith("sqlite:")))
+    if pooled:
+        options.update(
+            poolclass=TimedAsyncQueuePool if is_async else TimedQueuePool,
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+            pool_pre_ping=POOL_PRE_PING,
+        )
+
+    if is_async:
+        new_engine = create_async_engine(to_async_url(url), **options)
+        sync_engine = new_engine.sync_engine
+    else:
+        new_engine = create_engine(url, **options)
+        sync_engine = new_engine
+    if pooled:
+        sync_engine.pool.stats = pool_stats.setdefault(name, PoolStats(name))
+    if is_sqlite:
+        event.listen(sync_engine, "connect", set_sqlite_pragmas)
+    query_tracking.instrument_engine(sync_engine, name)
+    return new_engine
+
+# Sync engine, used by the scheduler and scripts
+engine = make_engine(SQLALCHEMY_DATABASE_URL, "primary")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# API routes use the async engines
+async_engine = make_engine(os.getenv("ASYNC_DATABASE_URL", SQLALCHEMY_DATABASE_URL), "primary_async", is_async=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+if REPLICA_DATABASE_URL:
+    replica_engine = make_engine(REPLICA_DATABASE_URL, "replica_async", is_async=True)
+    ReadSessionLocal = async_sessionmaker(bind=replica_engine, autoflush=False, expire_on_commit=False)
+else:
+    replica_engine = None
+    ReadSessionLocal = AsyncSessionLocal
+
 Base = declarative_base()
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_replica_db():
+    async with ReadSessionLocal() as db:
+        yield db
+
+# Read-only routes depend on get_read_db. Without a replica it is get_db itself,
+# so FastAPI reuses the request's primary session instead of opening a second one.
+get_read_db = get_replica_db if REPLICA_DATABASE_URL else get_db
+
+def pool_status():
+    engines = {"primary": engine, "primary_async": async_engine.sync_engine}
+    if replica_engine is not None:
+        engines["replica_async"] = replica_engine.sync_engine
+    status = {}
+    for name, pool_engine in engines.items():
+        stats = pool_stats.get(name)
+        if stats is None:
+            continue
+        pool = pool_engine.pool
+        status[name] = {
+            "size": pool.size(),
+            "in_use": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "checkouts": stats.checkouts,
+            "timeouts": stats.timeouts,
+            "wait_seconds_total": stats.wait_seconds,
+            "max_wait_seconds": stats.max_wait_seconds,
+        }
+    return status
@@ -1,14 +1,22 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from .database import engine, Base
-from .api import auth, onboarding, energy
-from .services import scheduler
+from .api import auth, dashboard, onboarding, energy
+from .services import latest, response_cache, scheduler
+from . import metrics, query_tracking
+from .profiling import ProfilingMiddleware
 import logging
+import os
+import time
 
-# Create tables
+# Create tables and add new columns to existing ones
 # In production, use Alembic for migrations
-from . import models
-models.Base.metadata.create_all(bind=engine)
+from . import migrations
+migrations.upgrade(engine)
+
+# Set to false when ingestion runs in its own process (python -m app.worker)
+RUN_SCHEDULER = os.getenv("RUN_SCHEDULER", "true").lower() == "true"
 
 app = FastAPI(title="Energy Monitor")
 
@@ -25,13 +33,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# On-demand profiling of single requests, see profiling.py
+app.add_middleware(ProfilingMiddleware)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    with query_tracking.track_queries("request", request.url.path) as queries:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers["X-Query-Count"] = str(queries.count)
+            response.headers["X-Query-Time-Ms"] = f"{queries.seconds * 1000:.2f}"
+            if queries.repeated_statements:
+                response.headers["X-Query-Warning"] = "n-plus-one"
+            return response
+        finally:
+            # Label by route template, not raw path, to keep label cardinality bounded
+            route = request.scope.get("route")
+            route_path = route.path if route else "unmatched"
+            queries.name = f"{request.method} {route_path}"
+            metrics.HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=request.method,
+                route=route_path,
+                status=status
+            )
+
 # Include Routers
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(onboarding.router, prefix="/api/onboarding", tags=["onboarding"])
 app.include_router(energy.router, prefix="/api/energy", tags=["energy"])
+app.include_router(dashboard.router, prefix="/api/dashboard", tags=["dashboard"])
 
 @app.on_event("startup")
 def startup_event():
+    # Every worker maps the shared latest readings table and brings it up to date,
+    # and the log of stored readings that invalidates cached responses
+    latest.attach()
+    response_cache.attach()
+    if not RUN_SCHEDULER:
+        logging.info("RUN_SCHEDULER is off, ingestion is left to the worker process")
+        return
     logging.info("Starting scheduler...")
     scheduler.start()
 
@@ -42,3 +86,7 @@ def shutdown_event():
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Energy Monitor API"}
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
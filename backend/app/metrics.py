@@ -0,0 +1,199 @@
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+
+# Minimal Prometheus text-format metrics, exposed on /metrics by main.py
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels: dict):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self.render_sample(dict(zip(self.labelnames, key)), value))
+        return lines
+
+    def render_sample(self, labels: dict, value):
+        return [f"{self.name}{format_labels(labels)} {format_value(value)}"]
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+class MirroredCounter(Gauge):
+    # A counter kept by another component and copied in by a collector
+    type = "counter"
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render_sample(self, labels: dict, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': format_value(float(bound))})} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        # Collectors refresh gauges from state owned elsewhere, right before rendering
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route and status.", ("method", "route", "status")))
+JOB_DURATION = REGISTRY.register(Histogram(
+    "scheduler_job_duration_seconds", "Scheduler job run time.", ("job",)))
+JOB_LAG = REGISTRY.register(Histogram(
+    "scheduler_job_lag_seconds", "Delay between a job's scheduled run time and its submission.", ("job",)))
+JOB_MISSED = REGISTRY.register(Counter(
+    "scheduler_job_missed_total", "Scheduled runs skipped because they were past their misfire grace time.", ("job",)))
+JOB_OVERLAP_SKIPPED = REGISTRY.register(Counter(
+    "scheduler_job_overlap_skipped_total", "Runs skipped because the previous run was still in progress.", ("job",)))
+POLL_SOURCES = REGISTRY.register(Gauge(
+    "poll_sources_scheduled", "Sources scheduled on the polling timing wheel."))
+INGEST_READINGS = REGISTRY.register(Counter(
+    "energy_ingest_readings_total", "Energy readings stored.", ("source",)))
+INGEST_FAILURES = REGISTRY.register(Counter(
+    "energy_ingest_failures_total", "Energy fetches that failed after all retries.", ("source",)))
+INGEST_REJECTED = REGISTRY.register(Counter(
+    "energy_ingest_rejected_total", "Readings rejected by validation and quarantined.", ("source", "reason")))
+INGEST_RETRIES = REGISTRY.register(Counter(
+    "energy_ingest_retries_total", "Energy fetch attempts that failed and were retried.", ("source",)))
+DEADBAND_DROPPED = REGISTRY.register(Counter(
+    "energy_deadband_dropped_total", "Readings left out by deadband compression, interpolated on read.", ("source",)))
+COALESCED_REQUESTS = REGISTRY.register(Counter(
+    "http_coalesced_requests_total", "Read requests answered from an identical request in flight or just finished.", ("route",)))
+RESPONSE_CACHE_REQUESTS = REGISTRY.register(Counter(
+    "http_response_cache_requests_total", "History and stats requests by response cache outcome: hit or miss.", ("route", "outcome")))
+RESPONSE_CACHE_BYTES = REGISTRY.register(Gauge(
+    "http_response_cache_bytes", "Approximate size of the cached responses in this process."))
+LATEST_READS = REGISTRY.register(Counter(
+    "energy_latest_reads_total", "Latest-reading lookups, by where they were answered: shared table or database.", ("outcome",)))
+SPOOLED_READINGS = REGISTRY.register(Counter(
+    "energy_spool_readings_total", "Readings written to the local spool because the database write failed."))
+SPOOL_REPLAYED_READINGS = REGISTRY.register(Counter(
+    "energy_spool_replayed_readings_total", "Spooled readings loaded into the database."))
+SPOOL_PENDING_BYTES = REGISTRY.register(Gauge(
+    "energy_spool_pending_bytes", "Size of spool segments not yet replayed."))
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    "db_query_duration_seconds", "Database statement execution time.", ("engine", "operation")))
+DB_QUERIES_PER_SCOPE = REGISTRY.register(Histogram(
+    "db_queries_per_scope", "Statements issued per request or scheduler job.", ("kind", "name"),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 500)))
+DB_N_PLUS_ONE = REGISTRY.register(Counter(
+    "db_n_plus_one_total", "Requests or jobs that repeated one statement past the N+1 threshold.", ("kind", "name")))
+DB_POOL_IN_USE = REGISTRY.register(Gauge(
+    "db_pool_connections_in_use", "Connections currently checked out of the pool.", ("pool",)))
+DB_POOL_SIZE = REGISTRY.register(Gauge(
+    "db_pool_size", "Configured pool size.", ("pool",)))
+DB_POOL_OVERFLOW = REGISTRY.register(Gauge(
+    "db_pool_overflow_connections", "Connections open beyond the pool size.", ("pool",)))
+DB_POOL_CHECKOUTS = REGISTRY.register(MirroredCounter(
+    "db_pool_checkouts_total", "Connection checkouts since start.", ("pool",)))
+DB_POOL_TIMEOUTS = REGISTRY.register(MirroredCounter(
+    "db_pool_checkout_timeouts_total", "Checkouts that timed out waiting for a connection.", ("pool",)))
+DB_POOL_WAIT = REGISTRY.register(MirroredCounter(
+    "db_pool_checkout_wait_seconds_total", "Total time spent waiting for a pooled connection.", ("pool",)))
+DB_POOL_MAX_WAIT = REGISTRY.register(Gauge(
+    "db_pool_checkout_wait_seconds_max", "Longest single wait for a pooled connection.", ("pool",)))
+
+def collect_pool_stats():
+    from . import database
+    for pool, status in database.pool_status().items():
+        DB_POOL_IN_USE.set(status["in_use"], pool=pool)
+        DB_POOL_SIZE.set(status["size"], pool=pool)
+        DB_POOL_OVERFLOW.set(status["overflow"], pool=pool)
+        DB_POOL_CHECKOUTS.set(status["checkouts"], pool=pool)
+        DB_POOL_TIMEOUTS.set(status["timeouts"], pool=pool)
+        DB_POOL_WAIT.set(status["wait_seconds_total"], pool=pool)
+        DB_POOL_MAX_WAIT.set(status["max_wait_seconds"], pool=pool)
+
+REGISTRY.add_collector(collect_pool_stats)
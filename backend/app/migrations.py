@@ -0,0 +1,93 @@
+from sqlalchemy import delete, func, inspect, literal_column, select, text, update
+from . import models
+from .services import partitions, timeseries
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Minimal schema upgrades until the project moves to Alembic. create_all only
+# creates missing tables, so columns added to existing models are added here with
+# ALTER TABLE, and indexes added to existing tables are created.
+# New columns must be nullable or have a server default.
+
+# Indexes replaced by newer ones, dropped from energy_data and its sealed partitions
+RETIRED_INDEXES = ["ix_energy_data_timestamp", "ix_energy_data_user_timestamp", "ix_energy_data_source_timestamp", "ix_energy_data_source_ts"]
+
+def add_missing_columns(engine, metadata):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info(f"Added column {table.name}.{column.name}")
+
+def add_missing_indexes(engine, metadata):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+                    logger.info(f"Created index {index.name}")
+
+def backfill_epoch(engine, tables):
+    # energy_data.ts of readings stored before the column existed
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in tables:
+            if not inspector.has_table(table.name):
+                continue
+            filled = conn.execute(update(table).where(table.c.ts.is_(None), table.c.timestamp.is_not(None)).values(
+                ts=timeseries.epoch_seconds(table.c.timestamp)
+            )).rowcount
+            if filled:
+                logger.info(f"Filled {table.name}.ts of {filled} readings")
+
+def drop_duplicate_readings(engine, tables):
+    # Readings of a source stored more than once in the same second, from before
+    # uq_energy_data_source_ts existed. The first one stored is kept.
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in tables:
+            if not inspector.has_table(table.name):
+                continue
+            if "uq_energy_data_source_ts".replace("energy_data", table.name, 1) in {index["name"] for index in inspector.get_indexes(table.name)}:
+                continue
+            # Ids are not unique in sealed SQLite partitions
+            row_id = literal_column("rowid") if engine.dialect.name == "sqlite" else table.c.id
+            keyed = (table.c.source_id.is_not(None), table.c.ts.is_not(None))
+            first = select(func.min(row_id)).where(*keyed).group_by(table.c.source_id, table.c.ts)
+            dropped = conn.execute(delete(table).where(*keyed, row_id.not_in(first))).rowcount
+            if dropped:
+                logger.info(f"Dropped {dropped} duplicate readings from {table.name}")
+
+def drop_retired_indexes(engine, tables):
+    with engine.begin() as conn:
+        for table in tables:
+            for name in RETIRED_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name.replace('energy_data', table.name, 1)}"))
+
+def upgrade(engine):
+    models.Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine, models.Base.metadata)
+    readings = [models.EnergyData.__table__]
+    backfill_epoch(engine, readings)
+    drop_retired_indexes(engine, readings)
+    drop_duplicate_readings(engine, readings)
+    add_missing_indexes(engine, models.Base.metadata)
+    # Native partitioning on PostgreSQL, and sealed SQLite partitions follow energy_data's schema
+    sealed = partitions.setup(engine)
+    add_missing_columns(engine, sealed)
+    backfill_epoch(engine, sealed.sorted_tables)
+    drop_retired_indexes(engine, sealed.sorted_tables)
+    drop_duplicate_readings(engine, sealed.sorted_tables)
+    add_missing_indexes(engine, sealed)
@@ -1,7 +1,9 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Integer, String, Float, DateTime, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
+import calendar
 import datetime
+import json
 
 Base = declarative_base()
 
@@ -18,18 +20,176 @@ class User(Base):
     energy_source_pic = Column(String, nullable=True) # Path to file
     supporting_doc = Column(String, nullable=True) # Path to file
 
+def epoch_of_timestamp(context):
+    # Whole UTC seconds of the row's timestamp, filled in on insert
+    return calendar.timegm(context.get_current_parameters()["timestamp"].utctimetuple())
+
 class EnergyData(Base):
     __tablename__ = "energy_data"
 
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    # Time key of every range read, index and partition: an integer compares and
+    # indexes far more compactly than SQLite's text datetimes. `timestamp` keeps
+    # the exact reading time returned by the API.
+    ts = Column(BigInteger, default=epoch_of_timestamp)
     generated_energy = Column(Float)
     
     # We might want to link this to a user if multiple users have different sources
     # For now, per spec, it's global or implicit. Adding user_id for future proofing/best practice
     # but could be optional depending on exact interpretation. Given "user's energy source", likely per user.
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True) 
+    source_id = Column(Integer, ForeignKey("energy_sources.id"), nullable=True, index=True)
+    is_outlier = Column(Boolean, default=False) # Flagged by ingest validation, still stored
     
     owner = relationship("User", back_populates="energy_data")
+    source = relationship("EnergySource", back_populates="energy_data")
+
+    # Time-range reads are scoped to a user or a source, rollups scan by time alone.
+    # A source has at most one reading per second: writers insert with ON CONFLICT
+    # DO NOTHING (timeseries.insert_readings), so retried pushes and replays are no-ops.
+    __table_args__ = (
+        Index("ix_energy_data_ts", "ts"),
+        Index("ix_energy_data_user_ts", "user_id", "ts"),
+        Index("uq_energy_data_source_ts", "source_id", "ts", unique=True),
+    )
 
 User.energy_data = relationship("EnergyData", back_populates="owner")
+
+class EnergySource(Base):
+    __tablename__ = "energy_sources"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    name = Column(String)
+    kind = Column(String, default="mock") # Adapter name, see services/adapters.py
+    endpoint_url = Column(String, nullable=True) # URL, CSV path or file-drop directory, depending on kind
+    credentials_ref = Column(String, nullable=True) # Name of the SOURCE_CRED_* env var holding the API token, never the token itself
+    unit = Column(String, default="MWh") # Unit the source reports in, converted to MWh on ingest
+    interval_seconds = Column(Integer, default=60)
+    is_active = Column(Boolean, default=True)
+    last_reading_at = Column(DateTime, nullable=True) # Newest reading received, adapters fetch from here
+    deadband = Column(Float, nullable=True) # MWh tolerance of swinging-door compression, None stores every reading
+    deadband_state = Column(String, nullable=True) # JSON, see services/deadband.py
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    owner = relationship("User", back_populates="energy_sources")
+    energy_data = relationship("EnergyData", back_populates="source")
+
+    @property
+    def compression_ratio(self):
+        # Readings received per reading stored since deadband compression was enabled
+        state = json.loads(self.deadband_state) if self.deadband_state else None
+        return state["received"] / state["stored"] if state and state["stored"] else None
+
+User.energy_sources = relationship("EnergySource", back_populates="owner")
+
+class EnergyRollup(Base):
+    # Pre-aggregated energy_data, see services/rollups.py
+    __tablename__ = "energy_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    resolution = Column(Integer) # Bucket width in seconds
+    bucket = Column(Integer) # Bucket start, epoch seconds
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    source_id = Column(Integer, ForeignKey("energy_sources.id"), nullable=True)
+    count = Column(Integer)
+    sum = Column(Float)
+    min = Column(Float)
+    max = Column(Float)
+    sketch = Column(LargeBinary) # Quantile sketch, services/sketch.py
+
+    __table_args__ = (
+        Index("ix_energy_rollups_user_bucket", "resolution", "user_id", "bucket"),
+        Index("ix_energy_rollups_source_bucket", "resolution", "source_id", "bucket"),
+    )
+
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+
+    resolution = Column(Integer, primary_key=True)
+    closed_until = Column(Integer) # Rollups are complete for buckets before this epoch second
+    claimed_until = Column(Integer, nullable=True) # A rollup run is building buckets before this epoch second
+
+class RollupDirty(Base):
+    # Closed rollup buckets a late write changed, per group, rebuilt by
+    # services/rollups.py compute_rollups and then deleted
+    __tablename__ = "rollup_dirty"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=True)
+    source_id = Column(Integer, nullable=True)
+    period_start = Column(Integer) # Epoch seconds, inclusive
+    period_end = Column(Integer) # Epoch seconds, exclusive
+
+class EnergyPartition(Base):
+    # Monthly partitions of energy_data, see services/partitions.py
+    __tablename__ = "energy_partitions"
+
+    name = Column(String, primary_key=True) # Table name, energy_data_YYYYMM
+    period_start = Column(Integer, index=True) # Epoch seconds, inclusive
+    period_end = Column(Integer) # Epoch seconds, exclusive
+    native = Column(Boolean, default=False) # PostgreSQL partition, rather than a sealed SQLite table
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ArchiveChunk(Base):
+    # Compressed columnar energy_data of archived periods, one chunk per user,
+    # source and day, see services/archive.py
+    __tablename__ = "energy_archive"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    source_id = Column(Integer, ForeignKey("energy_sources.id"), nullable=True)
+    period_start = Column(Integer) # Day the chunk covers, epoch seconds
+    count = Column(Integer)
+    timestamps = Column(LargeBinary) # services/columnar.py codecs
+    energy = Column(LargeBinary)
+    outliers = Column(LargeBinary)
+
+    __table_args__ = (
+        Index("ix_energy_archive_user_period", "user_id", "period_start"),
+        Index("ix_energy_archive_source_period", "source_id", "period_start"),
+        Index("ix_energy_archive_period", "period_start"),
+    )
+
+class QuarantinedReading(Base):
+    # Readings rejected by ingest validation, kept with the reason for inspection
+    __tablename__ = "quarantined_readings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source_id = Column(Integer, ForeignKey("energy_sources.id"), nullable=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    timestamp = Column(DateTime, nullable=True) # Null when the record could not be parsed
+    value = Column(Float, nullable=True) # As received, before unit conversion
+    unit = Column(String, nullable=True)
+    reason = Column(String, index=True) # One of services.validation.REASONS, or "malformed"
+    detail = Column(String)
+    raw = Column(String, nullable=True) # Original record text for malformed records
+    received_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    kind = Column(String) # "energy_pic" or "doc", same names as the multipart form fields
+    filename = Column(String)
+    content_type = Column(String)
+    total_size = Column(Integer)
+    received_size = Column(Integer, default=0)
+    sha256 = Column(String, nullable=True) # Expected digest of the whole file, checked on finalize
+    status = Column(String, default="pending")
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    chunks = relationship("UploadChunk", back_populates="upload", cascade="all, delete-orphan")
+
+class UploadChunk(Base):
+    __tablename__ = "upload_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    upload_id = Column(String, ForeignKey("upload_sessions.id"), index=True)
+    offset = Column(Integer)
+    size = Column(Integer)
+    sha256 = Column(String)
+
+    upload = relationship("UploadSession", back_populates="chunks")
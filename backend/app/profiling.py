@@ -0,0 +1,123 @@
+from collections import Counter
+from urllib.parse import parse_qs
+from starlette.responses import JSONResponse
+import cProfile
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Admin secret for on-demand profiling. Profiling is disabled when it is unset.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.001"))
+# One profile at a time per process: cProfile refuses a second active profiler
+# (Python 3.12+), and two profiles of the same loop would each hold both requests
+profile_lock = threading.Lock()
+
+class StackSampler:
+    # Samples one thread's stack on a timer and counts folded stacks
+    # ("outer;inner count" lines), the input format of flamegraph.pl and speedscope.
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+class ProfilingMiddleware:
+    # Profiles a single request when it carries ?profile=sample|cprofile (or an
+    # X-Profile header) together with X-Profile-Token. The profile is written to
+    # PROFILE_DIR and its file name returned in the X-Profile-File response header.
+    # Requests without the flag go straight through to the app.
+    #
+    # Both profilers follow the event loop thread, not the request: the profile
+    # also holds whatever other requests ran on the loop meanwhile, so profile an
+    # otherwise idle process. A flagged request arriving while another is being
+    # profiled gets 409.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not PROFILE_TOKEN or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        mode = self.requested_mode(scope)
+        if mode is None:
+            return await self.app(scope, receive, send)
+
+        if not profile_lock.acquire(blocking=False):
+            response = JSONResponse({"detail": "Another request is being profiled"}, status_code=409)
+            return await response(scope, receive, send)
+        try:
+            await self.profile(mode, scope, receive, send)
+        finally:
+            profile_lock.release()
+
+    async def profile(self, mode, scope, receive, send):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        extension = "prof" if mode == "cprofile" else "folded"
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.{extension}"
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-file", filename.encode())]
+            await send(message)
+
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_with_header)
+            finally:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+        else:
+            sampler = StackSampler(threading.get_ident(), SAMPLE_INTERVAL)
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_with_header)
+            finally:
+                sampler.stop()
+                sampler.write(os.path.join(PROFILE_DIR, filename))
+        logger.info(f"Profiled {scope['path']} to {filename}")
+
+    def requested_mode(self, scope):
+        headers = dict(scope.get("headers", []))
+        mode = headers.get(b"x-profile", b"").decode()
+        if not mode and b"profile=" in scope.get("query_string", b""):
+            mode = parse_qs(scope["query_string"].decode()).get("profile", [""])[0]
+        if not mode:
+            return None
+        if not hmac.compare_digest(headers.get(b"x-profile-token", b""), PROFILE_TOKEN.encode()):
+            return None
+        return "cprofile" if mode == "cprofile" else "sample"
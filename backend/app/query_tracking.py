@@ -0,0 +1,94 @@
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import event
+from . import metrics
+import contextvars
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged with their parameters and query plan
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# The same statement issued this many times in one request or job is flagged as N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+class QueryScope:
+    def __init__(self, kind: str, name: str):
+        self.kind = kind # "request" or "job"
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    @property
+    def repeated_statements(self):
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= N_PLUS_ONE_THRESHOLD]
+
+    def report(self):
+        metrics.DB_QUERIES_PER_SCOPE.observe(self.count, kind=self.kind, name=self.name)
+        for statement, count in self.repeated_statements:
+            metrics.DB_N_PLUS_ONE.inc(kind=self.kind, name=self.name)
+            logger.warning(f"Possible N+1 in {self.kind} {self.name}: statement ran {count} times: {statement}")
+
+current_scope = contextvars.ContextVar("query_scope", default=None)
+
+@contextmanager
+def track_queries(kind: str, name: str):
+    # Counts and times every statement issued in this context (contextvars follow
+    # async tasks and threadpool calls), then reports the totals
+    scope = QueryScope(kind, name)
+    token = current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        current_scope.reset(token)
+        scope.report()
+
+def explain(conn, statement: str, parameters):
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    # A raw DBAPI cursor, so the EXPLAIN itself does not go through these hooks
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+def log_slow_query(conn, statement: str, parameters, elapsed_ms: float, executemany: bool):
+    plan = ""
+    if not executemany:
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as e:
+            plan = f"(EXPLAIN failed: {e})"
+    logger.warning(f"Slow query ({elapsed_ms:.1f} ms): {statement} params={parameters}\n{plan}")
+
+def instrument_engine(engine, name: str):
+    # Hooks a sync engine (for async engines pass engine.sync_engine)
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        metrics.DB_QUERY_DURATION.observe(elapsed, engine=name, operation=operation)
+        scope = current_scope.get()
+        if scope is not None:
+            scope.record(statement, elapsed)
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            log_slow_query(conn, statement, parameters, elapsed * 1000, executemany)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
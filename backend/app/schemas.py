@@ -1,6 +1,13 @@
-from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime
+from pydantic import AfterValidator, BaseModel
+from typing import Annotated, Optional, List, Dict
+from datetime import datetime, timezone
+
+def as_utc(value: datetime) -> datetime:
+    # Times are stored as naive UTC. Responses carry the offset, so clients don't
+    # take them for local time.
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+UtcDatetime = Annotated[datetime, AfterValidator(as_utc)]
 
 class UserBase(BaseModel):
     email: str
@@ -29,9 +36,92 @@ class EnergyDataCreate(BaseModel):
     generated_energy: float
 
 class EnergyData(EnergyDataCreate):
-    id: int
-    timestamp: datetime
+    id: Optional[int] = None # None for a reading deadband compression holds back, not stored yet
+    timestamp: UtcDatetime
     user_id: Optional[int] = None
+    source_id: Optional[int] = None
+    is_outlier: Optional[bool] = None
+
+    class Config:
+        orm_mode = True
+
+class EnergySourceCreate(BaseModel):
+    name: str
+    kind: str = "mock"
+    endpoint_url: Optional[str] = None
+    credentials_ref: Optional[str] = None
+    unit: str = "MWh"
+    interval_seconds: int = 60
+    deadband: Optional[float] = None
+
+class EnergySource(EnergySourceCreate):
+    id: int
+    is_active: bool
+    last_reading_at: Optional[UtcDatetime] = None
+    compression_ratio: Optional[float] = None # Readings received per reading stored, with a deadband
+
+    class Config:
+        orm_mode = True
+
+class StatsSummary(BaseModel):
+    start: UtcDatetime
+    end: UtcDatetime
+    count: int # Readings; a deadband source counts those rebuilt at its interval, not the points stored
+    sum: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    mean: Optional[float] = None
+    percentiles: Dict[str, Optional[float]]
+
+class EnergyStats(BaseModel):
+    start: UtcDatetime
+    end: UtcDatetime
+    bucket_seconds: Optional[int] = None
+    tier: str # "raw", "rollup" or "mixed"
+    approximate: bool # Percentiles read from sketches (rollups, archived or rebuilt deadband readings), within ~1%
+    total: StatsSummary
+    buckets: List[StatsSummary]
+
+class HistoryPoint(BaseModel):
+    timestamp: UtcDatetime # Reading time, or bucket start when downsampled
+    generated_energy: Optional[float] = None # Bucket mean when downsampled
+    min: Optional[float] = None
+    max: Optional[float] = None
+    count: int
+
+class EnergyHistory(BaseModel):
+    start: UtcDatetime
+    end: UtcDatetime
+    bucket_seconds: Optional[int] = None # None when raw readings are returned as-is
+    tier: str # "raw", "rollup" or "mixed"
+    estimated_rows: int
+    # Deadband-compressed sources are rebuilt at their interval from the stored
+    # points, counts and sums cover every reading received
+    interpolated: bool = False
+    points: List[HistoryPoint]
+
+class Dashboard(BaseModel):
+    user: User
+    # None before onboarding; current is also None until the first reading
+    current: Optional[EnergyData] = None
+    history: Optional[EnergyHistory] = None
+    stats: Optional[StatsSummary] = None
+
+class UploadSessionCreate(BaseModel):
+    kind: str
+    filename: str
+    content_type: str
+    total_size: int
+    sha256: Optional[str] = None
+
+class UploadSession(BaseModel):
+    id: str
+    kind: str
+    filename: str
+    content_type: str
+    total_size: int
+    received_size: int
+    status: str
 
     class Config:
         orm_mode = True
@@ -0,0 +1,231 @@
+from collections import namedtuple
+import csv
+import datetime
+import glob
+import io
+import ipaddress
+import json
+import os
+import random
+import socket
+from urllib.parse import urlsplit
+import httpx
+
+# Fetch adapters, one per EnergySource.kind. Every adapter returns all readings
+# newer than `since` in one call, so a source that was unreachable for a while is
+# caught up with a single batch instead of one reading per poll.
+
+Reading = namedtuple("Reading", ["timestamp", "value"])
+
+# Push sources send readings to POST /api/energy/ingest and are never polled
+PUSH = "push"
+
+HTTP_TIMEOUT_SECONDS = float(os.getenv("SOURCE_HTTP_TIMEOUT_SECONDS", "10"))
+# Upper bound on files a file-drop source consumes per poll
+FILE_DROP_MAX_FILES = int(os.getenv("FILE_DROP_MAX_FILES", "100"))
+
+# Sources are configured by users, so what they can reach is limited: tokens
+# only come from env vars with this prefix (never DATABASE_URL or SECRET_KEY),
+# URLs must resolve to public addresses unless their host is listed in
+# SOURCE_ALLOWED_HOSTS (e.g. inverters on the plant LAN), and local CSV files and
+# drop directories must be under SOURCE_FILE_ROOT (no local sources when unset).
+# Checked when a source is created and again on every fetch, which connects to
+# the address that was checked (get_checked).
+CREDENTIALS_PREFIX = "SOURCE_CRED_"
+SOURCE_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("SOURCE_ALLOWED_HOSTS", "").split(",") if host.strip()}
+SOURCE_FILE_ROOT = os.getenv("SOURCE_FILE_ROOT")
+
+# Conversion factors applied by the validation stage
+UNIT_TO_MWH = {"Wh": 1e-6, "kWh": 1e-3, "MWh": 1.0, "GWh": 1e3}
+
+def parse_timestamp(value) -> datetime.datetime:
+    # Epoch seconds or ISO 8601, returned as naive UTC like the rest of the schema
+    if isinstance(value, (int, float)):
+        return datetime.datetime.utcfromtimestamp(value)
+    parsed = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def parse_record(record: dict) -> Reading:
+    value = record["value"] if "value" in record else record["generated_energy"]
+    return Reading(parse_timestamp(record["timestamp"]), float(value))
+
+def newer_than(readings, since):
+    readings = sorted(readings)
+    return readings if since is None else [r for r in readings if r.timestamp > since]
+
+def credentials(source):
+    check_credentials_ref(source.credentials_ref)
+    return os.getenv(source.credentials_ref) if source.credentials_ref else None
+
+def check_credentials_ref(ref):
+    if ref and not ref.startswith(CREDENTIALS_PREFIX):
+        raise ValueError(f"credentials_ref must name an environment variable starting with {CREDENTIALS_PREFIX}")
+
+def check_url(url: str):
+    # Raises ValueError unless url is http(s) to an allowed host or a public address.
+    # Returns the address to connect to, None for allowed hosts.
+    parsed = urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("endpoint_url must be an http or https URL")
+    host = parsed.hostname.lower()
+    if host in SOURCE_ALLOWED_HOSTS:
+        return None
+    try:
+        addresses = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(host, parsed.port or 0, proto=socket.IPPROTO_TCP)))
+    except socket.gaierror:
+        raise ValueError(f"endpoint_url host {host} does not resolve")
+    for address in addresses:
+        address = ipaddress.ip_address(address.split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"endpoint_url host {host} is a loopback, private or reserved address")
+    return addresses[0].split("%")[0]
+
+def get_checked(client: httpx.Client, url: str, **kwargs) -> httpx.Response:
+    # GET url from the address check_url vetted, without resolving the host again:
+    # a host that re-resolves to an internal address in between (DNS rebinding) is
+    # never connected to. The Host header, TLS SNI and certificate check still use
+    # the host name. Redirects are not followed.
+    address = check_url(url)
+    if address is None:
+        return client.get(url, **kwargs)
+    original = httpx.URL(url)
+    headers = {**kwargs.pop("headers", {}), "Host": original.netloc.decode("ascii")}
+    extensions = {"sni_hostname": original.host} if original.scheme == "https" else None
+    return client.get(original.copy_with(host=address), headers=headers, extensions=extensions, follow_redirects=False, **kwargs)
+
+def local_path(path: str) -> str:
+    # path resolved under SOURCE_FILE_ROOT (relative paths are taken from there),
+    # or ValueError if it points outside it
+    if not SOURCE_FILE_ROOT:
+        raise ValueError("Local file sources are disabled, SOURCE_FILE_ROOT is not set")
+    root = os.path.realpath(SOURCE_FILE_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path.removeprefix("file://")))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError("endpoint_url must be a path under SOURCE_FILE_ROOT")
+    return resolved
+
+def is_http(url: str) -> bool:
+    return url.startswith(("http://", "https://"))
+
+def check_source(kind: str, endpoint_url, credentials_ref):
+    # Raises ValueError if a user-supplied source would reach something it may not
+    check_credentials_ref(credentials_ref)
+    if kind == "http_json" or (kind == "csv" and is_http(endpoint_url)):
+        check_url(endpoint_url)
+    elif kind in ("csv", "file_drop"):
+        local_path(endpoint_url)
+
+class SourceAdapter:
+    # True when fetch only returns readings after `since`: anything at or before
+    # it is then a replay and quarantined as stale. Other adapters may deliver
+    # late readings, which are stored, and repeats are skipped by the
+    # (source_id, ts) unique key.
+    filters_since = False
+
+    def fetch(self, source, since):
+        raise NotImplementedError
+
+    def acknowledge(self, source):
+        # Called once the batch returned by fetch has been committed
+        pass
+
+ADAPTERS = {}
+
+def register(kind: str):
+    def decorator(cls):
+        ADAPTERS[kind] = cls()
+        return cls
+    return decorator
+
+def get_adapter(kind: str) -> SourceAdapter:
+    if kind not in ADAPTERS:
+        raise ValueError(f"No adapter for source kind {kind!r}")
+    return ADAPTERS[kind]
+
+@register("mock")
+class MockAdapter(SourceAdapter):
+    # Stand-in for sources without a real endpoint yet
+    def fetch(self, source, since):
+        return [Reading(datetime.datetime.utcnow(), random.uniform(0, 100))]
+
+@register("http_json")
+class HttpJsonAdapter(SourceAdapter):
+    # GETs endpoint_url?since=... and expects a JSON list of {"timestamp", "value"}
+    # objects, either bare or under a "readings" key
+    filters_since = True
+
+    def __init__(self):
+        self.client = httpx.Client(timeout=HTTP_TIMEOUT_SECONDS)
+
+    def fetch(self, source, since):
+        token = credentials(source)
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        params = {"since": since.isoformat()} if since else {}
+        response = get_checked(self.client, source.endpoint_url, params=params, headers=headers)
+        response.raise_for_status()
+        body = response.json()
+        records = body["readings"] if isinstance(body, dict) else body
+        return newer_than([parse_record(record) for record in records], since)
+
+@register("csv")
+class CsvAdapter(SourceAdapter):
+    # Polls a CSV with timestamp,value columns over HTTP(S) or from a local path
+    # under SOURCE_FILE_ROOT.
+    # The whole file is read each time and only rows after `since` are kept.
+    filters_since = True
+
+    def __init__(self):
+        self.client = httpx.Client(timeout=HTTP_TIMEOUT_SECONDS)
+
+    def fetch(self, source, since):
+        if is_http(source.endpoint_url):
+            token = credentials(source)
+            headers = {"Authorization": f"Bearer {token}"} if token else {}
+            response = get_checked(self.client, source.endpoint_url, headers=headers)
+            response.raise_for_status()
+            text = response.text
+        else:
+            with open(local_path(source.endpoint_url), newline="") as f:
+                text = f.read()
+        return newer_than([parse_record(row) for row in csv.DictReader(io.StringIO(text))], since)
+
+@register("file_drop")
+class FileDropAdapter(SourceAdapter):
+    # Watches a directory under SOURCE_FILE_ROOT that the source drops .csv, .json
+    # or .ndjson files into.
+    # Files are moved to processed/ only after their readings are committed, so a
+    # failed insert re-reads them on the next poll.
+    def __init__(self):
+        self.pending = {}
+
+    def fetch(self, source, since):
+        directory = local_path(source.endpoint_url)
+        paths = sorted(
+            path for path in glob.glob(os.path.join(directory, "*"))
+            if os.path.isfile(path) and path.endswith((".csv", ".json", ".ndjson"))
+        )[:FILE_DROP_MAX_FILES]
+        readings = []
+        for path in paths:
+            readings.extend(self.read_file(path))
+        self.pending[source.id] = paths
+        # Dropped files are new by definition, late readings are kept as well
+        return sorted(readings)
+
+    def read_file(self, path: str):
+        with open(path, newline="") as f:
+            if path.endswith(".csv"):
+                return [parse_record(row) for row in csv.DictReader(f)]
+            if path.endswith(".ndjson"):
+                return [parse_record(json.loads(line)) for line in f if line.strip()]
+            body = json.load(f)
+            return [parse_record(record) for record in (body["readings"] if isinstance(body, dict) else body)]
+
+    def acknowledge(self, source):
+        processed = os.path.join(local_path(source.endpoint_url), "processed")
+        os.makedirs(processed, exist_ok=True)
+        for path in self.pending.pop(source.id, []):
+            os.replace(path, os.path.join(processed, os.path.basename(path)))
@@ -0,0 +1,125 @@
+from collections import namedtuple
+from sqlalchemy import select, insert, delete, func
+from .. import database, metrics, models
+from ..query_tracking import track_queries
+from . import columnar, partitions, timeseries
+import logging
+import os
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Cold energy_data in compressed columnar chunks. Once a monthly partition is
+# rolled up and older than ARCHIVE_AFTER_DAYS it is rewritten into one chunk per
+# user, source and day (services/columnar.py) and the partition is dropped.
+# Raw reads of a range decode the overlapping chunks alongside the row tables.
+
+# 0 keeps every partition as rows
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+CHUNK_SECONDS = 86400
+# Stand-in for NULL user or source ids in NumPy arrays
+NO_ID = -1
+# Per reading in energy_data, without row and index overhead: timestamp, value, flag
+RAW_BYTES = 17
+
+Archived = namedtuple("Archived", ["user_ids", "source_ids", "micros", "values", "outliers"])
+
+def encode_chunks(user_ids, source_ids, micros, values, outliers) -> list:
+    days = micros // 1_000_000 // CHUNK_SECONDS
+    order = np.lexsort((micros, days, source_ids, user_ids))
+    keys = np.column_stack([user_ids, source_ids, days])[order]
+    boundaries = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+    chunks = []
+    for rows, (user_id, source_id, day) in zip(np.split(order, boundaries), keys[np.r_[0, boundaries]] if len(order) else []):
+        chunks.append({
+            "user_id": None if user_id == NO_ID else int(user_id),
+            "source_id": None if source_id == NO_ID else int(source_id),
+            "period_start": int(day) * CHUNK_SECONDS,
+            "count": len(rows),
+            "timestamps": columnar.encode_timestamps(micros[rows]),
+            "energy": columnar.encode_values(values[rows]),
+            "outliers": columnar.encode_flags(outliers[rows]),
+        })
+    return chunks
+
+def compact_partition(db, partition: models.EnergyPartition) -> int:
+    table = partitions.partition_table(partition.name)
+    rows = db.execute(select(
+        func.coalesce(table.c.user_id, NO_ID),
+        func.coalesce(table.c.source_id, NO_ID),
+        table.c.timestamp,
+        table.c.generated_energy,
+        func.coalesce(table.c.is_outlier, False)
+    )).all()
+    chunks = []
+    if rows:
+        user_ids, source_ids, timestamps, values, outliers = zip(*rows)
+        micros = np.array(timestamps, dtype="datetime64[us]").view(np.int64)
+        chunks = encode_chunks(
+            np.array(user_ids, dtype=np.int64), np.array(source_ids, dtype=np.int64), micros,
+            np.array(values, dtype=np.float64), np.array(outliers, dtype=bool)
+        )
+        db.execute(insert(models.ArchiveChunk), chunks)
+    # Chunks and the dropped partition are committed together
+    partitions.drop_partition(db, partition)
+    stored = sum(len(chunk["timestamps"]) + len(chunk["energy"]) + len(chunk["outliers"]) for chunk in chunks)
+    ratio = len(rows) * RAW_BYTES / stored if stored else 0
+    logger.info(f"Archived {partition.name}: {len(rows)} readings in {len(chunks)} chunks, {stored} bytes ({ratio:.1f}x)")
+    return len(rows)
+
+def compact(now: float = None):
+    with metrics.JOB_DURATION.time(job="compact_archive"), track_queries("job", "compact_archive"):
+        if not ARCHIVE_AFTER_DAYS:
+            return
+        now = int(time.time() if now is None else now)
+        db = database.SessionLocal()
+        try:
+            closed = partitions.rolled_up_until(db)
+            horizon = min(closed, now - ARCHIVE_AFTER_DAYS * 86400)
+            for partition in db.execute(select(models.EnergyPartition).where(
+                models.EnergyPartition.period_end <= horizon
+            ).order_by(models.EnergyPartition.period_start)).scalars().all():
+                compact_partition(db, partition)
+            # Archived readings expire with raw retention like the partitions do
+            cutoff = partitions.retention_cutoff(now)
+            if cutoff is not None:
+                expired = db.execute(delete(models.ArchiveChunk).where(
+                    models.ArchiveChunk.period_start + CHUNK_SECONDS <= min(timeseries.to_epoch(cutoff), closed)
+                )).rowcount
+                db.commit()
+                if expired:
+                    logger.info(f"Dropped {expired} expired archive chunks")
+        finally:
+            db.close()
+
+def chunk_query(filters, start: int, end: int):
+    return select(
+        models.ArchiveChunk.user_id, models.ArchiveChunk.source_id, models.ArchiveChunk.count,
+        models.ArchiveChunk.timestamps, models.ArchiveChunk.energy, models.ArchiveChunk.outliers
+    ).where(*filters, models.ArchiveChunk.period_start > start - CHUNK_SECONDS, models.ArchiveChunk.period_start < end)
+
+def decode(rows, start: int, end: int) -> Archived:
+    # Readings with a value in [start, end), ordered by time. A day can have more
+    # than one chunk when late readings were archived after the rest.
+    if not rows:
+        return Archived(*(np.empty(0, dtype=dtype) for dtype in (np.int64, np.int64, np.int64, np.float64, bool)))
+    counts = [row.count for row in rows]
+    micros = np.concatenate([columnar.decode_timestamps(row.timestamps, row.count) for row in rows])
+    values = np.concatenate([columnar.decode_values(row.energy, row.count) for row in rows])
+    outliers = np.concatenate([columnar.decode_flags(row.outliers, row.count) for row in rows])
+    user_ids = np.repeat([NO_ID if row.user_id is None else row.user_id for row in rows], counts)
+    source_ids = np.repeat([NO_ID if row.source_id is None else row.source_id for row in rows], counts)
+    keep = np.flatnonzero((micros >= start * 1_000_000) & (micros < end * 1_000_000) & ~np.isnan(values))
+    keep = keep[np.argsort(micros[keep], kind="stable")]
+    return Archived(user_ids[keep], source_ids[keep], micros[keep], values[keep], outliers[keep])
+
+async def load(db, user: models.User, source_id: int, start: int, end: int) -> Archived:
+    filters = timeseries.reading_filters(user, source_id, models.ArchiveChunk)
+    return decode((await db.execute(chunk_query(filters, start, end))).all(), start, end)
+
+async def overlaps(db, user: models.User, source_id: int, start: int, end: int) -> bool:
+    filters = timeseries.reading_filters(user, source_id, models.ArchiveChunk)
+    query = chunk_query(filters, start, end).with_only_columns(models.ArchiveChunk.id).limit(1)
+    return (await db.execute(query)).first() is not None
@@ -0,0 +1,64 @@
+from fastapi import Response
+from pydantic import TypeAdapter
+from .. import metrics
+import asyncio
+import functools
+import os
+import time
+
+# Single-flight for read routes. When a new minute lands many clients refresh at
+# once with identical requests: the first one runs the queries and serializes
+# the response, the others await that same result instead of querying again.
+# The body is then reused for COALESCE_TTL_SECONDS. Keys include the user, as
+# every read is scoped to what the user can see. Per process, like the rest of
+# the in-memory state.
+
+COALESCE_TTL_SECONDS = float(os.getenv("COALESCE_TTL_SECONDS", "1"))
+# Expired entries are swept once there are more than this many
+COALESCE_SWEEP_ENTRIES = 1000
+
+# key -> (expires at, or None while in flight; task producing the body)
+flights = {}
+
+@functools.lru_cache(maxsize=None)
+def adapter(model) -> TypeAdapter:
+    return TypeAdapter(model)
+
+def render(model, value) -> bytes:
+    # What FastAPI would send for response_model=model
+    return adapter(model).dump_json(adapter(model).validate_python(value, from_attributes=True))
+
+def sweep(now: float):
+    for key, (expires, _) in list(flights.items()):
+        if expires is not None and expires <= now:
+            del flights[key]
+
+async def shared(key: tuple, model, compute, keep=None) -> Response:
+    # key[0] names the route. compute is an async callable returning the value to
+    # render as `model`; its exceptions (HTTPException included) reach every waiter.
+    # keep, if given, is called with the body by the request that computed it.
+    now = time.monotonic()
+    entry = flights.get(key)
+    if entry is not None and (entry[0] is None or entry[0] > now):
+        metrics.COALESCED_REQUESTS.inc(route=key[0])
+        task = entry[1]
+    else:
+        if len(flights) > COALESCE_SWEEP_ENTRIES:
+            sweep(now)
+        task = asyncio.ensure_future(run(key, model, compute, keep))
+        flights[key] = (None, task)
+    # Shielded, so one waiter going away does not cancel the others' result
+    body = await asyncio.shield(task)
+    return Response(content=body, media_type="application/json")
+
+async def run(key: tuple, model, compute, keep) -> bytes:
+    try:
+        body = render(model, await compute())
+    except BaseException:
+        # Failures are not reused: the next request tries again
+        flights.pop(key, None)
+        raise
+    if keep is not None:
+        keep(body)
+    flights[key] = (time.monotonic() + COALESCE_TTL_SECONDS, asyncio.current_task())
+    return body
@@ -0,0 +1,47 @@
+import zlib
+import numpy as np
+
+# Column codecs for archived readings. Timestamps are stored as zigzag-encoded
+# delta-of-deltas and values as the XOR of each float with the one before it (as
+# in Gorilla), both split into byte planes and deflated: regular intervals and
+# slowly changing values become long runs of zero bytes. Instead of Gorilla's
+# per-value bit packing everything is whole-array NumPy, in both directions.
+
+LEVEL = 6
+
+def shuffle(words: np.ndarray) -> bytes:
+    # All first bytes of the 64-bit words, then all second bytes, and so on
+    planes = np.asarray(words, dtype="<u8").view(np.uint8).reshape(-1, 8).T
+    return zlib.compress(np.ascontiguousarray(planes).tobytes(), LEVEL)
+
+def unshuffle(blob: bytes, count: int) -> np.ndarray:
+    planes = np.frombuffer(zlib.decompress(blob), dtype=np.uint8).reshape(8, count)
+    return np.ascontiguousarray(planes.T).view("<u8").ravel()
+
+def zigzag(values: np.ndarray) -> np.ndarray:
+    # Small negative and positive integers to small unsigned ones
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+def unzigzag(words: np.ndarray) -> np.ndarray:
+    return (words >> np.uint64(1)).view(np.int64) ^ -(words & np.uint64(1)).astype(np.int64)
+
+def encode_timestamps(micros) -> bytes:
+    # Epoch microseconds; the first value and first delta are kept whole
+    micros = np.asarray(micros, dtype=np.int64)
+    return shuffle(zigzag(np.diff(np.diff(micros, prepend=0), prepend=0)))
+
+def decode_timestamps(blob: bytes, count: int) -> np.ndarray:
+    return np.cumsum(np.cumsum(unzigzag(unshuffle(blob, count))))
+
+def encode_values(values) -> bytes:
+    bits = np.asarray(values, dtype=np.float64).view(np.uint64)
+    return shuffle(bits ^ np.concatenate((np.zeros(1, dtype=np.uint64), bits[:-1])))
+
+def decode_values(blob: bytes, count: int) -> np.ndarray:
+    return np.bitwise_xor.accumulate(unshuffle(blob, count)).view(np.float64)
+
+def encode_flags(flags) -> bytes:
+    return np.packbits(np.asarray(flags, dtype=bool)).tobytes()
+
+def decode_flags(blob: bytes, count: int) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(blob, dtype=np.uint8), count=count).astype(bool)
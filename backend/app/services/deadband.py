@@ -0,0 +1,153 @@
+from sqlalchemy import select
+from .. import models
+from . import archive, partitions, timeseries
+import datetime
+import json
+import os
+import numpy as np
+
+# Optional swinging-door compression of accepted readings, per source. A reading
+# is only stored once no straight line from the last stored point can pass within
+# `deadband` MWh of every reading since; until then the newest reading is held
+# back. Every read rebuilds the series at the source's interval by linear
+# interpolation between stored points and the held one (rebuilt, rebuilt_sync):
+# raw history, the raw parts of /history buckets and /stats, and hourly rollups,
+# so counts and sums cover the readings received, not the points stored. The
+# door is carried across batches in EnergySource.deadband_state, together with
+# received/stored counts.
+
+# A held reading is stored at least this often, so flat stretches still leave
+# a point every so often and interpolation never spans more than this
+DEADBAND_MAX_SECONDS = int(os.getenv("DEADBAND_MAX_SECONDS", "3600"))
+
+def seconds(timestamp: datetime.datetime) -> float:
+    return timeseries.to_epoch(timestamp) + timestamp.microsecond / 1e6
+
+def new_state() -> dict:
+    # anchor: last stored [seconds, value]; held: newest reading not stored yet;
+    # low/high: the door's slope bounds from the anchor, None while it is wide open
+    return {"anchor": None, "held": None, "low": None, "high": None, "received": 0, "stored": 0}
+
+def compress(rows: list, deadband: float, state: dict):
+    # rows: accepted readings of one source in time order. Returns the rows to
+    # store and the updated state.
+    state = dict(state or new_state())
+    kept = []
+
+    def store(row):
+        kept.append(row)
+        state["anchor"] = [seconds(row["timestamp"]), row["generated_energy"]]
+        state["low"] = state["high"] = None
+
+    for row in rows:
+        state["received"] += 1
+        t, value = seconds(row["timestamp"]), row["generated_energy"]
+        anchor = state["anchor"]
+        if anchor is None or t <= (state["held"]["t"] if state["held"] else anchor[0]):
+            # First reading, or a late one: stored as is, the door is unaffected
+            if anchor is None:
+                store(row)
+            else:
+                kept.append(row)
+            continue
+        high, low = slopes(anchor, t, value, deadband)
+        if state["high"] is not None:
+            high, low = min(high, state["high"]), max(low, state["low"])
+        if state["held"] and (low > high or t - anchor[0] > DEADBAND_MAX_SECONDS):
+            # The door closed: the held reading is the last one the line could reach
+            store(held_row(state["held"], row))
+            high, low = slopes(state["anchor"], t, value, deadband)
+        state["high"], state["low"] = high, low
+        state["held"] = {"t": t, "timestamp": row["timestamp"].isoformat(), "generated_energy": value, "is_outlier": row.get("is_outlier", False)}
+    state["stored"] += len(kept)
+    return kept, state
+
+def slopes(anchor, t: float, value: float, deadband: float):
+    dt = t - anchor[0]
+    return (value + deadband - anchor[1]) / dt, (value - deadband - anchor[1]) / dt
+
+def held_row(held: dict, template: dict) -> dict:
+    return {
+        **template,
+        "timestamp": datetime.datetime.fromisoformat(held["timestamp"]),
+        "generated_energy": held["generated_energy"],
+        "is_outlier": held["is_outlier"],
+    }
+
+def held_reading(source: models.EnergySource):
+    # The reading the source's door holds back, as a row without an id, or None
+    held = json.loads(source.deadband_state)["held"] if source.deadband_state else None
+    if held is None:
+        return None
+    return {
+        "id": None, "source_id": source.id, "user_id": source.user_id,
+        "timestamp": datetime.datetime.fromisoformat(held["timestamp"]),
+        "generated_energy": held["generated_energy"], "is_outlier": held["is_outlier"],
+    }
+
+def rebuild(times, values, interval: int, start: int, end: int):
+    # (seconds, values) in [start, end): every stored point followed by points
+    # `interval` apart up to the next one. Wider gaps than a door stays open are
+    # outages, left empty.
+    times, values = np.asarray(times, dtype=np.float64), np.asarray(values, dtype=np.float64)
+    if not times.size:
+        return times, values
+    gaps = np.diff(times)
+    steps = np.append(np.where(gaps <= DEADBAND_MAX_SECONDS + interval, np.maximum(np.ceil(gaps / interval), 1), 1), 1).astype(np.int64)
+    owner = np.repeat(np.arange(times.size), steps)
+    grid = times[owner] + (np.arange(owner.size) - np.repeat(np.cumsum(steps) - steps, steps)) * interval
+    keep = (grid >= start) & (grid < end)
+    return grid[keep], np.interp(grid[keep], times, values)
+
+def stored_query(table, source_id: int, start: int, end: int):
+    return select(table.c.timestamp, table.c.generated_energy).where(
+        table.c.source_id == source_id, *timeseries.time_range(start, end, table.c), table.c.generated_energy.is_not(None)
+    )
+
+def series(source: models.EnergySource, rows, archived: archive.Archived, start: int, end: int, fetched_until: int):
+    # Rebuilt readings of the source in [start, end) from its stored rows and
+    # archived readings, fetched from far enough around the window
+    times = np.concatenate([np.array([seconds(timestamp) for timestamp, _ in rows], dtype=np.float64), archived.micros / 1e6])
+    values = np.concatenate([np.array([value for _, value in rows], dtype=np.float64), archived.values])
+    order = np.argsort(times, kind="stable")
+    times, values = times[order], values[order]
+    held = held_reading(source)
+    if held and (not times.size or seconds(held["timestamp"]) > times[-1]) and seconds(held["timestamp"]) < fetched_until:
+        times, values = np.append(times, seconds(held["timestamp"])), np.append(values, held["generated_energy"])
+    return rebuild(times, values, source.interval_seconds or 60, start, end)
+
+def margin(source: models.EnergySource) -> int:
+    # How far around a window stored points still shape it
+    return DEADBAND_MAX_SECONDS + (source.interval_seconds or 60)
+
+async def rebuilt(db, source: models.EnergySource, start: int, end: int):
+    a, b = start - margin(source), end + margin(source)
+    table = await partitions.readings_between(db, a, b)
+    rows = (await db.execute(stored_query(table, source.id, a, b))).all()
+    chunks = (await db.execute(archive.chunk_query([models.ArchiveChunk.source_id == source.id], a, b))).all()
+    return series(source, rows, archive.decode(chunks, a, b), start, end, b)
+
+def rebuilt_sync(db, source: models.EnergySource, start: int, end: int):
+    a, b = start - margin(source), end + margin(source)
+    table = partitions.readings(db.execute(partitions.sealed_query(a, b)).scalars().all(), a, b)
+    rows = db.execute(stored_query(table, source.id, a, b)).all()
+    chunks = db.execute(archive.chunk_query([models.ArchiveChunk.source_id == source.id], a, b)).all()
+    return series(source, rows, archive.decode(chunks, a, b), start, end, b)
+
+def compressed_query(user: models.User = None, source_id: int = None):
+    # Sources whose readings are read rebuilt: the user's, or any user's
+    query = select(models.EnergySource).where(models.EnergySource.deadband > 0)
+    if user is not None:
+        query = query.where(models.EnergySource.user_id == user.id)
+    if source_id is not None:
+        query = query.where(models.EnergySource.id == source_id)
+    return query
+
+def not_compressed(sources: list, table) -> list:
+    # Filters leaving out the rows of `sources`, which are read rebuilt instead
+    if not sources:
+        return []
+    return [table.source_id.is_(None) | table.source_id.not_in([source.id for source in sources])]
+
+def not_compressed_mask(sources: list, source_ids: np.ndarray) -> np.ndarray:
+    return ~np.isin(source_ids, [source.id for source in sources])
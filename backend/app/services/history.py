@@ -0,0 +1,170 @@
+from collections import namedtuple
+from sqlalchemy import select, func
+from .. import models
+from . import archive, deadband, partitions, rollups, stats, timeseries
+import logging
+import os
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Query planner for /history: picks raw readings, rollups or a mix of closed
+# rollups plus raw edges for a range, from row counts estimated off the sources'
+# polling intervals, and downsamples to roughly the requested number of points.
+
+HISTORY_DEFAULT_POINTS = int(os.getenv("HISTORY_DEFAULT_POINTS", "500"))
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "5000"))
+# Assumed reading interval when the user has no sources to estimate from
+DEFAULT_INTERVAL_SECONDS = 60
+# Bucket sizes the planner rounds up to, beyond the last one whole days
+BUCKET_STEPS = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400)
+
+HistoryPlan = namedtuple("HistoryPlan", "tier bucket segments estimated_rows")
+
+def bucket_for(span: int, points: int) -> int:
+    wanted = -(-span // points)
+    for step in BUCKET_STEPS:
+        if step >= wanted:
+            return step
+    return stats.ceil_to(wanted, rollups.DAY)
+
+def segment_cost(tier, a: int, b: int, rate: float, sources: int) -> float:
+    # Expected rows read: raw rows arrive at `rate` per second, rollups hold one
+    # row per source and bucket
+    if tier == "raw":
+        return (b - a) * rate
+    return (b - a) / tier * sources
+
+def choose(start: int, end: int, points: int, rate: float, sources: int, closed_until: dict) -> HistoryPlan:
+    raw_rows = (end - start) * rate
+    if raw_rows <= points:
+        return HistoryPlan("raw", None, [("raw", start, end)], round(raw_rows))
+    bucket = bucket_for(end - start, points)
+    candidates = [[("raw", start, end)], stats.plan(start, end, bucket, closed_until)]
+    costs = [sum(segment_cost(tier, a, b, rate, sources) for tier, a, b in segments) for segments in candidates]
+    segments, cost = min(zip(candidates, costs), key=lambda candidate: candidate[1])
+    tiers = {tier == "raw" for tier, _, _ in segments}
+    tier = "raw" if tiers == {True} else "rollup" if tiers == {False} else "mixed"
+    return HistoryPlan(tier, bucket, segments, round(cost))
+
+async def plan_history(db, user: models.User, start: int, end: int, points: int, source_id: int = None) -> HistoryPlan:
+    query = select(models.EnergySource.interval_seconds).where(models.EnergySource.user_id == user.id)
+    if source_id is not None:
+        query = query.where(models.EnergySource.id == source_id)
+    intervals = (await db.execute(query)).scalars().all()
+    rate = sum(1 / max(interval, 1) for interval in intervals) or 1 / DEFAULT_INTERVAL_SECONDS
+    plan = choose(start, end, points, rate, max(len(intervals), 1), await rollups.closed_for(db, user, source_id))
+    logger.info(f"History [{start}, {end}) for {points} points: {plan.tier}, bucket={plan.bucket}, "
+                f"estimated {plan.estimated_rows} rows, segments {plan.segments}")
+    return plan
+
+def point(bucket_start: int, count: int, total, low, high) -> dict:
+    return {
+        "timestamp": timeseries.from_epoch(bucket_start),
+        "generated_energy": total / count if count else None,
+        "min": low,
+        "max": high,
+        "count": count,
+    }
+
+async def raw_points(db, user: models.User, source_id, start: int, end: int, limit: int, compressed: list = ()):
+    # Readings as stored, leaving out those of the `compressed` sources
+    table = await partitions.readings_between(db, start, end)
+    result = await db.execute(select(table.c.timestamp, table.c.generated_energy).where(
+        *timeseries.reading_filters(user, source_id, table.c), *timeseries.time_range(start, end, table.c),
+        table.c.generated_energy.is_not(None), *deadband.not_compressed(compressed, table.c)
+    ).order_by(table.c.ts).limit(limit))
+    rows = [tuple(row) for row in result.all()]
+    archived = await archive.load(db, user, source_id, start, end)
+    keep = deadband.not_compressed_mask(compressed, archived.source_ids)
+    if keep.any():
+        timestamps = archived.micros[keep][:limit].astype("datetime64[us]").tolist()
+        rows = sorted(rows + list(zip(timestamps, archived.values[keep][:limit].tolist())))[:limit]
+    return [
+        {"timestamp": timestamp, "generated_energy": value, "min": value, "max": value, "count": 1}
+        for timestamp, value in rows
+    ]
+
+async def interpolated_points(db, source: models.EnergySource, start: int, end: int, limit: int):
+    # A deadband-compressed source rebuilt at its polling interval
+    times, values = await deadband.rebuilt(db, source, start, end)
+    micros = np.round(times[:limit] * 1_000_000).astype(np.int64).astype("datetime64[us]").tolist()
+    return [
+        {"timestamp": timestamp, "generated_energy": value, "min": value, "max": value, "count": 1}
+        for timestamp, value in zip(micros, values[:limit].tolist())
+    ]
+
+def merge(buckets: dict, key: int, count: int, total, low, high):
+    if key in buckets:
+        merged = buckets[key]
+        buckets[key] = (merged[0] + count, merged[1] + total, min(merged[2], low), max(merged[3], high))
+    else:
+        buckets[key] = (count, total, low, high)
+
+def merge_values(buckets: dict, keys: np.ndarray, values: np.ndarray):
+    if values.size:
+        grouped = rollups.group_reduce(keys[:, None], np.ones(len(values), dtype=np.int64), values, values, values)
+        for key, count, total, low, high in zip(grouped[0][:, 0].tolist(), *(column.tolist() for column in grouped[1:])):
+            merge(buckets, key, count, total, low, high)
+
+async def bucketed_points(db, user: models.User, source_id, plan: HistoryPlan, compressed: list = ()):
+    # Merges per-bucket count/sum/min/max across segments and archived readings;
+    # a bucket can straddle a raw edge and a rollup segment. Raw readings of the
+    # `compressed` sources are rebuilt first.
+    buckets = {}
+    rollup_filters = timeseries.reading_filters(user, source_id, models.EnergyRollup)
+    for tier, a, b in plan.segments:
+        if tier == "raw":
+            table = await partitions.readings_between(db, a, b)
+            value = table.c.generated_energy
+            index = table.c.ts // plan.bucket
+            query = select(index, func.count(value), func.sum(value), func.min(value), func.max(value)).where(
+                *timeseries.reading_filters(user, source_id, table.c), *timeseries.time_range(a, b, table.c), value.is_not(None),
+                *deadband.not_compressed(compressed, table.c)
+            ).group_by(index)
+            archived = await archive.load(db, user, source_id, a, b)
+            keep = deadband.not_compressed_mask(compressed, archived.source_ids)
+            merge_values(buckets, archived.micros[keep] // 1_000_000 // plan.bucket, archived.values[keep])
+            for source in compressed:
+                times, values = await deadband.rebuilt(db, source, a, b)
+                merge_values(buckets, times.astype(np.int64) // plan.bucket, values)
+        else:
+            index = models.EnergyRollup.bucket // plan.bucket
+            query = select(
+                index, func.sum(models.EnergyRollup.count), func.sum(models.EnergyRollup.sum),
+                func.min(models.EnergyRollup.min), func.max(models.EnergyRollup.max)
+            ).where(
+                *rollup_filters,
+                models.EnergyRollup.resolution == tier,
+                models.EnergyRollup.bucket >= a,
+                models.EnergyRollup.bucket < b
+            ).group_by(index)
+        for key, count, total, low, high in (await db.execute(query)).all():
+            merge(buckets, key, count, total, low, high)
+    return [point(key * plan.bucket, *buckets[key]) for key in sorted(buckets)]
+
+async def read_history(db, user: models.User, start: int, end: int, points: int, source_id: int = None) -> dict:
+    plan = await plan_history(db, user, start, end, points, source_id)
+    compressed = (await db.execute(deadband.compressed_query(user, source_id))).scalars().all()
+    if plan.bucket is None:
+        rows = await raw_points(db, user, source_id, start, end, points + 1, compressed)
+        for source in compressed:
+            rows = sorted(rows + await interpolated_points(db, source, start, end, points + 1), key=lambda row: row["timestamp"])[:points + 1]
+        if len(rows) > points:
+            # More readings than estimated, downsample the raw rows instead
+            plan = plan._replace(bucket=bucket_for(end - start, points))
+            logger.info(f"History [{start}, {end}) underestimated, bucketing raw rows by {plan.bucket}s")
+        else:
+            return history(start, end, plan, rows, bool(compressed))
+    return history(start, end, plan, await bucketed_points(db, user, source_id, plan, compressed), bool(compressed))
+
+def history(start: int, end: int, plan: HistoryPlan, points: list, interpolated: bool = False) -> dict:
+    return {
+        "start": timeseries.from_epoch(start),
+        "end": timeseries.from_epoch(end),
+        "bucket_seconds": plan.bucket,
+        "tier": plan.tier,
+        "estimated_rows": plan.estimated_rows,
+        "interpolated": interpolated,
+        "points": points,
+    }
@@ -0,0 +1,167 @@
+from sqlalchemy import insert
+from starlette.concurrency import run_in_threadpool
+from .. import metrics, models
+from . import adapters, deadband, latest, partitions, response_cache, rollups, timeseries, validation
+import json
+import logging
+import math
+import os
+import msgpack
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Push ingestion: readings arrive as a stream of NDJSON lines or concatenated
+# MessagePack maps, are validated a batch at a time and bulk-inserted, so memory
+# stays bounded by the batch size whatever the request size.
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+# A single NDJSON line or MessagePack object larger than this aborts the request
+MAX_RECORD_BYTES = int(os.getenv("INGEST_MAX_RECORD_BYTES", str(64 * 1024)))
+# Rejected records are counted, only the first few are described in the response
+MAX_REPORTED_ERRORS = 20
+
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+MSGPACK_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+
+class IngestError(Exception):
+    # The stream itself is unreadable, as opposed to one bad record
+    pass
+
+async def ndjson_items(chunks):
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > MAX_RECORD_BYTES:
+            raise IngestError(f"NDJSON line longer than {MAX_RECORD_BYTES} bytes")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+async def msgpack_items(chunks):
+    # The buffer holds at most one partial object plus the chunk just fed
+    unpacker = msgpack.Unpacker(raw=False, max_buffer_size=MAX_RECORD_BYTES + 1024 * 1024)
+    fed = 0
+    try:
+        async for chunk in chunks:
+            unpacker.feed(chunk)
+            fed += len(chunk)
+            for item in unpacker:
+                yield item
+    except (msgpack.BufferFull, msgpack.FormatError, msgpack.StackError, ValueError) as e:
+        raise IngestError(f"Invalid MessagePack stream: {e}")
+    if unpacker.tell() != fed:
+        raise IngestError("MessagePack stream ends mid-object")
+
+def parse_record(item):
+    # Structural parsing only, values and units are checked per batch in validation
+    if isinstance(item, bytes):
+        item = json.loads(item)
+    if not isinstance(item, dict):
+        raise ValueError("reading must be an object")
+    value = float(item["value"] if "value" in item else item["generated_energy"])
+    return adapters.parse_timestamp(item["timestamp"]), value, item.get("unit", "MWh")
+
+def validate_batch(items, first_number: int, source, result: dict):
+    fields = {"source_id": source.id, "user_id": source.user_id}
+    numbers, timestamps, values, units = [], [], [], []
+    quarantined, errors = [], []
+    for number, item in enumerate(items, first_number):
+        try:
+            timestamp, value, unit = parse_record(item)
+        except (KeyError, TypeError, ValueError, OverflowError) as e:
+            message = f"missing field {e}" if isinstance(e, KeyError) else str(e)
+            raw = item.decode(errors="replace") if isinstance(item, bytes) else repr(item)
+            quarantined.append({**fields, "reason": "malformed", "detail": message, "raw": raw[:1000]})
+            errors.append((number, message))
+            continue
+        numbers.append(number)
+        timestamps.append(timestamp)
+        values.append(value)
+        units.append(unit)
+
+    # The spec only accepts MWh, other units are rejected rather than converted
+    factors = [1.0 if unit == "MWh" else math.nan for unit in units]
+    checked = validation.validate(timestamps, values, factors, oldest=partitions.retention_cutoff())
+    rows, rejected = validation.partition(checked, timestamps, values, units, fields)
+    for index in np.flatnonzero(checked.reason != validation.ACCEPTED).tolist():
+        errors.append((numbers[index], validation.MESSAGES[validation.REASONS[checked.reason[index]]]))
+    quarantined.extend(rejected)
+    # Record number of each accepted reading, to report the ones found already stored
+    accepted = {timestamps[i]: numbers[i] for i in np.flatnonzero(checked.reason == validation.ACCEPTED).tolist()}
+    reject(quarantined, errors, result)
+    return rows, quarantined, accepted
+
+def reject(quarantined: list, errors: list, result: dict):
+    result["rejected"] += len(quarantined)
+    for number, message in sorted(errors)[:MAX_REPORTED_ERRORS - len(result["errors"])]:
+        result["errors"].append({"record": number, "error": message})
+    for row in quarantined:
+        metrics.INGEST_REJECTED.inc(source="push", reason=row["reason"])
+
+def already_stored(rows: list, numbers: dict, result: dict) -> list:
+    # Quarantine rows for readings the database already had for their source and
+    # second: a client retrying a batch whose response it lost, or overlapping pushes
+    quarantined = [{
+        "source_id": row["source_id"], "user_id": row["user_id"], "timestamp": row["timestamp"],
+        "value": row["generated_energy"], "unit": "MWh", "reason": "duplicate", "detail": validation.MESSAGES["duplicate"],
+    } for row in rows]
+    reject(quarantined, [(numbers.get(row["timestamp"], 0), validation.MESSAGES["duplicate"]) for row in rows], result)
+    return quarantined
+
+async def store_batch(db, source, items: list, first_number: int, result: dict):
+    received, quarantined, numbers = validate_batch(items, first_number, source, result)
+    rows = received
+    if source.deadband and received:
+        rows, state = deadband.compress(received, source.deadband, json.loads(source.deadband_state) if source.deadband_state else None)
+        source.deadband_state = json.dumps(state)
+        metrics.DEADBAND_DROPPED.inc(len(received) - len(rows), source="push")
+    if rows:
+        returned = (await db.execute(timeseries.insert_readings(db.bind.dialect.name), rows)).all()
+        rows, replayed = timeseries.split_inserted(rows, returned)
+        if replayed:
+            quarantined = quarantined + already_stored(replayed, numbers, result)
+            seen = {row["timestamp"] for row in replayed}
+            received = [row for row in received if row["timestamp"] not in seen]
+    if rows:
+        await db.execute(*rollups.mark_dirty(rows, deadband.DEADBAND_MAX_SECONDS if source.deadband else 0))
+    if received:
+        newest = max(row["timestamp"] for row in received)
+        if source.last_reading_at is None or newest > source.last_reading_at:
+            source.last_reading_at = newest
+    if quarantined:
+        await db.execute(insert(models.QuarantinedReading), quarantined)
+    if received or quarantined:
+        # Each batch is its own transaction, the response reports how many were stored
+        await db.commit()
+    # /current shows the reading the door holds back too
+    held = deadband.held_reading(source) if source.deadband else None
+    # Both wait on locks shared with other processes, off the event loop
+    await run_in_threadpool(latest.update, rows + ([held] if held else []))
+    await run_in_threadpool(response_cache.readings_stored, received, deadband.DEADBAND_MAX_SECONDS if source.deadband else 0)
+    result["accepted"] += len(received)
+    result["stored"] += len(rows)
+    metrics.INGEST_READINGS.inc(len(rows), source="push")
+
+async def ingest_stream(db, source, items) -> dict:
+    result = {"accepted": 0, "stored": 0, "rejected": 0, "errors": []}
+    batch = []
+    received = 0
+    try:
+        async for item in items:
+            batch.append(item)
+            if len(batch) >= INGEST_BATCH_SIZE:
+                await store_batch(db, source, batch, received + 1, result)
+                received += len(batch)
+                batch = []
+    except IngestError as e:
+        # Records decoded before the stream broke are still kept
+        result["error"] = str(e)
+    await store_batch(db, source, batch, received + 1, result)
+    if source.deadband:
+        result["compression_ratio"] = source.compression_ratio
+    logger.info(f"Ingested {result['accepted']} readings for source {source.id}, rejected {result['rejected']}")
+    return result
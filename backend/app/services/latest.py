@@ -0,0 +1,232 @@
+from multiprocessing import resource_tracker, shared_memory
+from sqlalchemy import and_, select, func
+from .. import database, metrics, models
+from . import deadband, timeseries
+import contextlib
+import datetime
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Newest stored reading per source, in a shared-memory table every process on
+# the host maps: API workers answer /current from it without a query, whichever
+# process stores readings (ingest route, scheduler, worker) updates it after
+# committing. Slot i holds source i; readings without a source have a slot per
+# user after the LATEST_SLOTS source slots, global ones the first of those. For a
+# deadband source the newest reading is the one its door holds back, without an id.
+#
+# Each slot has a sequence number (a seqlock): a writer makes it odd, writes the
+# fields, then makes it even again. Readers copy a user's slots without locking
+# and keep them if every number was even and unchanged around the copy, retrying
+# otherwise. Writers serialize on a lock of the segment: every process fills
+# the table when it attaches, while others may be writing the same slots.
+#
+# Which slots are a user's is kept per process (owners), rebuilt from the table
+# whenever the header's "assigned" count shows a slot was taken or changed user.
+#
+# The table outlives processes, and readings written around store_readings (bulk
+# loads, manual SQL) never reach it, so every process brings it up to date from
+# the database when it attaches. Until the first fill, and for ids past the
+# slots, readers fall back to the database. Filling never moves a slot back.
+
+LATEST_SLOTS = int(os.getenv("LATEST_SLOTS", "16384"))
+# Slots for readings without a source, by user id
+LATEST_USER_SLOTS = int(os.getenv("LATEST_USER_SLOTS", "16384"))
+# Defaults to a name derived from the database, so separate databases on one
+# host (tests, staging) never share a table. Unlink it after restoring a backup.
+LATEST_SHM_NAME = os.getenv("LATEST_SHM_NAME") or "energy_latest_" + hashlib.sha1(database.SQLALCHEMY_DATABASE_URL.encode()).hexdigest()[:12]
+LATEST_READ_RETRIES = 3
+NO_ID = -1
+
+HEADER = np.dtype([("slots", "<i8"), ("sources", "<i8"), ("ready", "<i8"), ("overflow", "<i8"), ("assigned", "<i8")])
+SLOT = np.dtype([
+    ("seq", "<u8"), ("id", "<i8"), ("user_id", "<i8"), ("micros", "<i8"),
+    ("value", "<f8"), ("is_outlier", "<i8"),
+])
+
+memory = None
+header = None
+slots = None
+write_lock = threading.Lock()
+# user id (NO_ID: readings everyone sees) -> indexes of their slots, as of header["assigned"] == indexed
+by_user = {}
+indexed = None
+
+def map_shared(name: str, size: int):
+    # (segment, whether this call created it), for tables shared by every process
+    # on the host. Raises OSError when shared memory is unavailable.
+    try:
+        segment = shared_memory.SharedMemory(name, create=True, size=size)
+        created = True
+    except FileExistsError:
+        segment = shared_memory.SharedMemory(name)
+        created = False
+    # The segment outlives every process; Python < 3.13 would unlink it when the
+    # first of them exits
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment, created
+
+def attach(warm: bool = True) -> bool:
+    # Maps the table, creating it if this is the first process to get here, and
+    # fills it from the database. Called at startup; False if shared memory is
+    # unavailable, reads then always go to the database.
+    global memory, header, slots
+    if slots is not None:
+        return True
+    try:
+        memory, created = map_shared(LATEST_SHM_NAME, HEADER.itemsize + (LATEST_SLOTS + LATEST_USER_SLOTS) * SLOT.itemsize)
+    except OSError as e:
+        logger.warning(f"Latest readings table unavailable, /current reads the database: {e}")
+        return False
+    header = np.ndarray((), HEADER, buffer=memory.buf)
+    if created:
+        header["slots"] = LATEST_SLOTS + LATEST_USER_SLOTS
+        header["sources"] = LATEST_SLOTS
+    slots = np.ndarray((int(header["slots"]),), SLOT, buffer=memory.buf, offset=HEADER.itemsize)
+    if warm:
+        fill()
+    return True
+
+def detach():
+    global memory, header, slots, by_user, indexed
+    if memory is not None:
+        header = slots = None
+        by_user, indexed = {}, None
+        memory.close()
+        memory = None
+
+def fill():
+    # Newest reading of every source, and of every user's readings without one,
+    # from energy_data only: sealed partitions only hold fully rolled-up months
+    data = models.EnergyData
+    db = database.SessionLocal()
+    try:
+        newest = select(data.source_id, data.user_id, func.max(data.ts).label("ts")).group_by(data.source_id, data.user_id).subquery()
+        rows = db.execute(select(data.id, data.source_id, data.user_id, data.timestamp, data.generated_energy, data.is_outlier).join(newest, and_(
+            data.ts == newest.c.ts, data.source_id.is_not_distinct_from(newest.c.source_id), data.user_id.is_not_distinct_from(newest.c.user_id)
+        ))).mappings().all()
+        held = [deadband.held_reading(source) for source in db.execute(deadband.compressed_query()).scalars()]
+    finally:
+        db.close()
+    rows = [dict(row) for row in rows] + [row for row in held if row]
+    update(rows)
+    header["ready"] = 1
+    logger.info(f"Latest readings table {LATEST_SHM_NAME} filled with {len(rows)} readings")
+
+def attached() -> bool:
+    return slots is not None
+
+def slot(source_id, user_id):
+    # Index of the slot for a reading, None past the end of its part of the table
+    sources = int(header["sources"])
+    if source_id is not None:
+        return source_id if source_id < sources else None
+    index = sources + (user_id or 0)
+    return index if index < len(slots) else None
+
+def newest(rows) -> dict:
+    # slot index -> newest of `rows`
+    found = {}
+    for row in rows:
+        index = slot(row.get("source_id"), row.get("user_id"))
+        if index not in found or row["timestamp"] > found[index]["timestamp"]:
+            found[index] = row
+    return found
+
+@contextlib.contextmanager
+def writing():
+    with write_lock:
+        fcntl.flock(memory._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(memory._fd, fcntl.LOCK_UN)
+
+def update(rows):
+    # rows: stored readings with their ids. Slots only move forward in time.
+    if slots is None:
+        return
+    with writing():
+        for index, row in newest(rows).items():
+            if index is None:
+                header["overflow"] = 1
+                continue
+            micros = int(np.datetime64(row["timestamp"], "us").astype(np.int64))
+            if slots["seq"][index] and micros < slots["micros"][index]:
+                continue
+            user_id = NO_ID if row.get("user_id") is None else row["user_id"]
+            assigned = not slots["seq"][index] or slots["user_id"][index] != user_id
+            slots["seq"][index] += 1
+            slots["id"][index] = NO_ID if row["id"] is None else row["id"]
+            slots["user_id"][index] = user_id
+            slots["micros"][index] = micros
+            slots["value"][index] = row["generated_energy"]
+            slots["is_outlier"][index] = bool(row.get("is_outlier"))
+            slots["seq"][index] += 1
+            if assigned:
+                header["assigned"] += 1
+
+def ready() -> bool:
+    return slots is not None and bool(header["ready"]) and not header["overflow"]
+
+def owners() -> dict:
+    # The index of slots by user, rebuilt when a slot was assigned since. A slot
+    # assigned while this scans bumps the count again, so the next read rebuilds.
+    global by_user, indexed
+    assigned = int(header["assigned"])
+    if assigned != indexed:
+        used = np.flatnonzero(slots["seq"] > 0)
+        users = slots["user_id"][used]
+        order = np.argsort(users, kind="stable")
+        ids, starts = np.unique(users[order], return_index=True)
+        by_user = dict(zip(ids.tolist(), np.split(used[order], starts[1:])))
+        indexed = assigned
+    return by_user
+
+def read(user_id: int):
+    # (True, the newest reading visible to the user or None) from the table, or
+    # (False, None) when the database has to answer
+    if not ready():
+        metrics.LATEST_READS.inc(outcome="database")
+        return False, None
+    empty = np.empty(0, dtype=np.int64)
+    for _ in range(LATEST_READ_RETRIES):
+        owned = owners()
+        candidates = np.concatenate([owned.get(user_id, empty), owned.get(NO_ID, empty)])
+        before = slots["seq"][candidates]
+        copy = slots[candidates]
+        if np.any(before % 2) or not np.array_equal(before, slots["seq"][candidates]) or header["assigned"] != indexed:
+            continue
+        metrics.LATEST_READS.inc(outcome="shared")
+        visible = (copy["user_id"] == user_id) | (copy["user_id"] == NO_ID)
+        if not visible.any():
+            return True, None
+        found = np.flatnonzero(visible)[np.argmax(copy["micros"][visible])]
+        slot, index = copy[found], candidates[found]
+        return True, models.EnergyData(
+            id=None if slot["id"] == NO_ID else int(slot["id"]),
+            timestamp=datetime.datetime(1970, 1, 1) + datetime.timedelta(microseconds=int(slot["micros"])),
+            generated_energy=float(slot["value"]),
+            user_id=None if slot["user_id"] == NO_ID else int(slot["user_id"]),
+            source_id=int(index) if index < header["sources"] else None,
+            is_outlier=bool(slot["is_outlier"]),
+        )
+    metrics.LATEST_READS.inc(outcome="database")
+    return False, None
+
+async def reading(db, user: models.User):
+    # timeseries.latest_reading or a newer held reading, from the table when it can answer
+    found, row = read(user.id)
+    if found:
+        return row
+    row = await timeseries.latest_reading(db, user)
+    held = [deadband.held_reading(source) for source in (await db.execute(deadband.compressed_query(user))).scalars()]
+    held = max((reading for reading in held if reading), key=lambda reading: reading["timestamp"], default=None)
+    if held and (row is None or held["timestamp"] > row.timestamp):
+        return models.EnergyData(**held)
+    return row
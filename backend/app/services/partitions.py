@@ -0,0 +1,257 @@
+from sqlalchemy import Column, Index, MetaData, Table, select, insert, delete, func, or_, text, union_all
+from .. import database, metrics, models
+from ..query_tracking import track_queries
+from . import timeseries
+import calendar
+import datetime
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Monthly partitions of energy_data. On PostgreSQL energy_data is partitioned by
+# range of ts, one partition per month: the migration copies an existing table
+# into them, and partitions are created ahead of time. A DEFAULT partition
+# catches readings for months without one; creating the month's partition later
+# moves them over. SQLite has no partitioning, so energy_data keeps the open
+# months and every month that is fully rolled up is sealed, once, into its own
+# energy_data_YYYYMM table. While that month is most of energy_data (sealing
+# keeps up) energy_data itself is renamed and only the other months' rows are
+# copied into a fresh one. Readings arriving for a month after it was sealed
+# stay in energy_data. Time-range reads union in the sealed tables overlapping
+# the range. On both, retention drops whole expired partitions once rolled up,
+# and only DELETEs the few late readings left outside them.
+
+# Raw readings older than this are dropped, their rollups are kept. 0 keeps them forever.
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "0"))
+PARTITION_INTERVAL_SECONDS = int(os.getenv("PARTITION_INTERVAL_SECONDS", "3600"))
+# Monthly partitions created ahead of the current month on PostgreSQL
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "2"))
+DEFAULT_PARTITION = "energy_data_default"
+# energy_data while the migration copies it into monthly partitions
+UNPARTITIONED = "energy_data_unpartitioned"
+
+def month_start(seconds: int) -> int:
+    day = timeseries.from_epoch(seconds)
+    return calendar.timegm((day.year, day.month, 1, 0, 0, 0))
+
+def next_month(seconds: int) -> int:
+    day = timeseries.from_epoch(seconds)
+    return calendar.timegm((day.year + day.month // 12, day.month % 12 + 1, 1, 0, 0, 0))
+
+def partition_name(start: int) -> str:
+    return f"energy_data_{timeseries.from_epoch(start):%Y%m}"
+
+def retention_cutoff(now: float = None):
+    # Readings before this are past retention, None when retention is off
+    if not RAW_RETENTION_DAYS:
+        return None
+    return timeseries.from_epoch(int(time.time() if now is None else now)) - datetime.timedelta(days=RAW_RETENTION_DAYS)
+
+# Sealed SQLite partitions, defined on demand from the catalog
+sealed_metadata = MetaData()
+
+def partition_table(name: str) -> Table:
+    # Same columns and indexes as energy_data, without keys: SQLite hands the ids
+    # of rows moved out of energy_data to new readings, so ids are not unique here
+    if name in sealed_metadata.tables:
+        return sealed_metadata.tables[name]
+    head = models.EnergyData.__table__
+    table = Table(name, sealed_metadata, *(Column(column.name, column.type) for column in head.columns))
+    for index in head.indexes:
+        Index(index.name.replace(head.name, name, 1), *(table.c[column.name] for column in index.columns), unique=index.unique)
+    return table
+
+def sealed_query(start: int, end: int):
+    return select(models.EnergyPartition.name).where(
+        models.EnergyPartition.native == False,
+        models.EnergyPartition.period_start < end,
+        models.EnergyPartition.period_end > start
+    ).order_by(models.EnergyPartition.period_start)
+
+def readings(names, start: int, end: int):
+    # energy_data alone, or energy_data and the named sealed tables as one
+    # subquery with the same columns, each part already limited to [start, end)
+    head = models.EnergyData.__table__
+    if not names:
+        return head
+    parts = [head] + [partition_table(name) for name in names]
+    return union_all(*(select(*part.c).where(*timeseries.time_range(start, end, part.c)) for part in parts)).subquery("readings")
+
+async def readings_between(db, start: int, end: int):
+    return readings((await db.execute(sealed_query(start, end))).scalars().all(), start, end)
+
+def setup(engine):
+    # Run by migrations.upgrade. Returns the metadata of the sealed SQLite
+    # partitions, so new energy_data columns and indexes are added to them too.
+    if engine.dialect.name == "postgresql":
+        partition_natively(engine)
+        with engine.begin() as conn:
+            split_default(conn)
+    with engine.connect() as conn:
+        for name in conn.execute(select(models.EnergyPartition.name).where(models.EnergyPartition.native == False)).scalars():
+            partition_table(name)
+    return sealed_metadata
+
+def partition_natively(engine):
+    # One-off conversion of a plain energy_data table into a partitioned one:
+    # every month it holds is copied into its own partition, then it is dropped.
+    # Its foreign keys go with it, partitions have none.
+    head = models.EnergyData.__table__
+    with engine.begin() as conn:
+        kind = conn.scalar(text(
+            "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relname = 'energy_data' AND n.nspname = current_schema()"
+        ))
+        if kind != "r":
+            return
+        conn.execute(text(f"ALTER TABLE energy_data RENAME TO {UNPARTITIONED}"))
+        for index in head.indexes:
+            conn.execute(text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name.replace(head.name, UNPARTITIONED, 1)}"))
+        conn.execute(text(f"ALTER TABLE {UNPARTITIONED} DROP CONSTRAINT IF EXISTS energy_data_pkey"))
+        # The partition key has to be part of the primary key
+        conn.execute(text(f"ALTER TABLE {UNPARTITIONED} ALTER COLUMN ts SET NOT NULL"))
+        conn.execute(text(f"CREATE TABLE energy_data (LIKE {UNPARTITIONED} INCLUDING DEFAULTS) PARTITION BY RANGE (ts)"))
+        conn.execute(text("ALTER TABLE energy_data ADD PRIMARY KEY (id, ts)"))
+        conn.execute(text("ALTER SEQUENCE energy_data_id_seq OWNED BY energy_data.id"))
+        for index in head.indexes:
+            index.create(conn)
+        conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF energy_data DEFAULT"))
+        oldest, newest = conn.execute(text(f"SELECT MIN(ts), MAX(ts) FROM {UNPARTITIONED}")).one()
+        start = month_start(oldest) if oldest is not None else None
+        while start is not None and start <= newest:
+            end = next_month(start)
+            name = partition_name(start)
+            conn.execute(text(f"CREATE TABLE {name} PARTITION OF energy_data FOR VALUES FROM ({start}) TO ({end})"))
+            conn.execute(text(f"INSERT INTO {name} SELECT * FROM {UNPARTITIONED} WHERE ts >= {start} AND ts < {end}"))
+            conn.execute(insert(models.EnergyPartition).values(name=name, period_start=start, period_end=end, native=True))
+            start = end
+        conn.execute(text(f"DROP TABLE {UNPARTITIONED}"))
+    logger.info("Partitioned energy_data by month")
+
+def split_default(conn, months=None):
+    # Gives each month the DEFAULT partition holds readings for (or each of
+    # `months`, as start epochs) its own partition, moving those readings over.
+    # The default only holds readings that arrived before their month's partition.
+    if months is None:
+        months = sorted({month_start(ts) for ts in conn.execute(text(
+            f"SELECT DISTINCT ts / 86400 * 86400 FROM {DEFAULT_PARTITION}"
+        )).scalars()})
+    for start in months:
+        end = next_month(start)
+        name = partition_name(start)
+        in_month = f"ts >= {start} AND ts < {end}"
+        conn.execute(text(f"CREATE TABLE {name} (LIKE energy_data INCLUDING DEFAULTS)"))
+        conn.execute(text(f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_month}"))
+        conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_month}"))
+        conn.execute(text(f"ALTER TABLE energy_data ATTACH PARTITION {name} FOR VALUES FROM ({start}) TO ({end})"))
+        conn.execute(insert(models.EnergyPartition).values(name=name, period_start=start, period_end=end, native=True))
+        logger.info(f"Created partition {name}")
+
+def rolled_up_until(db) -> int:
+    # Every rollup resolution is complete before this epoch second
+    return db.scalar(select(func.min(models.RollupState.closed_until))) or 0
+
+def create_ahead(db, now: int):
+    # Current and coming months, moving over readings the DEFAULT partition got for them
+    start = month_start(now)
+    months = []
+    for _ in range(PARTITION_PREMAKE_MONTHS + 1):
+        if db.get(models.EnergyPartition, partition_name(start)) is None:
+            months.append(start)
+        start = next_month(start)
+    if months:
+        split_default(db.connection(), months)
+        db.commit()
+
+def seal(db, start: int, end: int) -> int:
+    # Seals one month of energy_data into its own table
+    name = partition_name(start)
+    head = models.EnergyData.__table__
+    in_month = timeseries.time_range(start, end, head.c)
+    moved = db.scalar(select(func.count()).select_from(head).where(*in_month))
+    kept = db.scalar(select(func.count()).select_from(head).where(outside(start, end, head.c)))
+    if kept < moved:
+        rotate(db, start, end)
+    else:
+        table = partition_table(name)
+        table.create(db.connection())
+        db.execute(insert(table).from_select([column.name for column in head.columns], select(*head.c).where(*in_month)))
+        db.execute(delete(head).where(*in_month))
+    db.add(models.EnergyPartition(name=name, period_start=start, period_end=end, native=False))
+    db.commit()
+    logger.info(f"Sealed {moved} readings into {name}")
+    return moved
+
+def outside(start: int, end: int, table):
+    return or_(table.ts < start, table.ts >= end, table.ts.is_(None))
+
+def rotate(db, start: int, end: int):
+    # energy_data becomes the sealed table and a fresh energy_data gets back the
+    # readings of other months, so only those are copied
+    conn = db.connection()
+    head = models.EnergyData.__table__
+    table = partition_table(partition_name(start))
+    conn.execute(text(f"ALTER TABLE {head.name} RENAME TO {table.name}"))
+    # SQLite index names are per database, the renamed table keeps its old ones
+    for index in head.indexes:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    head.create(conn)
+    columns = [column.name for column in head.columns]
+    conn.execute(insert(head).from_select(columns, select(*(table.c[column] for column in columns)).where(outside(start, end, table.c))))
+    conn.execute(delete(table).where(outside(start, end, table.c)))
+    for index in table.indexes:
+        index.create(conn)
+
+def seal_closed(db, closed: int):
+    # Oldest month after the sealed ones first. Readings that arrive for a sealed
+    # month stay in energy_data instead of reopening its table.
+    while True:
+        sealed_until = db.scalar(select(func.max(models.EnergyPartition.period_end))) or 0
+        oldest = db.scalar(select(func.min(models.EnergyData.ts)).where(models.EnergyData.ts >= sealed_until))
+        if oldest is None:
+            return
+        start = month_start(oldest)
+        if next_month(start) > closed:
+            return
+        seal(db, start, next_month(start))
+
+def drop_expired(db, now: int, closed: int):
+    cutoff = retention_cutoff(now)
+    if cutoff is None:
+        return
+    horizon = min(timeseries.to_epoch(cutoff), closed)
+    expired = db.execute(select(models.EnergyPartition).where(models.EnergyPartition.period_end <= horizon)).scalars().all()
+    for partition in expired:
+        drop_partition(db, partition)
+        logger.info(f"Dropped expired partition {partition.name}")
+    # Late readings of dropped months, in energy_data or the DEFAULT partition
+    late = db.execute(delete(models.EnergyData).where(models.EnergyData.ts < month_start(horizon))).rowcount
+    db.commit()
+    if late:
+        logger.info(f"Dropped {late} expired late readings")
+
+def drop_partition(db, partition: models.EnergyPartition):
+    # Commits, together with whatever else the session holds
+    if partition.native:
+        db.execute(text(f"ALTER TABLE energy_data DETACH PARTITION {partition.name}"))
+    db.execute(text(f"DROP TABLE IF EXISTS {partition.name}"))
+    db.delete(partition)
+    db.commit()
+    if partition.name in sealed_metadata.tables:
+        sealed_metadata.remove(sealed_metadata.tables[partition.name])
+
+def maintain(now: float = None):
+    with metrics.JOB_DURATION.time(job="maintain_partitions"), track_queries("job", "maintain_partitions"):
+        now = int(time.time() if now is None else now)
+        db = database.SessionLocal()
+        try:
+            closed = rolled_up_until(db)
+            if db.bind.dialect.name == "postgresql":
+                create_ahead(db, now)
+            else:
+                seal_closed(db, closed)
+            drop_expired(db, now, closed)
+        finally:
+            db.close()
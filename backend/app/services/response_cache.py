@@ -0,0 +1,221 @@
+from collections import OrderedDict, deque, namedtuple
+from fastapi import Response
+from .. import metrics
+from . import coalesce, latest, timeseries
+import datetime
+import fcntl
+import logging
+import os
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Cache of serialized /history and /stats responses. An entry is never expired by
+# time: it is dropped when stored readings change inside the window it covers,
+# so windows that ended long ago stay cached until evicted, and windows still
+# open are dropped as soon as a reading for one of their sources is committed.
+# Least recently used entries are evicted past RESPONSE_CACHE_MAX_BYTES.
+#
+# Every process storing readings announces the source and time range it wrote
+# in a shared-memory ring (see latest.map_shared), and every process drops its
+# own overlapping entries when it next looks at the cache. A process that falls
+# more than a ring behind clears its cache. Without the ring a process could not
+# see other processes' writes, so it caches nothing.
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_LOG_SIZE = int(os.getenv("RESPONSE_CACHE_LOG_SIZE", "4096"))
+RESPONSE_CACHE_SHM_NAME = os.getenv("RESPONSE_CACHE_SHM_NAME") or latest.LATEST_SHM_NAME.replace("energy_latest_", "energy_changes_", 1)
+# Key and bookkeeping per entry, on top of the body
+ENTRY_OVERHEAD = 256
+# Invalidations kept to check entries computed while they happened
+RECENT_CHANGES = 1024
+# Windows without an end given end at the next multiple of this, so repeated
+# requests share an entry
+OPEN_END_SECONDS = 60
+NO_ID = -1
+
+# Readings changed in [start, end) epoch seconds: of one source (or of none,
+# NO_ID) belonging to one user (or global, NO_ID)
+Change = namedtuple("Change", ["source_id", "user_id", "start", "end"])
+# What an entry depends on; source_id None is every source visible to the user
+Scope = namedtuple("Scope", ["user_id", "source_id", "start", "end"])
+
+CHANGE = np.dtype([("seq", "<u8"), ("source_id", "<i8"), ("user_id", "<i8"), ("start", "<i8"), ("end", "<i8")])
+
+entries = OrderedDict() # key -> (scope, body)
+size = 0
+# Keys of entries for one source, and of entries over all of a user's sources
+by_source = {}
+by_user = {}
+# Changes applied to this process's cache so far, and the latest of them
+generation = 0
+recent = deque(maxlen=RECENT_CHANGES)
+
+memory = None
+head = None
+ring = None
+cursor = 0
+# The segment lock only excludes other processes
+publish_lock = threading.Lock()
+
+def attach() -> bool:
+    global memory, head, ring, cursor
+    if ring is not None:
+        return True
+    try:
+        memory, created = latest.map_shared(RESPONSE_CACHE_SHM_NAME, 8 + RESPONSE_CACHE_LOG_SIZE * CHANGE.itemsize)
+    except OSError as e:
+        logger.warning(f"Shared change log unavailable, responses are not cached: {e}")
+        return False
+    head = np.ndarray((1,), "<u8", buffer=memory.buf)
+    ring = np.ndarray((RESPONSE_CACHE_LOG_SIZE,), CHANGE, buffer=memory.buf, offset=8)
+    cursor = int(head[0])
+    return True
+
+def detach():
+    global memory, head, ring
+    if memory is not None:
+        head = ring = None
+        memory.close()
+        memory = None
+    clear()
+
+def clear():
+    global size
+    entries.clear()
+    by_source.clear()
+    by_user.clear()
+    size = 0
+
+def lost_track():
+    # Changes were missed: nothing cached, or being computed, can be trusted
+    global generation
+    generation += 1
+    recent.clear()
+    clear()
+
+def add(key: tuple, scope: Scope, body: bytes):
+    global size
+    entries[key] = (scope, body)
+    size += len(body) + ENTRY_OVERHEAD
+    if scope.source_id is not None:
+        by_source.setdefault(scope.source_id, set()).add(key)
+    else:
+        by_user.setdefault(scope.user_id, set()).add(key)
+
+def drop(key: tuple):
+    global size
+    scope, body = entries.pop(key)
+    size -= len(body) + ENTRY_OVERHEAD
+    index, group = (by_source, scope.source_id) if scope.source_id is not None else (by_user, scope.user_id)
+    index[group].discard(key)
+    if not index[group]:
+        del index[group]
+
+def affects(change: Change, scope: Scope) -> bool:
+    if change.start >= scope.end or scope.start >= change.end:
+        return False
+    if scope.source_id is not None:
+        return change.source_id == scope.source_id
+    return change.user_id in (scope.user_id, NO_ID)
+
+def apply(change: Change):
+    global generation
+    generation += 1
+    recent.append((generation, change))
+    candidates = set(by_source.get(change.source_id, ()))
+    # Global readings are visible to every user
+    for keys in (by_user.values() if change.user_id == NO_ID else [by_user.get(change.user_id, ())]):
+        candidates.update(keys)
+    for key in candidates:
+        if affects(change, entries[key][0]):
+            drop(key)
+
+def catch_up():
+    # Applies the changes processes logged since the last look
+    global cursor
+    if ring is None:
+        return
+    end = int(head[0])
+    if end - cursor > len(ring):
+        cursor = end
+        lost_track()
+        return
+    for position in range(cursor, end):
+        record = ring[position % len(ring)].copy()
+        if record["seq"] != 2 * position + 2 or ring["seq"][position % len(ring)] != record["seq"]:
+            # Overwritten while we read it: we fell a whole ring behind
+            cursor = end
+            lost_track()
+            return
+        apply(Change(int(record["source_id"]), int(record["user_id"]), int(record["start"]), int(record["end"])))
+    cursor = end
+
+def publish(change: Change):
+    # Appends to the shared ring, writers in turn through a lock of the segment.
+    # Entries are written like latest.py's slots: odd sequence number while in
+    # progress. Blocks while another writer holds the lock, so async writers call
+    # readings_stored in a thread.
+    with publish_lock:
+        fcntl.flock(memory._fd, fcntl.LOCK_EX)
+        try:
+            position = int(head[0])
+            index = position % len(ring)
+            ring["seq"][index] = 2 * position + 1
+            ring["source_id"][index], ring["user_id"][index] = change.source_id, change.user_id
+            ring["start"][index], ring["end"][index] = change.start, change.end
+            ring["seq"][index] = 2 * position + 2
+            head[0] = position + 1
+        finally:
+            fcntl.flock(memory._fd, fcntl.LOCK_UN)
+
+def readings_stored(rows, lookback: int = 0):
+    # Called by writers after committing `rows`. lookback widens the changed
+    # range backwards, for reads interpolating from before the first row.
+    ranges = {}
+    for row in rows:
+        key = (NO_ID if row.get("source_id") is None else row["source_id"], NO_ID if row.get("user_id") is None else row["user_id"])
+        seconds = timeseries.to_epoch(row["timestamp"])
+        low, high = ranges.get(key, (seconds, seconds))
+        ranges[key] = (min(low, seconds), max(high, seconds))
+    if ring is None:
+        return
+    for (source_id, user_id), (low, high) in ranges.items():
+        publish(Change(source_id, user_id, low - lookback, high + 1))
+
+def open_end() -> datetime.datetime:
+    # End of a window without one given: now, rounded up to OPEN_END_SECONDS
+    now = timeseries.to_epoch(datetime.datetime.utcnow())
+    return timeseries.from_epoch(-(-now // OPEN_END_SECONDS) * OPEN_END_SECONDS)
+
+async def cached(key: tuple, scope: Scope, model, compute) -> Response:
+    # Like coalesce.shared, serving and filling the cache
+    if ring is None:
+        return await coalesce.shared(key, model, compute)
+    catch_up()
+    body = entries.get(key, (None, None))[1]
+    if body is not None:
+        entries.move_to_end(key)
+        metrics.RESPONSE_CACHE_REQUESTS.inc(route=key[0], outcome="hit")
+        return Response(content=body, media_type="application/json")
+    metrics.RESPONSE_CACHE_REQUESTS.inc(route=key[0], outcome="miss")
+    started = []
+
+    async def run():
+        started.append(generation)
+        return await compute()
+
+    def keep(body: bytes):
+        catch_up()
+        # Not kept if readings in the window changed while it was computed
+        changed = generation - started[0] > len(recent) or any(
+            affects(change, scope) for number, change in recent if number > started[0]
+        )
+        if not changed and key not in entries:
+            add(key, scope, body)
+            while size > RESPONSE_CACHE_MAX_BYTES and entries:
+                drop(next(iter(entries)))
+        metrics.RESPONSE_CACHE_BYTES.set(size)
+
+    return await coalesce.shared(key, model, run, keep)
@@ -0,0 +1,329 @@
+from sqlalchemy import Integer, bindparam, select, delete, insert, update, func
+from .. import database, metrics, models
+from ..query_tracking import track_queries
+from . import archive, deadband, partitions, sketch, timeseries
+import logging
+import os
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Pre-aggregated energy_data per (user, source, bucket): count, sum, min, max and a
+# quantile sketch. Hourly rollups are built from raw rows, daily ones from hourly.
+# Deadband-compressed sources are rolled up from their rebuilt readings.
+# rollup_state.closed_until marks how far each resolution is complete. A write
+# reaching back before it records the range per (user, source) in rollup_dirty
+# (mark_dirty), and compute_rollups rebuilds the closed buckets of that group
+# only; reads of the group use raw rows for the range until then.
+#
+# A rollup run claims a range (claimed_until) before reading its raw rows, so a
+# write either lands before the claim and is read, or sees the claim and records
+# its range. On PostgreSQL the write holds a share lock on the hourly state row
+# until it commits, which the claim waits for.
+
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = (HOUR, DAY)
+# Readings may arrive this late before their bucket is rolled up
+ROLLUP_DELAY_SECONDS = int(os.getenv("ROLLUP_DELAY_SECONDS", "300"))
+ROLLUP_INTERVAL_SECONDS = int(os.getenv("ROLLUP_INTERVAL_SECONDS", "300"))
+# Buckets rebuilt per transaction, and raw rows fetched per round trip
+ROLLUP_CHUNK_BUCKETS = int(os.getenv("ROLLUP_CHUNK_BUCKETS", "24"))
+ROLLUP_FETCH_ROWS = int(os.getenv("ROLLUP_FETCH_ROWS", "100000"))
+# rollup_dirty records rebuilt per transaction
+ROLLUP_DIRTY_BATCH = int(os.getenv("ROLLUP_DIRTY_BATCH", "1000"))
+# Stand-in for NULL user or source ids in NumPy group keys
+NO_ID = -1
+
+def unique_rows(keys: np.ndarray):
+    # np.unique(keys, axis=0, return_inverse=True), but by factorizing each column
+    # and combining them into one flat code, much faster than sorting whole rows
+    codes, uniques = [], []
+    for column in keys.T:
+        values, code = np.unique(column, return_inverse=True)
+        uniques.append(values)
+        codes.append(code.ravel())
+    flat, inverse = np.unique(np.ravel_multi_index(codes, [len(values) for values in uniques]), return_inverse=True)
+    positions = np.unravel_index(flat, [len(values) for values in uniques])
+    return np.column_stack([values[position] for values, position in zip(uniques, positions)]), inverse.ravel()
+
+def group_reduce(keys: np.ndarray, counts, sums, mins, maxs):
+    groups, inverse = unique_rows(keys)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+    return (
+        groups,
+        np.add.reduceat(counts[order], starts),
+        np.add.reduceat(sums[order], starts),
+        np.minimum.reduceat(mins[order], starts),
+        np.maximum.reduceat(maxs[order], starts),
+    )
+
+class Accumulator:
+    # Collects partial per-group stats and sketch bin counts, keyed by rows of
+    # int64 group keys, and reduces them once at the end
+
+    def __init__(self):
+        self.stats = []
+        self.bins = []
+
+    def add_values(self, keys: np.ndarray, values: np.ndarray):
+        if not len(values):
+            return
+        ones = np.ones(len(values), dtype=np.int64)
+        self.stats.append(group_reduce(keys, ones, values, values, values))
+        binned, inverse = unique_rows(np.column_stack([keys, sketch.bins(values)]))
+        self.bins.append((binned, np.bincount(inverse)))
+
+    def add_stats(self, keys, counts, sums, mins, maxs):
+        self.stats.append((keys, counts, sums, mins, maxs))
+
+    def add_sketch(self, keys: np.ndarray, blobs: list):
+        for key, blob in zip(keys, blobs):
+            index, counts = sketch.decode(blob)
+            self.bins.append((np.column_stack([np.tile(key, (len(index), 1)), index]), counts))
+
+    def result(self) -> dict:
+        # {group key tuple: {"count", "sum", "min", "max", "bins", "bin_counts"}}
+        if not self.stats:
+            return {}
+        groups, counts, sums, mins, maxs = group_reduce(*(np.concatenate(column) for column in zip(*self.stats)))
+        groups_out = {
+            tuple(key): {"count": int(count), "sum": float(total), "min": float(low), "max": float(high), "bins": [], "bin_counts": []}
+            for key, count, total, low, high in zip(groups.tolist(), counts.tolist(), sums.tolist(), mins.tolist(), maxs.tolist())
+        }
+        if self.bins:
+            binned = np.concatenate([keys for keys, _ in self.bins])
+            bin_counts = np.concatenate([counts for _, counts in self.bins])
+            binned, inverse = unique_rows(binned)
+            bin_counts = np.bincount(inverse, weights=bin_counts).astype(np.int64)
+            width = binned.shape[1] - 1
+            boundaries = np.flatnonzero(np.any(np.diff(binned[:, :width], axis=0) != 0, axis=1)) + 1
+            for rows in np.split(np.arange(len(binned)), boundaries):
+                group = groups_out[tuple(binned[rows[0], :width].tolist())]
+                group["bins"] = binned[rows, width]
+                group["bin_counts"] = bin_counts[rows]
+        return groups_out
+
+def as_array(rows) -> np.ndarray:
+    # Result rows to a 2-D float array (NULL becomes NaN). Going through plain
+    # columns avoids NumPy probing each Row object, which is far slower.
+    return np.column_stack([np.array(column, dtype=np.float64) for column in zip(*rows)])
+
+def mark_dirty_statement():
+    # Built once: it only varies by its parameters. Core tables, the ORM's session
+    # synchronisation has no loaded state to fix up.
+    state = models.RollupState.__table__.c
+    claimed = select(func.coalesce(state.claimed_until, state.closed_until).label("until")).where(
+        state.resolution == HOUR
+    ).with_for_update(read=True).cte("claimed")
+    columns = [bindparam(name, type_=Integer) for name in ("user_id", "source_id", "start", "end")]
+    return insert(models.RollupDirty.__table__).from_select(
+        ["user_id", "source_id", "period_start", "period_end"],
+        select(*columns).select_from(claimed).where(claimed.c.until > bindparam("start", type_=Integer))
+    )
+
+MARK_DIRTY = mark_dirty_statement()
+
+def mark_dirty(rows: list, deadband_seconds: int = 0):
+    # (statement, parameters) recording the time range the stored `rows` cover per
+    # (user, source), for those reaching back into claimed rollups; run in the same
+    # transaction as the write. On-time readings record nothing. A point stored for
+    # a deadband source also reshapes the rebuilt readings `deadband_seconds` around it.
+    ranges = {}
+    for row in rows:
+        key = (row.get("user_id"), row.get("source_id"))
+        ts = timeseries.to_epoch(row["timestamp"])
+        low, high = ranges.get(key, (ts, ts))
+        ranges[key] = (min(low, ts), max(high, ts))
+    parameters = [
+        {"user_id": user_id, "source_id": source_id, "start": low - deadband_seconds, "end": high + deadband_seconds + 1}
+        for (user_id, source_id), (low, high) in ranges.items()
+    ]
+    return MARK_DIRTY, parameters
+
+def group_filters(key, table) -> list:
+    # Rows of one (user id, source id) group, NO_ID standing for NULL; all rows for None
+    if key is None:
+        return []
+    user_id, source_id = key
+    if source_id != NO_ID:
+        return [table.source_id == source_id]
+    return [table.source_id.is_(None), table.user_id.is_(None) if user_id == NO_ID else table.user_id == user_id]
+
+def raw_partitions(db, start: int, end: int, key=None):
+    table = partitions.readings(db.execute(partitions.sealed_query(start, end)).scalars().all(), start, end)
+    query = select(
+        func.coalesce(table.c.user_id, NO_ID),
+        func.coalesce(table.c.source_id, NO_ID),
+        table.c.ts,
+        table.c.generated_energy
+    ).where(*timeseries.time_range(start, end, table.c), table.c.generated_energy.is_not(None), *group_filters(key, table.c))
+    for partition in db.execute(query.execution_options(yield_per=ROLLUP_FETCH_ROWS)).partitions():
+        data = as_array(partition)
+        yield data[:, :3].astype(np.int64), data[:, 3]
+    archived = archive.decode(db.execute(archive.chunk_query(group_filters(key, models.ArchiveChunk), start, end)).all(), start, end)
+    if archived.values.size:
+        yield np.column_stack([archived.user_ids, archived.source_ids, archived.micros // 1_000_000]), archived.values
+
+def rebuild(db, resolution: int, start: int, end: int, key=None) -> int:
+    # Rollups of [start, end), of every group or of the group `key` only
+    accumulator = Accumulator()
+    if resolution == HOUR:
+        compressed = []
+        if key is None or key[1] != NO_ID:
+            compressed = db.execute(deadband.compressed_query(source_id=None if key is None else key[1])).scalars().all()
+        for keys, values in raw_partitions(db, start, end, key):
+            keep = deadband.not_compressed_mask(compressed, keys[:, 1])
+            keys = keys[keep]
+            keys[:, 2] = keys[:, 2] // resolution * resolution
+            accumulator.add_values(keys, values[keep])
+        for source in compressed:
+            times, values = deadband.rebuilt_sync(db, source, start, end)
+            keys = np.tile(np.array([NO_ID if source.user_id is None else source.user_id, source.id], dtype=np.int64), (len(times), 1))
+            accumulator.add_values(np.column_stack([keys, times.astype(np.int64) // resolution * resolution]), values)
+    else:
+        # Coarser resolutions merge the finer rollups instead of rescanning raw rows
+        rows = db.execute(select(
+            func.coalesce(models.EnergyRollup.user_id, NO_ID),
+            func.coalesce(models.EnergyRollup.source_id, NO_ID),
+            models.EnergyRollup.bucket,
+            models.EnergyRollup.count,
+            models.EnergyRollup.sum,
+            models.EnergyRollup.min,
+            models.EnergyRollup.max,
+            models.EnergyRollup.sketch
+        ).where(
+            models.EnergyRollup.resolution == finer(resolution),
+            models.EnergyRollup.bucket >= start,
+            models.EnergyRollup.bucket < end,
+            *group_filters(key, models.EnergyRollup)
+        )).all()
+        if rows:
+            keys = np.array([row[:3] for row in rows], dtype=np.int64)
+            keys[:, 2] = keys[:, 2] // resolution * resolution
+            accumulator.add_stats(keys, *(np.array([row[i] for row in rows]) for i in range(3, 7)))
+            accumulator.add_sketch(keys, [row[7] for row in rows])
+
+    db.execute(delete(models.EnergyRollup).where(
+        models.EnergyRollup.resolution == resolution,
+        models.EnergyRollup.bucket >= start,
+        models.EnergyRollup.bucket < end,
+        *group_filters(key, models.EnergyRollup)
+    ))
+    groups = accumulator.result()
+    if groups:
+        db.execute(models.EnergyRollup.__table__.insert(), [
+            {
+                "resolution": resolution,
+                "user_id": None if user_id == NO_ID else user_id,
+                "source_id": None if source_id == NO_ID else source_id,
+                "bucket": bucket,
+                "count": group["count"],
+                "sum": group["sum"],
+                "min": group["min"],
+                "max": group["max"],
+                "sketch": sketch.encode(group["bins"], group["bin_counts"]),
+            }
+            for (user_id, source_id, bucket), group in groups.items()
+        ])
+    return len(groups)
+
+def finer(resolution: int) -> int:
+    return RESOLUTIONS[RESOLUTIONS.index(resolution) - 1]
+
+def first_bucket(db, resolution: int, closed: int) -> int:
+    if resolution == HOUR:
+        oldest = db.scalar(select(func.min(models.EnergyData.ts)))
+        sealed = db.scalar(select(func.min(models.EnergyPartition.period_start)).where(models.EnergyPartition.native == False))
+        oldest = min(filter(lambda value: value is not None, [oldest, sealed]), default=None)
+    else:
+        oldest = db.scalar(select(func.min(models.EnergyRollup.bucket)).where(models.EnergyRollup.resolution == finer(resolution)))
+    return closed if oldest is None else oldest // resolution * resolution
+
+def compute_rollups(now: float = None):
+    with metrics.JOB_DURATION.time(job="compute_rollups"), track_queries("job", "compute_rollups"):
+        now = int(time.time() if now is None else now)
+        db = database.SessionLocal()
+        try:
+            for resolution in RESOLUTIONS:
+                closed = (now - ROLLUP_DELAY_SECONDS) // resolution * resolution
+                if resolution != HOUR:
+                    # Only roll up what the finer resolution has completed
+                    finer_state = db.get(models.RollupState, finer(resolution))
+                    closed = min(closed, (finer_state.closed_until if finer_state else 0) // resolution * resolution)
+                state = db.get(models.RollupState, resolution)
+                if state is None:
+                    state = models.RollupState(resolution=resolution, closed_until=first_bucket(db, resolution, closed))
+                    db.add(state)
+                    db.commit()
+                start = state.closed_until
+                while start < closed:
+                    end = min(start + resolution * ROLLUP_CHUNK_BUCKETS, closed)
+                    # Claimed in its own transaction before any raw row is read
+                    db.execute(update(models.RollupState).where(models.RollupState.resolution == resolution).values(claimed_until=end))
+                    db.commit()
+                    groups = rebuild(db, resolution, start, end)
+                    # Compare-and-set: another run that got here first wins
+                    advanced = db.execute(update(models.RollupState).where(
+                        models.RollupState.resolution == resolution,
+                        models.RollupState.closed_until == start
+                    ).values(closed_until=end)).rowcount
+                    db.commit()
+                    logger.info(f"Rolled up {groups} groups at {resolution}s for [{start}, {end})")
+                    if not advanced:
+                        break
+                    start = end
+            rebuild_dirty(db)
+        finally:
+            db.close()
+
+def dirty_buckets(ranges, resolution: int, closed: int) -> list:
+    # [start, end) ranges of whole buckets covering `ranges` up to `closed`, merged
+    spans = sorted((start // resolution * resolution, min(-(-end // resolution) * resolution, closed)) for start, end in ranges)
+    merged = []
+    for start, end in spans:
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def rebuild_dirty(db):
+    # Rebuilds the closed buckets of the groups late writes recorded, ROLLUP_DIRTY_BATCH
+    # records per transaction. Records are deleted by id: one committed later
+    # with a lower id is still picked up by the next batch or run.
+    while True:
+        dirty = db.execute(select(models.RollupDirty).order_by(models.RollupDirty.id).limit(ROLLUP_DIRTY_BATCH)).scalars().all()
+        if not dirty:
+            return
+        ranges = {}
+        for record in dirty:
+            key = (NO_ID if record.user_id is None else record.user_id, NO_ID if record.source_id is None else record.source_id)
+            ranges.setdefault(key, []).append((record.period_start, record.period_end))
+        rebuilt = 0
+        for resolution in RESOLUTIONS:
+            state = db.get(models.RollupState, resolution)
+            if state is None:
+                continue
+            for key, key_ranges in ranges.items():
+                for start, end in dirty_buckets(key_ranges, resolution, state.closed_until):
+                    rebuild(db, resolution, start, end, key)
+                    rebuilt += 1
+        db.execute(delete(models.RollupDirty).where(models.RollupDirty.id.in_([record.id for record in dirty])))
+        db.commit()
+        logger.info(f"Rebuilt {rebuilt} dirty rollup ranges of {len(ranges)} groups")
+
+async def closed_for(db, user: models.User, source_id: int = None) -> dict:
+    # resolution -> closed_until, moved back to where the user's (or the source's)
+    # readings have rollups still to rebuild: those buckets are read raw until then
+    states = dict((await db.execute(select(models.RollupState.resolution, models.RollupState.closed_until))).all())
+    pending = await db.scalar(select(func.min(models.RollupDirty.period_start)).where(
+        *timeseries.reading_filters(user, source_id, models.RollupDirty)
+    ))
+    if pending is None:
+        return states
+    return {resolution: min(closed, pending // resolution * resolution) for resolution, closed in states.items()}
@@ -1,47 +1,267 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from .. import database, models
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+from .. import database, models, metrics
+from ..query_tracking import track_queries
+from .timing_wheel import WheelRunner
+from . import adapters, archive, deadband, latest, partitions, response_cache, rollups, timeseries, validation
+from .spool import Spool
+from sqlalchemy import insert, update, or_
+from sqlalchemy.exc import SQLAlchemyError
 import datetime
-import random
+import json
 import logging
+import math
+import os
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-scheduler = BackgroundScheduler()
-
-def fetch_energy_data():
-    logger.info("Fetching energy data...")
-    # Mock data fetch for now as endpoint is TBD
-    
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            # Simulate network call
-            generated = random.uniform(0, 100) # Mock value
-            
-            db = database.SessionLocal()
+# Job policies. A run that misses its slot by more than the grace time is skipped,
+# runs missed during downtime collapse into one catch-up run, and a slow run is
+# never overlapped by the next one.
+JOB_MISFIRE_GRACE_SECONDS = int(os.getenv("JOB_MISFIRE_GRACE_SECONDS", "30"))
+JOB_COALESCE = os.getenv("JOB_COALESCE", "true").lower() == "true"
+JOB_MAX_INSTANCES = int(os.getenv("JOB_MAX_INSTANCES", "1"))
+# Poll interval for sources that do not set their own
+FETCH_INTERVAL_SECONDS = int(os.getenv("FETCH_INTERVAL_SECONDS", "60"))
+# How often the set of sources on the timing wheel is refreshed from the database
+SOURCE_SYNC_SECONDS = int(os.getenv("SOURCE_SYNC_SECONDS", "60"))
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", "8"))
+SPOOL_REPLAY_SECONDS = int(os.getenv("SPOOL_REPLAY_SECONDS", "30"))
+
+# Jobs are persisted in the app database so schedules survive restarts.
+# Only one process may run the scheduler against a job store at a time
+# (the API with RUN_SCHEDULER=true, or the worker).
+scheduler = BackgroundScheduler(
+    jobstores={"default": SQLAlchemyJobStore(engine=database.engine, tablename="apscheduler_jobs")},
+    job_defaults={
+        "misfire_grace_time": JOB_MISFIRE_GRACE_SECONDS,
+        "coalesce": JOB_COALESCE,
+        "max_instances": JOB_MAX_INSTANCES,
+    },
+)
+
+# Last ingestion outcomes, reported by the worker's health endpoint
+last_run = {"success": None, "failure": None}
+
+spool = Spool()
+
+# Source settings as of the last sync, so polls keep running while the database
+# is down, and the newest reading stored or spooled per source. Both are in memory
+# only: after a restart during an outage, polls start again from the committed
+# last_reading_at and readings already spooled are fetched again, to be skipped
+# on insert.
+sources = {}
+high_water = {}
+# Deadband door per source, ahead of the stored copy while the database is down
+doors = {}
+
+def load_source(source_id: int):
+    db = database.SessionLocal()
+    try:
+        source = db.get(models.EnergySource, source_id)
+        if source is not None:
+            db.expunge(source)
+            sources[source_id] = source
+        return source
+    finally:
+        db.close()
+
+def store_readings(rows: list, quarantined: list = (), received: list = None, door_states: dict = None):
+    # received: every accepted reading, when deadband compression only kept `rows`;
+    # door_states: deadband state to save per source id
+    db = database.SessionLocal()
+    try:
+        if rows:
+            # Rows already stored are skipped: a spool segment replayed again after a
+            # crash, or readings fetched again after a restart lost high_water
+            rows, replayed = timeseries.split_inserted(rows, db.execute(timeseries.insert_readings(db.bind.dialect.name), rows).all())
+            if replayed:
+                logger.info(f"Skipped {len(replayed)} readings that were already stored")
+        if quarantined:
+            db.execute(insert(models.QuarantinedReading), list(quarantined))
+        if rows:
+            # Late readings have the closed rollup buckets of their source rebuilt
+            db.execute(*rollups.mark_dirty(rows, deadband.DEADBAND_MAX_SECONDS if door_states else 0))
+        newest = {}
+        for row in (rows if received is None else received):
+            if row["source_id"] not in newest or row["timestamp"] > newest[row["source_id"]]:
+                newest[row["source_id"]] = row["timestamp"]
+        # Core statements, like the insert: no loaded sources for the ORM to synchronise
+        source_table = models.EnergySource.__table__
+        for source_id, timestamp in newest.items():
+            db.execute(update(source_table).where(
+                source_table.c.id == source_id,
+                or_(source_table.c.last_reading_at.is_(None), source_table.c.last_reading_at < timestamp)
+            ).values(last_reading_at=timestamp))
+        for source_id, state in (door_states or {}).items():
+            db.execute(update(models.EnergySource).where(models.EnergySource.id == source_id).values(deadband_state=json.dumps(state)))
+        db.commit()
+        # /current shows the readings doors hold back too
+        users = {row["source_id"]: row["user_id"] for row in received or ()}
+        latest.update(rows + [deadband.held_row(state["held"], {"id": None, "source_id": source_id, "user_id": users.get(source_id)})
+                              for source_id, state in (door_states or {}).items() if state["held"]])
+        # Deadband sources are interpolated from the stored point before, up to DEADBAND_MAX_SECONDS back
+        response_cache.readings_stored(rows if received is None else received, deadband.DEADBAND_MAX_SECONDS if door_states else 0)
+    finally:
+        db.close()
+
+def fetch_energy_data(source_id: int):
+    # Polls one source through its adapter and stores the whole batch it returns.
+    # If the database write fails the batch goes to the local spool instead.
+    with metrics.JOB_DURATION.time(job="fetch_energy_data"), track_queries("job", "fetch_energy_data"):
+        source = sources.get(source_id) or load_source(source_id)
+        if source is None or not source.is_active:
+            return
+        adapter = adapters.get_adapter(source.kind)
+        since = max(filter(None, [source.last_reading_at, high_water.get(source_id)]), default=None)
+        logger.info(f"Fetching energy data for source {source_id} ({source.kind})...")
+
+        max_retries = 3
+        for attempt in range(max_retries):
             try:
-                data = models.EnergyData(
-                    generated_energy=generated,
-                    timestamp=datetime.datetime.utcnow()
-                )
-                db.add(data)
-                db.commit()
-                logger.info(f"Data saved: {generated:.2f} kWh")
+                readings = adapter.fetch(source, since)
                 break # Success, exit retry loop
-            finally:
-                db.close()
-                
-        except Exception as e:
-            logger.error(f"Attempt {attempt + 1} failed: {e}")
-            if attempt == max_retries - 1:
-                logger.error("Max retries reached. Data fetch failed.")
+            except Exception as e:
+                logger.error(f"Attempt {attempt + 1} failed: {e}")
+                if attempt == max_retries - 1:
+                    metrics.INGEST_FAILURES.inc(source=source.kind)
+                    last_run["failure"] = datetime.datetime.utcnow()
+                    logger.error("Max retries reached. Data fetch failed.")
+                    return
+                metrics.INGEST_RETRIES.inc(source=source.kind)
+
+        # Normalize to MWh and validate the whole batch at once
+        timestamps = [reading.timestamp for reading in readings]
+        values = [reading.value for reading in readings]
+        checked = validation.validate(timestamps, values, adapters.UNIT_TO_MWH.get(source.unit, math.nan),
+                                      after=since if adapter.filters_since else None, oldest=partitions.retention_cutoff())
+        rows, quarantined = validation.partition(checked, timestamps, values, source.unit, {"source_id": source.id, "user_id": source.user_id})
+        for row in quarantined:
+            metrics.INGEST_REJECTED.inc(source=source.kind, reason=row["reason"])
+        received, door_states = rows, None
+        if source.deadband and rows:
+            state = doors.get(source_id) or (json.loads(source.deadband_state) if source.deadband_state else None)
+            rows, doors[source_id] = deadband.compress(received, source.deadband, state)
+            door_states = {source_id: doors[source_id]}
+            metrics.DEADBAND_DROPPED.inc(len(received) - len(rows), source=source.kind)
+        if received or quarantined:
+            try:
+                store_readings(rows, quarantined, received, door_states)
+                logger.info(f"Data saved: {len(rows)} of {len(received)} MWh readings from source {source_id}, {len(quarantined)} quarantined")
+            except SQLAlchemyError as e:
+                # No immediate retries against a failing database: the spool is
+                # durable and replay_spool bulk-loads it once the database is back.
+                # Quarantined rows are only logged while the database is down.
+                logger.warning(f"Database write failed, spooling {len(rows)} readings from source {source_id} "
+                               f"and dropping {len(quarantined)} quarantined: {e}")
+                if rows:
+                    spool.append(rows)
+                    metrics.SPOOLED_READINGS.inc(len(rows))
+        if readings:
+            high_water[source_id] = max(timestamps)
+        adapter.acknowledge(source)
+        metrics.INGEST_READINGS.inc(len(rows), source=source.kind)
+        last_run["success"] = datetime.datetime.utcnow()
+
+def replay_spool():
+    # Loads spooled segments oldest first, one transaction per segment. A segment is
+    # deleted after its commit, so a crash in between replays it again, which
+    # store_readings turns into a no-op.
+    with metrics.JOB_DURATION.time(job="replay_spool"), track_queries("job", "replay_spool"):
+        for path in spool.sealed_segments():
+            rows = spool.read_segment(path)
+            if rows:
+                try:
+                    store_readings(rows)
+                except SQLAlchemyError as e:
+                    logger.warning(f"Spool replay deferred, database still unavailable: {e}")
+                    break
+            spool.remove(path)
+            metrics.SPOOL_REPLAYED_READINGS.inc(len(rows))
+            logger.info(f"Replayed {len(rows)} spooled readings from {os.path.basename(path)}")
+        metrics.SPOOL_PENDING_BYTES.set(spool.pending_bytes())
+
+def record_poll_overlap(source_id):
+    logger.warning(f"Skipped a poll of source {source_id}: previous poll still in progress")
+    metrics.JOB_OVERLAP_SKIPPED.inc(job="poll_source")
+
+# Per-source polling. Every active EnergySource sits on a timing wheel with its own
+# interval and an id-derived offset, so polls are spread across the interval
+# instead of all landing on the minute boundary.
+poller = WheelRunner(fetch_energy_data, workers=POLL_WORKERS, on_skip=record_poll_overlap)
+
+def sync_sources():
+    db = database.SessionLocal()
+    try:
+        active = db.query(models.EnergySource).filter(
+            models.EnergySource.is_active == True,
+            models.EnergySource.kind != adapters.PUSH
+        ).all()
+        db.expunge_all()
+    finally:
+        db.close()
+    sources.clear()
+    sources.update((source.id, source) for source in active)
+    for source in active:
+        poller.schedule(source.id, source.interval_seconds or FETCH_INTERVAL_SECONDS)
+    for source_id in poller.keys() - set(sources):
+        poller.cancel(source_id)
+    metrics.POLL_SOURCES.set(len(sources))
+    logger.info(f"Polling {len(sources)} sources")
+
+def record_job_lag(event):
+    for run_time in event.scheduled_run_times:
+        lag = (datetime.datetime.now(run_time.tzinfo) - run_time).total_seconds()
+        metrics.JOB_LAG.observe(max(lag, 0.0), job=event.job_id)
+
+def record_job_missed(event):
+    metrics.JOB_MISSED.inc(job=event.job_id)
+
+def record_job_overlap(event):
+    logger.warning(f"Skipped a run of {event.job_id}: previous run still in progress")
+    metrics.JOB_OVERLAP_SKIPPED.inc(job=event.job_id)
+
+scheduler.add_listener(record_job_lag, EVENT_JOB_SUBMITTED)
+scheduler.add_listener(record_job_missed, EVENT_JOB_MISSED)
+scheduler.add_listener(record_job_overlap, EVENT_JOB_MAX_INSTANCES)
+
+def ensure_interval_job(func, job_id: str, seconds: int):
+    # Keep a persisted job (and its next run time) across restarts, only replacing
+    # it when the interval changed. Policies are re-applied from the environment.
+    job = scheduler.get_job(job_id)
+    if job is not None and getattr(job.trigger, "interval", None) == datetime.timedelta(seconds=seconds):
+        job.modify(
+            misfire_grace_time=JOB_MISFIRE_GRACE_SECONDS,
+            coalesce=JOB_COALESCE,
+            max_instances=JOB_MAX_INSTANCES
+        )
+        return job
+    return scheduler.add_job(func, 'interval', seconds=seconds, id=job_id, replace_existing=True)
 
 def start():
-    # Schedule job every 1 minute
-    scheduler.add_job(fetch_energy_data, 'interval', minutes=1)
-    scheduler.start()
+    # Start paused so persisted jobs are reconciled before any missed run fires
+    scheduler.start(paused=True)
+    # The single global fetch job is replaced by per-source polling
+    if scheduler.get_job("fetch_energy_data"):
+        scheduler.remove_job("fetch_energy_data")
+    ensure_interval_job(sync_sources, "sync_sources", SOURCE_SYNC_SECONDS)
+    ensure_interval_job(replay_spool, "replay_spool", SPOOL_REPLAY_SECONDS)
+    ensure_interval_job(rollups.compute_rollups, "compute_rollups", rollups.ROLLUP_INTERVAL_SECONDS)
+    ensure_interval_job(partitions.maintain, "maintain_partitions", partitions.PARTITION_INTERVAL_SECONDS)
+    ensure_interval_job(archive.compact, "compact_archive", archive.ARCHIVE_INTERVAL_SECONDS)
+    sync_sources()
+    poller.start()
+    scheduler.resume()
+
+def is_running():
+    return scheduler.running
 
-def shutdown():
-    scheduler.shutdown()
+def shutdown(wait: bool = True):
+    # wait=True lets running jobs and polls finish before returning
+    if scheduler.running:
+        scheduler.shutdown(wait=wait)
+    if poller.running:
+        poller.stop(wait=wait)
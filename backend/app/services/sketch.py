@@ -0,0 +1,43 @@
+import math
+import numpy as np
+
+# Mergeable quantile sketch for rollups. Values fall into log-spaced bins, so any
+# percentile read back is within about 1% (relative) of the true value, and
+# sketches of adjacent buckets merge by adding their bin counts.
+
+GAMMA = 1.02
+LOG_GAMMA = math.log(GAMMA)
+# Magnitudes below this share the zero bin
+ZERO = 1e-9
+
+def bins(values) -> np.ndarray:
+    # Signed bin index: 0 for ~zero, k > 0 for positive and -k for negative values
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.abs(values)
+    index = np.zeros(values.shape, dtype=np.int32)
+    nonzero = magnitude > ZERO
+    index[nonzero] = np.ceil(np.log(magnitude[nonzero] / ZERO) / LOG_GAMMA)
+    return np.where(values < 0, -index, index)
+
+def bin_values(index) -> np.ndarray:
+    # Representative value of each bin, within (GAMMA - 1) / (GAMMA + 1) of any member
+    index = np.asarray(index, dtype=np.float64)
+    magnitude = np.where(index == 0, 0.0, ZERO * 2 * GAMMA ** np.abs(index) / (GAMMA + 1))
+    return np.sign(index) * magnitude
+
+def encode(index, counts) -> bytes:
+    return np.asarray(index, dtype="<i4").tobytes() + np.asarray(counts, dtype="<i8").tobytes()
+
+def decode(blob: bytes):
+    size = len(blob) // 12
+    return np.frombuffer(blob, dtype="<i4", count=size), np.frombuffer(blob, dtype="<i8", offset=size * 4)
+
+def quantiles(index, counts, percentiles) -> list:
+    # Nearest-rank percentiles of a (merged) sketch, bins need not be sorted
+    order = np.argsort(index, kind="stable")
+    index = np.asarray(index)[order]
+    cumulative = np.cumsum(np.asarray(counts)[order])
+    if not cumulative.size or cumulative[-1] == 0:
+        return [None] * len(percentiles)
+    ranks = np.maximum(np.ceil(np.asarray(percentiles, dtype=np.float64) / 100 * cumulative[-1]), 1)
+    return bin_values(index[np.searchsorted(cumulative, ranks)]).tolist()
@@ -0,0 +1,127 @@
+import datetime
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Local write-ahead spool for readings that could not be written to the database.
+# Readings are appended as JSON lines to the open segment; concurrent appends share
+# one fsync (group commit). Segments are sealed when they reach the size limit or
+# when the replayer picks them up, and are deleted once their rows are committed.
+
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+
+OPEN_SUFFIX = ".open"
+SEALED_SUFFIX = ".log"
+
+def fsync_directory(directory: str):
+    # Makes renames and new files in the directory durable
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Spool:
+    def __init__(self, directory: str = SPOOL_DIR, segment_bytes: int = SPOOL_SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.file = None
+        self.path = None
+        self.written = 0 # Appends written so far
+        self.synced = 0 # Appends known to be on disk
+        self.recovered = False
+
+    def recover(self):
+        # Segments left open by a crash are sealed as they are, a torn last line is
+        # skipped when the segment is read
+        for path in glob.glob(os.path.join(self.directory, "*" + OPEN_SUFFIX)):
+            if path != self.path:
+                os.replace(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        self.recovered = True
+
+    def append(self, rows: list):
+        data = "".join(json.dumps({**row, "timestamp": row["timestamp"].isoformat()}) + "\n" for row in rows).encode()
+        with self.lock:
+            if self.file is None:
+                self.open_segment()
+            elif self.file.tell() > 0 and self.file.tell() + len(data) > self.segment_bytes:
+                self.seal()
+                self.open_segment()
+            self.file.write(data)
+            self.file.flush()
+            self.written += 1
+            sequence = self.written
+        self.sync(sequence)
+
+    def sync(self, sequence: int):
+        with self.sync_lock:
+            if self.synced >= sequence:
+                # Another thread's fsync already covered this append
+                return
+            with self.lock:
+                target = self.written
+                # A duplicate descriptor stays valid even if the segment is sealed meanwhile
+                fd = os.dup(self.file.fileno()) if self.file else None
+            if fd is not None:
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self.synced = max(self.synced, target)
+
+    def open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if not self.recovered:
+            self.recover()
+        self.path = os.path.join(self.directory, f"{time.time_ns():020d}{OPEN_SUFFIX}")
+        self.file = open(self.path, "ab")
+        fsync_directory(self.directory)
+
+    def seal(self):
+        # Caller holds self.lock
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.path, self.path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        fsync_directory(self.directory)
+        self.synced = self.written
+        self.file = None
+        self.path = None
+
+    def sealed_segments(self):
+        # Seals the open segment too, so everything spooled so far can be replayed
+        if not os.path.isdir(self.directory):
+            return []
+        with self.lock:
+            if self.file is not None and self.file.tell() > 0:
+                self.seal()
+            if not self.recovered:
+                self.recover()
+        return sorted(glob.glob(os.path.join(self.directory, "*" + SEALED_SUFFIX)))
+
+    def read_segment(self, path: str):
+        rows = []
+        with open(path, "rb") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping torn record {number} in spool segment {path}")
+                    continue
+                row["timestamp"] = datetime.datetime.fromisoformat(row["timestamp"])
+                rows.append(row)
+        return rows
+
+    def remove(self, path: str):
+        os.remove(path)
+
+    def pending_bytes(self):
+        return sum(os.path.getsize(path) for path in glob.glob(os.path.join(self.directory, "*")))
@@ -0,0 +1,181 @@
+from sqlalchemy import select, func, case, literal
+from .. import models
+from . import archive, deadband, partitions, rollups, sketch, timeseries
+import logging
+import os
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Windowed statistics over energy_data. Short windows are computed exactly in SQL,
+# percentiles with window functions. Longer windows read closed rollup buckets
+# for the part of the range they cover and raw rows only for the edges.
+# Deadband-compressed sources are counted by their rebuilt readings (see
+# deadband.py), in Python, so windows with them are never the exact SQL path.
+
+# Windows up to this long are always computed exactly from raw rows
+STATS_RAW_MAX_SECONDS = int(os.getenv("STATS_RAW_MAX_SECONDS", str(2 * 86400)))
+STATS_MAX_BUCKETS = int(os.getenv("STATS_MAX_BUCKETS", "10000"))
+DEFAULT_PERCENTILES = (50.0, 95.0, 99.0)
+
+def percentile_key(p: float) -> str:
+    return f"p{p:g}"
+
+def floor_to(value: int, step: int) -> int:
+    return value // step * step
+
+def ceil_to(value: int, step: int) -> int:
+    return -(-value // step) * step
+
+def plan(start: int, end: int, bucket: int, closed_until: dict):
+    # Splits [start, end) into (tier, start, end) segments: the coarsest closed rollup
+    # tier that fits each stretch, raw rows for the rest. Rollups are only usable
+    # when their buckets nest inside the requested bucket size.
+    segments = [("raw", start, end)]
+    for resolution in sorted(closed_until, reverse=True):
+        if bucket and bucket % resolution:
+            continue
+        covered = []
+        for tier, a, b in segments:
+            low, high = ceil_to(a, resolution), min(floor_to(b, resolution), closed_until[resolution])
+            if tier != "raw" or low >= high:
+                covered.append((tier, a, b))
+                continue
+            if a < low:
+                covered.append(("raw", a, low))
+            covered.append((resolution, low, high))
+            if high < b:
+                covered.append(("raw", high, b))
+        segments = covered
+    return segments
+
+def summary(start: int, end: int, count: int, total, low, high, percentiles: dict) -> dict:
+    return {
+        "start": timeseries.from_epoch(start),
+        "end": timeseries.from_epoch(end),
+        "count": count,
+        "sum": total,
+        "min": low,
+        "max": high,
+        "mean": total / count if count else None,
+        "percentiles": percentiles,
+    }
+
+def raw_statement(table, filters, bucket: int, percentiles):
+    # One row per bucket (or one row overall): count, sum, min, max and the
+    # nearest-rank percentiles, ranks compared in integer basis points
+    value = table.c.generated_energy
+    partition = table.c.ts // bucket if bucket else None
+    bucket_column = partition if partition is not None else literal(0)
+    if not percentiles:
+        query = select(bucket_column.label("bucket"), func.count(value), func.sum(value), func.min(value), func.max(value)).where(*filters)
+        return query.group_by(partition).order_by(partition) if partition is not None else query
+
+    ranked = select(
+        bucket_column.label("bucket"),
+        value.label("value"),
+        func.row_number().over(partition_by=partition, order_by=value).label("rank"),
+        func.count().over(partition_by=partition).label("n")
+    ).where(*filters).subquery()
+    columns = [ranked.c.bucket, func.count(ranked.c.value), func.sum(ranked.c.value), func.min(ranked.c.value), func.max(ranked.c.value)]
+    for p in percentiles:
+        target = (ranked.c.n * int(round(p * 100)) + 9999) // 10000
+        columns.append(func.max(case((ranked.c.rank == target, ranked.c.value))))
+    query = select(*columns)
+    return query.group_by(ranked.c.bucket).order_by(ranked.c.bucket) if bucket else query
+
+async def raw_stats(db, user, source_id, start: int, end: int, bucket: int, percentiles):
+    table = await partitions.readings_between(db, start, end)
+    filters = timeseries.reading_filters(user, source_id, table.c) + timeseries.time_range(start, end, table.c) + [table.c.generated_energy.is_not(None)]
+    row = (await db.execute(raw_statement(table, filters, None, percentiles))).one()
+    total = summary(start, end, row[1], row[2], row[3], row[4], dict(zip(map(percentile_key, percentiles), row[5:])))
+    buckets = []
+    if bucket:
+        for row in (await db.execute(raw_statement(table, filters, bucket, percentiles))).all():
+            bucket_start = row[0] * bucket
+            buckets.append(summary(max(bucket_start, start), min(bucket_start + bucket, end), row[1], row[2], row[3], row[4],
+                                   dict(zip(map(percentile_key, percentiles), row[5:]))))
+    return total, buckets
+
+def sketch_percentiles(group: dict, percentiles) -> dict:
+    values = sketch.quantiles(group["bins"], group["bin_counts"], percentiles)
+    # Keep bin representatives inside the exact min and max
+    return {percentile_key(p): None if v is None else min(max(v, group["min"]), group["max"]) for p, v in zip(percentiles, values)}
+
+async def mixed_stats(db, user, source_id, segments, start: int, end: int, bucket: int, percentiles, compressed: list = ()):
+    accumulator = rollups.Accumulator()
+    bucket_of = (lambda seconds: seconds // bucket) if bucket else (lambda seconds: seconds * 0)
+    rollup_filters = timeseries.reading_filters(user, source_id, models.EnergyRollup)
+    for tier, a, b in segments:
+        if tier == "raw":
+            table = await partitions.readings_between(db, a, b)
+            rows = (await db.execute(select(table.c.ts, table.c.generated_energy).where(
+                *timeseries.reading_filters(user, source_id, table.c), *timeseries.time_range(a, b, table.c), table.c.generated_energy.is_not(None),
+                *deadband.not_compressed(compressed, table.c)
+            ))).all()
+            if rows:
+                data = rollups.as_array(rows)
+                accumulator.add_values(bucket_of(data[:, 0].astype(np.int64))[:, None], data[:, 1])
+            archived = await archive.load(db, user, source_id, a, b)
+            keep = deadband.not_compressed_mask(compressed, archived.source_ids)
+            accumulator.add_values(bucket_of(archived.micros[keep] // 1_000_000)[:, None], archived.values[keep])
+            for source in compressed:
+                times, values = await deadband.rebuilt(db, source, a, b)
+                accumulator.add_values(bucket_of(times.astype(np.int64))[:, None], values)
+        else:
+            rows = (await db.execute(select(
+                models.EnergyRollup.bucket, models.EnergyRollup.count, models.EnergyRollup.sum,
+                models.EnergyRollup.min, models.EnergyRollup.max, models.EnergyRollup.sketch
+            ).where(
+                *rollup_filters,
+                models.EnergyRollup.resolution == tier,
+                models.EnergyRollup.bucket >= a,
+                models.EnergyRollup.bucket < b
+            ))).all()
+            if rows:
+                keys = bucket_of(np.array([row[0] for row in rows], dtype=np.int64))[:, None]
+                accumulator.add_stats(keys, *(np.array([row[i] for row in rows]) for i in range(1, 5)))
+                accumulator.add_sketch(keys, [row[5] for row in rows])
+
+    groups = accumulator.result()
+    buckets = []
+    for (index,), group in sorted(groups.items()):
+        bucket_start = index * bucket if bucket else start
+        buckets.append(summary(max(bucket_start, start), min(bucket_start + bucket, end) if bucket else end,
+                               group["count"], group["sum"], group["min"], group["max"], sketch_percentiles(group, percentiles)))
+    if not groups:
+        return summary(start, end, 0, None, None, None, {percentile_key(p): None for p in percentiles}), []
+    merged = {
+        "min": min(group["min"] for group in groups.values()),
+        "max": max(group["max"] for group in groups.values()),
+        "bins": np.concatenate([group["bins"] for group in groups.values()]),
+        "bin_counts": np.concatenate([group["bin_counts"] for group in groups.values()]),
+    }
+    total = summary(start, end, sum(group["count"] for group in groups.values()), sum(group["sum"] for group in groups.values()),
+                    merged["min"], merged["max"], sketch_percentiles(merged, percentiles))
+    return total, buckets if bucket else []
+
+async def window_stats(db, user, start: int, end: int, bucket: int = None, source_id: int = None, percentiles=DEFAULT_PERCENTILES) -> dict:
+    segments = [("raw", start, end)]
+    if end - start > STATS_RAW_MAX_SECONDS:
+        segments = plan(start, end, bucket, await rollups.closed_for(db, user, source_id))
+
+    compressed = (await db.execute(deadband.compressed_query(user, source_id))).scalars().all()
+    tiers = {tier == "raw" for tier, _, _ in segments}
+    tier = "raw" if tiers == {True} else "rollup" if tiers == {False} else "mixed"
+    # Archived readings are decoded in Python, so the exact SQL path cannot see them
+    exact = tier == "raw" and not compressed and not await archive.overlaps(db, user, source_id, start, end)
+    if exact:
+        total, buckets = await raw_stats(db, user, source_id, start, end, bucket, percentiles)
+    else:
+        total, buckets = await mixed_stats(db, user, source_id, segments, start, end, bucket, percentiles, compressed)
+    logger.debug(f"Stats for [{start}, {end}) bucket={bucket} from {tier}: {segments}")
+    return {
+        "start": timeseries.from_epoch(start),
+        "end": timeseries.from_epoch(end),
+        "bucket_seconds": bucket,
+        "tier": tier,
+        "approximate": not exact and bool(percentiles),
+        "total": total,
+        "buckets": buckets,
+    }
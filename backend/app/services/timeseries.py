@@ -0,0 +1,83 @@
+from sqlalchemy import BigInteger, select, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from .. import models
+import calendar
+import datetime
+
+# Shared building blocks for reads of raw energy_data, so every route and job
+# scopes, filters and buckets readings the same way.
+
+class epoch_seconds(FunctionElement):
+    # Whole seconds since the Unix epoch of a naive UTC DateTime column, as
+    # stored in energy_data.ts (see migrations.backfill_epoch)
+    type = BigInteger()
+    inherit_cache = True
+
+@compiles(epoch_seconds)
+def compile_epoch_seconds(element, compiler, **kw):
+    return f"CAST(FLOOR(EXTRACT(EPOCH FROM {compiler.process(element.clauses, **kw)})) AS BIGINT)"
+
+@compiles(epoch_seconds, "sqlite")
+def compile_epoch_seconds_sqlite(element, compiler, **kw):
+    return f"CAST(strftime('%s', {compiler.process(element.clauses, **kw)}) AS INTEGER)"
+
+def to_epoch(value: datetime.datetime) -> int:
+    # Naive datetimes are taken as UTC, like everything stored in energy_data
+    return calendar.timegm(value.utctimetuple())
+
+def from_epoch(seconds: int) -> datetime.datetime:
+    return datetime.datetime.utcfromtimestamp(seconds)
+
+def to_utc(value: datetime.datetime) -> datetime.datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+def visible_to(user: models.User, table=models.EnergyData):
+    # The user's own readings plus global ones not tied to any user
+    return or_(table.user_id == user.id, table.user_id.is_(None))
+
+def reading_filters(user: models.User, source_id: int = None, table=models.EnergyData):
+    filters = [visible_to(user, table)]
+    if source_id is not None:
+        filters.append(table.source_id == source_id)
+    return filters
+
+def time_range(start: int, end: int, table=models.EnergyData):
+    # Half-open [start, end) in epoch seconds, compared on the indexed integer key
+    return [table.ts >= start, table.ts < end]
+
+# The newest readings are always in energy_data itself: only months that are
+# fully rolled up are moved out to sealed partitions (see partitions.py)
+
+async def latest_reading(db, user: models.User):
+    result = await db.execute(select(models.EnergyData).where(visible_to(user)).order_by(models.EnergyData.ts.desc()).limit(1))
+    return result.scalars().first()
+
+async def recent_readings(db, user: models.User, limit: int):
+    result = await db.execute(select(models.EnergyData).where(visible_to(user)).order_by(models.EnergyData.ts.desc()).limit(limit))
+    return result.scalars().all()
+
+def insert_readings(dialect: str):
+    # INSERT into energy_data that skips readings already stored for their source
+    # and second, so a retried push or a replayed spool segment stores nothing
+    # twice. Returns (id, source_id, ts) of the rows it stored, see split_inserted.
+    # The Core table rather than the model: rows are plain dicts, and the ORM's
+    # bulk-insert bookkeeping cost more than the insert itself on small batches
+    data = models.EnergyData.__table__
+    statement = postgresql.insert(data) if dialect == "postgresql" else sqlite.insert(data)
+    return statement.on_conflict_do_nothing(index_elements=["source_id", "ts"]).returning(data.c.id, data.c.source_id, data.c.ts)
+
+def split_inserted(rows: list, returned) -> tuple:
+    # (rows stored, with their ids; rows skipped as already stored)
+    ids = {(source_id, ts): row_id for row_id, source_id, ts in returned}
+    stored, skipped = [], []
+    for row in rows:
+        row_id = ids.pop((row.get("source_id"), to_epoch(row["timestamp"])), None)
+        if row_id is None:
+            skipped.append(row)
+        else:
+            stored.append({**row, "id": row_id})
+    return stored, skipped
@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def stable_offset(key, interval_ticks: int) -> int:
+    # Spreads keys evenly over the interval. Integer ids go through a Knuth
+    # multiplicative hash so sequential ids do not bunch up in neighbouring ticks.
+    value = key if isinstance(key, int) else sum(ord(c) * 31 ** i for i, c in enumerate(str(key)))
+    return ((value * 2654435761) & 0xFFFFFFFF) % interval_ticks
+
+class TimingWheel:
+    # Hashed timing wheel. Each tick only looks at the keys filed under the current
+    # slot, so the per-tick cost does not depend on how many keys are scheduled.
+    # Keys fire when the absolute tick number matches their offset within their
+    # interval, which keeps the spread stable across restarts.
+
+    def __init__(self, tick_seconds: float = 1.0, size: int = 3600, now: float = None):
+        self.tick_seconds = tick_seconds
+        self.size = size
+        self.slots = [set() for _ in range(size)]
+        # key -> [interval_ticks, slot, remaining rounds]
+        self.entries = {}
+        self.current_tick = int((time.time() if now is None else now) // tick_seconds)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def schedule(self, key, interval_seconds: float, offset_ticks: int = None):
+        self.cancel(key)
+        interval_ticks = max(1, round(interval_seconds / self.tick_seconds))
+        if offset_ticks is None:
+            offset_ticks = stable_offset(key, interval_ticks)
+        delay = (offset_ticks - self.current_tick) % interval_ticks or interval_ticks
+        self.place(key, interval_ticks, delay)
+
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.slots[entry[1]].discard(key)
+
+    def place(self, key, interval_ticks: int, delay_ticks: int):
+        slot = (self.current_tick + delay_ticks) % self.size
+        rounds = (delay_ticks - 1) // self.size
+        self.entries[key] = [interval_ticks, slot, rounds]
+        self.slots[slot].add(key)
+
+    def advance(self):
+        # Moves one tick forward and returns the keys due on it
+        self.current_tick += 1
+        bucket = self.slots[self.current_tick % self.size]
+        due = []
+        for key in list(bucket):
+            entry = self.entries[key]
+            if entry[2] > 0:
+                # Interval longer than one revolution, not this time around
+                entry[2] -= 1
+                continue
+            bucket.discard(key)
+            due.append(key)
+            self.place(key, entry[0], entry[0])
+        return due
+
+class WheelRunner:
+    # Drives a TimingWheel from a background thread and hands due keys to a thread
+    # pool. A key whose previous poll is still running is skipped, not queued.
+
+    def __init__(self, poll, tick_seconds: float = 1.0, size: int = 3600, workers: int = 8, on_skip=None):
+        self.poll = poll
+        self.on_skip = on_skip
+        self.wheel = TimingWheel(tick_seconds, size)
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.in_flight = set()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.executor = None
+
+    def schedule(self, key, interval_seconds: float):
+        # Re-scheduling an unchanged key keeps its place on the wheel
+        interval_ticks = max(1, round(interval_seconds / self.wheel.tick_seconds))
+        with self.lock:
+            entry = self.wheel.entries.get(key)
+            if entry is None or entry[0] != interval_ticks:
+                self.wheel.schedule(key, interval_seconds)
+
+    def cancel(self, key):
+        with self.lock:
+            self.wheel.cancel(key)
+
+    def keys(self):
+        with self.lock:
+            return set(self.wheel.entries)
+
+    def start(self):
+        # Rebuild the wheel at the current time so a restart does not replay every
+        # tick missed while stopped
+        with self.lock:
+            old = self.wheel
+            self.wheel = TimingWheel(old.tick_seconds, old.size)
+            for key, entry in old.entries.items():
+                self.wheel.schedule(key, entry[0] * old.tick_seconds)
+        self.stopped.clear()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="source-poll")
+        self.thread = threading.Thread(target=self.run, name="timing-wheel", daemon=True)
+        self.thread.start()
+
+    def stop(self, wait: bool = True):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        if self.executor:
+            self.executor.shutdown(wait=wait)
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self):
+        tick = self.wheel.tick_seconds
+        while not self.stopped.is_set():
+            with self.lock:
+                next_tick = self.wheel.current_tick + 1
+            delay = next_tick * tick - time.time()
+            if delay > 0 and self.stopped.wait(delay):
+                break
+            # Catch up tick by tick if the thread fell behind
+            while not self.stopped.is_set():
+                with self.lock:
+                    if (self.wheel.current_tick + 1) * tick > time.time():
+                        break
+                    due = self.wheel.advance()
+                for key in due:
+                    self.dispatch(key)
+
+    def dispatch(self, key):
+        with self.lock:
+            if key in self.in_flight:
+                if self.on_skip:
+                    self.on_skip(key)
+                return
+            self.in_flight.add(key)
+        self.executor.submit(self.run_poll, key)
+
+    def run_poll(self, key):
+        try:
+            self.poll(key)
+        except Exception:
+            logger.exception(f"Poll for source {key} failed")
+        finally:
+            with self.lock:
+                self.in_flight.discard(key)
@@ -0,0 +1,104 @@
+from collections import namedtuple
+import datetime
+import os
+import numpy as np
+
+# Batch validation and normalization of readings, shared by polled and pushed
+# ingestion. Every check is a whole-array NumPy operation; the first failing check
+# gives a row its rejection reason. Rejected rows go to the quarantine table.
+#
+# A source stores at most one reading per second (uq_energy_data_source_ts), so
+# timestamps are compared to the second. Checks only see the batch and `after`;
+# readings already stored are caught on insert (timeseries.insert_readings).
+
+# Upper bound for a single reading, anything above is a unit or device error
+MAX_READING_MWH = float(os.getenv("MAX_READING_MWH", "1000"))
+# Readings stamped further than this in the future are rejected
+MAX_FUTURE_SKEW_SECONDS = int(os.getenv("MAX_FUTURE_SKEW_SECONDS", "300"))
+# Accepted readings further than this many robust standard deviations from the
+# batch median are stored with is_outlier set
+OUTLIER_Z = float(os.getenv("OUTLIER_Z", "6"))
+OUTLIER_MIN_BATCH = 10
+
+REASONS = ("unit", "not_finite", "negative", "above_max", "future", "stale", "duplicate", "out_of_order", "expired")
+MESSAGES = {
+    "unit": "unsupported unit, readings must be in MWh",
+    "not_finite": "value must be a finite number",
+    "negative": "value must not be negative",
+    "above_max": f"value above the {MAX_READING_MWH:g} MWh limit for a single reading",
+    "future": "timestamp is in the future",
+    "stale": "timestamp is not newer than the source's latest reading",
+    "duplicate": "a reading for this second was already received",
+    "out_of_order": "timestamp earlier than a previous reading in the batch",
+    "expired": "timestamp is older than the raw data retention window",
+}
+ACCEPTED = -1
+
+CheckedBatch = namedtuple("CheckedBatch", ["values", "reason", "is_outlier"])
+
+def validate(timestamps, values, factors, after: datetime.datetime = None, now: datetime.datetime = None,
+             oldest: datetime.datetime = None) -> CheckedBatch:
+    # timestamps: naive UTC datetimes, values: readings in the source unit,
+    # factors: one MWh conversion factor (or one per row), NaN for unknown units,
+    # oldest: retention cutoff, older readings would land in dropped partitions
+    timestamps = np.asarray(timestamps, dtype="datetime64[us]")
+    count = timestamps.size
+    factors = np.broadcast_to(np.asarray(factors, dtype=np.float64), (count,))
+    values = np.asarray(values, dtype=np.float64) * factors
+    reason = np.full(count, ACCEPTED, dtype=np.int8)
+
+    def reject(mask, name):
+        reason[(reason == ACCEPTED) & mask] = REASONS.index(name)
+
+    with np.errstate(invalid="ignore"):
+        reject(np.isnan(factors), "unit")
+        reject(~np.isfinite(values), "not_finite")
+        reject(values < 0, "negative")
+        reject(values > MAX_READING_MWH, "above_max")
+    now = np.datetime64(now or datetime.datetime.utcnow(), "us")
+    reject(timestamps > now + np.timedelta64(MAX_FUTURE_SKEW_SECONDS, "s"), "future")
+    if oldest is not None:
+        reject(timestamps < np.datetime64(oldest, "us"), "expired")
+    ticks = timestamps.view(np.int64)
+    if after is not None:
+        reject(ticks // 1_000_000 <= np.datetime64(after, "us").astype(np.int64) // 1_000_000, "stale")
+
+    # Each row is compared with the newest timestamp among the valid rows before it
+    if count > 1:
+        floor = np.iinfo(np.int64).min
+        running = np.maximum.accumulate(np.where(reason == ACCEPTED, ticks, floor))
+        previous = np.concatenate(([floor], running[:-1]))
+        reject(ticks // 1_000_000 == previous // 1_000_000, "duplicate")
+        reject(ticks < previous, "out_of_order")
+
+    # Robust z-score (median and MAD), so the outliers themselves do not widen the band
+    is_outlier = np.zeros(count, dtype=bool)
+    accepted = reason == ACCEPTED
+    if accepted.sum() >= OUTLIER_MIN_BATCH:
+        kept = values[accepted]
+        median = np.median(kept)
+        mad = np.median(np.abs(kept - median))
+        if mad > 0:
+            is_outlier[accepted] = np.abs(kept - median) / (1.4826 * mad) > OUTLIER_Z
+    return CheckedBatch(values, reason, is_outlier)
+
+def partition(checked: CheckedBatch, timestamps: list, raw_values: list, units, fields: dict):
+    # Splits a checked batch into energy_data rows and quarantine rows. `fields`
+    # (source_id, user_id) is copied onto both.
+    rows, quarantined = [], []
+    units = units if isinstance(units, list) else [units] * len(timestamps)
+    outliers = checked.is_outlier.tolist()
+    normalized = checked.values.tolist()
+    for i, code in enumerate(checked.reason.tolist()):
+        if code == ACCEPTED:
+            rows.append({**fields, "timestamp": timestamps[i], "generated_energy": normalized[i], "is_outlier": outliers[i]})
+        else:
+            quarantined.append({
+                **fields,
+                "timestamp": timestamps[i],
+                "value": raw_values[i],
+                "unit": units[i],
+                "reason": REASONS[code],
+                "detail": MESSAGES[REASONS[code]],
+            })
+    return rows, quarantined
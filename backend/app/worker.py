@@ -0,0 +1,89 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .services import latest, response_cache, scheduler
+from . import metrics, migrations, database
+import json
+import logging
+import os
+import signal
+import threading
+
+# Standalone ingestion process: python -m app.worker
+# Runs the scheduler and ingestion pipeline without the API, so fetch bursts do not
+# compete with request handling. Start the API with RUN_SCHEDULER=false alongside it.
+
+logger = logging.getLogger(__name__)
+
+HEALTH_HOST = os.getenv("WORKER_HEALTH_HOST", "0.0.0.0")
+HEALTH_PORT = int(os.getenv("WORKER_HEALTH_PORT", "8001"))
+
+draining = threading.Event()
+
+def health_status():
+    running = scheduler.is_running() and not draining.is_set()
+    return {
+        "status": "ok" if running else ("draining" if draining.is_set() else "stopped"),
+        "scheduler_running": scheduler.is_running(),
+        "jobs": [
+            {"id": job.id, "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None}
+            for job in scheduler.scheduler.get_jobs()
+        ] if scheduler.is_running() else [],
+        "sources_scheduled": len(scheduler.poller.keys()),
+        "spool_pending_bytes": scheduler.spool.pending_bytes(),
+        "last_success": scheduler.last_run["success"].isoformat() if scheduler.last_run["success"] else None,
+        "last_failure": scheduler.last_run["failure"].isoformat() if scheduler.last_run["failure"] else None,
+    }
+
+class HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/health":
+            status = health_status()
+            self.respond(200 if status["status"] == "ok" else 503, json.dumps(status), "application/json")
+        elif self.path == "/metrics":
+            self.respond(200, metrics.REGISTRY.render(), "text/plain; version=0.0.4")
+        else:
+            self.respond(404, json.dumps({"detail": "Not Found"}), "application/json")
+
+    def respond(self, code: int, body: str, content_type: str):
+        data = body.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def start_health_server(host: str = HEALTH_HOST, port: int = HEALTH_PORT):
+    server = ThreadingHTTPServer((host, port), HealthHandler)
+    threading.Thread(target=server.serve_forever, name="worker-health", daemon=True).start()
+    return server
+
+def main():
+    migrations.upgrade(database.engine)
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}, draining...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    # Updated as readings are stored, for the API workers' /current and caches
+    latest.attach()
+    response_cache.attach()
+    server = start_health_server()
+    logger.info(f"Worker health endpoint on {HEALTH_HOST}:{server.server_port}")
+    scheduler.start()
+    logger.info("Worker started")
+
+    stop.wait()
+    # Report draining while in-flight jobs finish, then stop
+    draining.set()
+    scheduler.shutdown(wait=True)
+    server.shutdown()
+    logger.info("Worker stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Concurrent-request throughput: async session routes vs. sync routes on the threadpool.
+
+Usage (from backend/):
+    python -m benchmarks.bench_async_db --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import tempfile
+
+# Point the app at a throwaway database before anything imports it
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import select
+
+from app import database, models
+from .common import run_concurrently, format_row
+
+def build_app():
+    app = FastAPI()
+
+    @app.get("/sync/latest")
+    def sync_latest():
+        db = database.SessionLocal()
+        try:
+            row = db.query(models.EnergyData).order_by(models.EnergyData.timestamp.desc()).first()
+            return {"generated_energy": row.generated_energy}
+        finally:
+            db.close()
+
+    @app.get("/async/latest")
+    async def async_latest():
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(select(models.EnergyData).order_by(models.EnergyData.timestamp.desc()).limit(1))
+            return {"generated_energy": result.scalars().first().generated_energy}
+
+    return app
+
+def seed(rows: int):
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    now = datetime.datetime.utcnow()
+    db.add_all([
+        models.EnergyData(generated_energy=float(i), timestamp=now - datetime.timedelta(minutes=i))
+        for i in range(rows)
+    ])
+    db.commit()
+    db.close()
+
+async def drive(app, path: str, requests: int, concurrency: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def call():
+            response = await client.get(path)
+            return response.status_code == 200
+        return await run_concurrently(call, requests, concurrency)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    asyncio.run(compare(build_app(), args.requests, args.concurrency))
+
+async def compare(app, requests: int, concurrency: int):
+    # One event loop for both runs, the async engine's pool is bound to it
+    for model, path in (("threadpool (sync)", "/sync/latest"), ("async session", "/async/latest")):
+        # Warm up connections and the threadpool before timing
+        await drive(app, path, concurrency, concurrency)
+        result = await drive(app, path, requests, concurrency)
+        print(format_row(model, result))
+
+if __name__ == "__main__":
+    main()
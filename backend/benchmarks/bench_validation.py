@@ -0,0 +1,55 @@
+"""Throughput of the vectorized ingest validation stage (services/validation.py).
+
+Usage (from backend/):
+    python -m benchmarks.bench_validation --readings 1000000 --min-rate 1000000
+
+Exits with status 1 when the median rate is below --min-rate readings/s.
+"""
+import argparse
+import datetime
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from app.services import validation
+
+def make_batch(count: int, seed: int):
+    # Minute readings in kWh with a sprinkling of every rejection reason and outliers
+    rng = np.random.default_rng(seed)
+    start = np.datetime64(datetime.datetime(2024, 1, 1), "us")
+    timestamps = start + np.arange(count, dtype=np.int64) * np.timedelta64(60, "s")
+    values = rng.gamma(2.0, 500.0, size=count)
+    bad = rng.random(count)
+    values[bad < 0.001] = -values[bad < 0.001]
+    values[(bad >= 0.001) & (bad < 0.002)] = np.nan
+    values[(bad >= 0.002) & (bad < 0.003)] *= 1e4
+    swap = np.flatnonzero((bad >= 0.003) & (bad < 0.004))
+    timestamps[swap] = timestamps[np.maximum(swap - 2, 0)]
+    return timestamps, values
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--min-rate", type=float, default=1_000_000, help="Required readings/s")
+    args = parser.parse_args()
+
+    timestamps, values = make_batch(args.readings, seed=42)
+    rates = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        checked = validation.validate(timestamps, values, 1e-3)
+        rates.append(args.readings / (time.perf_counter() - start))
+
+    rejected = np.bincount(checked.reason[checked.reason != validation.ACCEPTED], minlength=len(validation.REASONS))
+    print(f"{args.readings:,} readings, median {statistics.median(rates):,.0f} readings/s (best {max(rates):,.0f})")
+    print("rejected: " + ", ".join(f"{name}={count}" for name, count in zip(validation.REASONS, rejected.tolist()) if count))
+    print(f"outliers flagged: {int(checked.is_outlier.sum())}")
+    if statistics.median(rates) < args.min_rate:
+        print(f"Below the required {args.min_rate:,.0f} readings/s")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
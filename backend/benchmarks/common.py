@@ -0,0 +1,47 @@
+import asyncio
+import math
+import time
+
+def percentile(sorted_values: list, q: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(latencies: list, elapsed: float, errors: int = 0) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+async def run_concurrently(call, requests: int, concurrency: int) -> dict:
+    # Runs `call` (an async callable returning True on success) `requests` times,
+    # at most `concurrency` at once, and summarizes per-call latency
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            ok = await call()
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+def format_row(name: str, result: dict, unit: str = "req/s") -> str:
+    return (f"{name:<28} {result['count']:>7} ok {result['errors']:>5} err "
+            f"{result['throughput']:>10.1f} {unit:<10} p50 {result['p50_ms']:>8.2f} ms  "
+            f"p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms")
@@ -0,0 +1,160 @@
+"""Bulk-load a synthetic fleet of users and per-interval EnergyData for scale testing.
+
+Each user gets a solar- or wind-shaped series with outages (gaps) and spikes
+(outliers). The same --seed always produces the same fleet.
+
+Usage (from backend/):
+    python -m benchmarks.generate_fleet --users 100 --days 30
+    DATABASE_URL=postgresql://... python -m benchmarks.generate_fleet --users 10000 --days 365
+"""
+import argparse
+import datetime
+import io
+import time
+
+import numpy as np
+from sqlalchemy import insert, select
+
+from app import database, migrations, models
+from app.services import timeseries
+
+FLEET_EMAIL = "fleet-{}@example.com"
+# bcrypt hash of "fleetpassword", so generated users can log in
+FLEET_PASSWORD_HASH = "$2b$12$blY48.ph0zMuLgS3nE0oU.mQ9ehGaiS2gBHAKnT6bXWmWDxFzU/Pu"
+
+def solar_series(rng, minutes: np.ndarray, interval: int, capacity_mw: float) -> np.ndarray:
+    day = minutes // 1440
+    minute_of_day = minutes % 1440
+    # Daylight length swings +-3h over the year around 12h, centred on solar noon
+    daylight = 720 + 180 * np.sin(2 * np.pi * (day - 80) / 365)
+    sunrise = 720 - daylight / 2
+    phase = (minute_of_day - sunrise) / daylight
+    bell = np.where((phase > 0) & (phase < 1), np.sin(np.pi * np.clip(phase, 0, 1)) ** 1.5, 0.0)
+    # Per-day cloudiness plus short-lived passing clouds
+    days = int(day.max()) + 1
+    cloudiness = rng.beta(5, 2, size=days)[day]
+    passing = 1 - 0.4 * (rng.random(minutes.size) < 0.02)
+    power_mw = capacity_mw * bell * cloudiness * passing
+    return power_mw * interval / 3600
+
+def wind_series(rng, minutes: np.ndarray, interval: int, capacity_mw: float) -> np.ndarray:
+    # Wind speed as a mean-reverting AR(1) walk around a site-specific mean. The
+    # recurrence x[i] = alpha * x[i-1] + noise[i] is a convolution with alpha**k,
+    # done with an FFT so long series stay vectorized.
+    mean_speed = rng.uniform(6, 10)
+    noise = rng.normal(0, 0.35, size=minutes.size)
+    alpha = 0.995
+    kernel = alpha ** np.arange(min(3000, minutes.size))
+    size = 1 << int(np.ceil(np.log2(minutes.size + kernel.size)))
+    deviation = np.fft.irfft(np.fft.rfft(noise, size) * np.fft.rfft(kernel, size), size)[:minutes.size]
+    speed = mean_speed + deviation
+    speed = np.clip(speed, 0, None)
+    # Power curve: cut-in 3 m/s, rated at 12 m/s, cut-out above 25 m/s
+    ratio = np.clip((speed - 3) / (12 - 3), 0, 1) ** 3
+    ratio[speed > 25] = 0
+    return capacity_mw * ratio * interval / 3600
+
+def user_series(seed: int, user_index: int, steps: int, interval: int):
+    rng = np.random.default_rng([seed, user_index])
+    minutes = np.arange(steps, dtype=np.int64) * interval // 60
+    capacity_mw = rng.uniform(0.5, 10)
+    if rng.random() < 0.6:
+        values = solar_series(rng, minutes, interval, capacity_mw)
+    else:
+        values = wind_series(rng, minutes, interval, capacity_mw)
+
+    # Outliers: rare spikes and negative glitches
+    outliers = rng.random(steps) < 1e-4
+    values[outliers] = values[outliers] * rng.uniform(5, 20, size=outliers.sum()) + rng.choice([-1.0, 1.0], size=outliers.sum())
+
+    # Gaps: a few outages a month, exponentially distributed lengths around 2 hours
+    keep = np.ones(steps, dtype=bool)
+    outages = rng.poisson(3 * steps * interval / (30 * 86400))
+    for start in rng.integers(0, steps, size=outages):
+        keep[start:start + int(rng.exponential(7200 / interval)) + 1] = False
+    return np.nonzero(keep)[0], np.round(values[keep], 6)
+
+def ensure_users(conn, count: int):
+    def fleet_ids():
+        query = select(models.User.email, models.User.id).where(models.User.email.like("fleet-%@example.com"))
+        return dict(conn.execute(query).all())
+
+    emails = [FLEET_EMAIL.format(i) for i in range(count)]
+    existing = fleet_ids()
+    missing = [
+        {"email": email, "full_name": f"Fleet User {i}", "hashed_password": FLEET_PASSWORD_HASH, "is_active": True, "is_onboarded": True}
+        for i, email in enumerate(emails) if email not in existing
+    ]
+    if missing:
+        conn.execute(insert(models.User), missing)
+        existing = fleet_ids()
+    return [existing[email] for email in emails]
+
+def timestamp_strings(start: datetime.datetime, offsets: np.ndarray, interval: int) -> np.ndarray:
+    # SQLAlchemy's SQLite DateTime text format: "YYYY-MM-DD HH:MM:SS.ffffff"
+    base = np.datetime64(start, "us")
+    stamps = base + (offsets * interval).astype("timedelta64[s]")
+    return np.char.replace(np.datetime_as_string(stamps, unit="us"), "T", " ")
+
+def epoch_seconds(start: datetime.datetime, offsets: np.ndarray, interval: int) -> np.ndarray:
+    # energy_data.ts of each reading. Its default is only applied by SQLAlchemy
+    # inserts, raw loads have to write it.
+    return timeseries.to_epoch(start) + offsets * interval
+
+def load_sqlite(raw, rows):
+    cursor = raw.cursor()
+    cursor.executemany("INSERT INTO energy_data (timestamp, ts, generated_energy, user_id) VALUES (?, ?, ?, ?)", rows)
+    cursor.close()
+
+def load_postgres(raw, rows):
+    buffer = io.StringIO()
+    buffer.writelines(f"{timestamp}\t{ts}\t{value}\t{user_id}\n" for timestamp, ts, value, user_id in rows)
+    buffer.seek(0)
+    cursor = raw.cursor()
+    cursor.copy_expert("COPY energy_data (timestamp, ts, generated_energy, user_id) FROM STDIN", buffer)
+    cursor.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--interval", type=int, default=60, help="Seconds between readings")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start", default=None, help="ISO date of the first reading (default: --days before today)")
+    parser.add_argument("--truncate", action="store_true", help="Delete existing energy_data first")
+    args = parser.parse_args()
+
+    migrations.upgrade(database.engine)
+    start = datetime.datetime.fromisoformat(args.start) if args.start else (
+        datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=args.days))
+    steps = args.days * 86400 // args.interval
+
+    with database.engine.begin() as conn:
+        if args.truncate:
+            conn.execute(models.EnergyData.__table__.delete())
+        user_ids = ensure_users(conn, args.users)
+
+    is_sqlite = database.engine.dialect.name == "sqlite"
+    loader = load_sqlite if is_sqlite else load_postgres
+    total = 0
+    began = time.perf_counter()
+    raw = database.engine.raw_connection()
+    if is_sqlite:
+        # Durability is not worth the write cost for throwaway test data
+        raw.cursor().execute("PRAGMA synchronous=OFF")
+    try:
+        for index, user_id in enumerate(user_ids):
+            offsets, values = user_series(args.seed, index, steps, args.interval)
+            stamps = timestamp_strings(start, offsets, args.interval)
+            epochs = epoch_seconds(start, offsets, args.interval)
+            loader(raw, zip(stamps.tolist(), epochs.tolist(), values.tolist(), [user_id] * len(values)))
+            raw.commit()
+            total += len(values)
+            if (index + 1) % 10 == 0 or index + 1 == len(user_ids):
+                elapsed = time.perf_counter() - began
+                print(f"{index + 1}/{len(user_ids)} users, {total:,} rows, {total / elapsed * 60:,.0f} rows/min")
+    finally:
+        raw.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Latency benchmarks for the API and the ingestion path, checked against a stored baseline.
+
+Usage (from backend/):
+    python -m benchmarks.suite                                  # in-process app, temporary database
+    python -m benchmarks.suite --url http://localhost:8000      # a running uvicorn server
+    python -m benchmarks.suite --save-baseline                  # record benchmarks/baseline.json
+
+Every scenario is warmed up, then run --repeats times; the medians of the
+repeats are what gets recorded and compared. Exits with status 1 when a
+scenario's median p95 latency or throughput regresses past --tolerance, plus
+the spread the repeats themselves showed, relative to the baseline.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Point the app at a throwaway database before anything imports it
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+import httpx
+
+from .common import run_concurrently, summarize, format_row
+
+# Metrics a regression is judged on
+COMPARED = ("p95_ms", "throughput")
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+BENCH_USER = {"email": "bench@example.com", "password": "benchpassword", "full_name": "Bench User"}
+# 1x1 transparent PNG
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+def median_result(repeats: list) -> dict:
+    # Median of every metric over the repeats, plus how far apart the repeats of
+    # each compared metric were, relative to their median
+    result = {key: statistics.median(repeat[key] for repeat in repeats) for key in repeats[0]}
+    for key in COMPARED:
+        values = [repeat[key] for repeat in repeats]
+        result[f"{key}_spread"] = (max(values) - min(values)) / result[key] if result[key] else 0.0
+    return result
+
+def seed_energy_data(rows: int):
+    from app import database, models
+    db = database.SessionLocal()
+    now = datetime.datetime.utcnow()
+    db.bulk_save_objects([
+        models.EnergyData(generated_energy=float(i % 100), timestamp=now - datetime.timedelta(minutes=i))
+        for i in range(rows)
+    ])
+    db.commit()
+    db.close()
+
+async def login(client: httpx.AsyncClient) -> dict:
+    await client.post("/api/auth/register", json=BENCH_USER)
+    response = await client.post("/api/auth/token", data={"username": BENCH_USER["email"], "password": BENCH_USER["password"]})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    # Energy routes need an onboarded user
+    await client.post("/api/onboarding/upload", headers=headers)
+    return headers
+
+def scenarios(client: httpx.AsyncClient, headers: dict):
+    async def token():
+        response = await client.post("/api/auth/token", data={"username": BENCH_USER["email"], "password": BENCH_USER["password"]})
+        return response.status_code == 200
+
+    async def current():
+        response = await client.get("/api/energy/current", headers=headers)
+        return response.status_code == 200
+
+    async def history():
+        response = await client.get("/api/energy/history", params={"limit": 100}, headers=headers)
+        return response.status_code == 200
+
+    async def upload():
+        files = {"energy_pic": ("source.png", PNG_BYTES, "image/png")}
+        response = await client.post("/api/onboarding/upload", files=files, headers=headers)
+        return response.status_code == 200
+
+    return {"auth_token": token, "energy_current": current, "energy_history": history, "onboarding_upload": upload}
+
+async def run_api(args) -> dict:
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+    else:
+        from app.main import app
+        from app.api import onboarding
+        onboarding.UPLOAD_ROOT = tempfile.mkdtemp()
+        seed_energy_data(args.rows)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+
+    results = {}
+    async with client:
+        headers = await login(client)
+        for name, call in scenarios(client, headers).items():
+            if args.only and name not in args.only:
+                continue
+            # bcrypt makes token requests orders of magnitude slower, run fewer of them
+            requests = max(args.requests // 20, 1) if name == "auth_token" else args.requests
+            # Warm-up: connection pool, statement caches, first-call imports
+            await run_concurrently(call, max(requests // 5, min(args.concurrency, requests)), args.concurrency)
+            results[name] = median_result([await run_concurrently(call, requests, args.concurrency) for _ in range(args.repeats)])
+    return results
+
+def run_ingestion(runs: int, repeats: int) -> dict:
+    from app.services import adapters, scheduler
+    from app import migrations, models
+    migrations.upgrade(scheduler.database.engine)
+    warmup = max(runs // 10, 1)
+    first = datetime.datetime.utcnow().replace(microsecond=0) - datetime.timedelta(seconds=warmup + runs * repeats + 1)
+
+    @adapters.register("benchmark")
+    class SteadyAdapter(adapters.SourceAdapter):
+        # A reading a second after the previous one on every poll, so every run
+        # stores one; the mock adapter's readings mostly share a second and would
+        # be quarantined as stale
+        seconds = itertools.count()
+
+        def fetch(self, source, since):
+            return [adapters.Reading(first + datetime.timedelta(seconds=next(self.seconds)), 1.0)]
+
+    db = scheduler.database.SessionLocal()
+    source = models.EnergySource(name="Benchmark source", kind="benchmark")
+    db.add(source)
+    db.commit()
+    source_id = source.id
+    db.close()
+    for _ in range(warmup):
+        scheduler.fetch_energy_data(source_id)
+    results = []
+    for _ in range(repeats):
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(runs):
+            run_start = time.perf_counter()
+            scheduler.fetch_energy_data(source_id)
+            latencies.append(time.perf_counter() - run_start)
+        results.append(summarize(latencies, time.perf_counter() - start))
+    return median_result(results)
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        # A difference no larger than the repeats of this run differed by is noise
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance + result.get("p95_ms_spread", 0.0)):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.2f} ms vs baseline {base['p95_ms']:.2f} ms")
+        if result["throughput"] < base["throughput"] * (1 - tolerance - result.get("throughput_spread", 0.0)):
+            regressions.append(f"{name}: throughput {result['throughput']:.1f}/s vs baseline {base['throughput']:.1f}/s")
+        if result["errors"] > base.get("errors", 0):
+            regressions.append(f"{name}: {result['errors']} errors vs baseline {base.get('errors', 0)}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per API scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=10000, help="Energy rows seeded for the in-process app")
+    parser.add_argument("--ingest-runs", type=int, default=2000, help="fetch_energy_data runs per repeat of the ingestion benchmark")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs of each scenario, compared by their median")
+    parser.add_argument("--only", nargs="*", help="Scenario names to run")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed fractional regression")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = asyncio.run(run_api(args))
+    for name, result in results.items():
+        print(format_row(name, result))
+    if not args.only or "ingestion" in args.only:
+        results["ingestion"] = run_ingestion(args.ingest_runs, args.repeats)
+        print(format_row("ingestion", results["ingestion"], unit="readings/s"))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            rounded = {name: {key: round(value, 2) for key, value in result.items()} for name, result in results.items()}
+            json.dump(rounded, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against, run with --save-baseline to record one")
+        return
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,15 @@
+import json
+import os
+import tempfile
 import pytest
 from starlette.testclient import TestClient
+
+# Keep test runs off the checked-in sql_app.db
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+# Reads right after writes must see them: no reuse of just-finished responses
+os.environ.setdefault("COALESCE_TTL_SECONDS", "0")
+os.environ.setdefault("RESPONSE_CACHE_MAX_BYTES", "0")
+
 from app.main import app
 from app.database import Base, engine, SessionLocal
 
@@ -12,3 +22,48 @@ def test_client():
     client = TestClient(app)
     yield client
     # Cleanup if needed
+
+@pytest.fixture(scope="module")
+def auth_headers(test_client):
+    # Registers (or reuses) a test user and returns a bearer header for it
+    test_client.post("/api/auth/register", json={
+        "email": "uploader@example.com",
+        "password": "strongpassword",
+        "full_name": "Upload User"
+    })
+    response = test_client.post("/api/auth/token", data={
+        "username": "uploader@example.com",
+        "password": "strongpassword"
+    })
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+class EnergyUser:
+    # A registered user, and the requests tests send as that user
+    def __init__(self, client: TestClient, headers: dict, id: int):
+        self.client = client
+        self.headers = headers
+        self.id = id
+
+    def add_source(self, name: str, **fields) -> int:
+        response = self.client.post("/api/energy/sources", json={"name": name, "kind": "push", **fields}, headers=self.headers)
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+
+    def ingest(self, source_id: int, readings) -> dict:
+        # NDJSON push of (timestamp, value) pairs, as a client sends it
+        body = "".join(json.dumps({"timestamp": timestamp.isoformat(), "value": value}) + "\n" for timestamp, value in readings)
+        return self.client.post(f"/api/energy/ingest?source_id={source_id}", content=body,
+                                headers={**self.headers, "Content-Type": "application/x-ndjson"}).json()
+
+@pytest.fixture(scope="module")
+def energy_user(test_client):
+    # Factory: registers (or reuses) {name}@example.com, onboarded unless asked otherwise
+    def register(name: str, onboard: bool = True) -> EnergyUser:
+        credentials = {"username": f"{name}@example.com", "password": f"{name}password"}
+        test_client.post("/api/auth/register", json={"email": credentials["username"], "password": credentials["password"], "full_name": name})
+        token = test_client.post("/api/auth/token", data=credentials).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        if onboard:
+            test_client.post("/api/onboarding/upload", headers=headers)
+        return EnergyUser(test_client, headers, test_client.get("/api/auth/me", headers=headers).json()["id"])
+    return register
@@ -0,0 +1,80 @@
+import datetime
+import numpy as np
+import pytest
+from sqlalchemy import inspect, select
+from app import database, models
+from app.services import archive, columnar, partitions, rollups, timeseries
+
+START = datetime.datetime(2018, 1, 1)
+MINUTES = 3 * 1440
+VALUES = np.round(np.random.default_rng(7).gamma(2.0, 1.5, size=MINUTES), 3)
+MARCH = timeseries.to_epoch(datetime.datetime(2018, 3, 1, 1))
+
+def test_codecs_round_trip():
+    rng = np.random.default_rng(3)
+    micros = np.cumsum(rng.integers(1, 120_000_000, size=1000)) + 1_500_000_000_000_000
+    values = np.concatenate([rng.normal(size=998), [np.nan, -0.0]])
+    flags = rng.random(1000) > 0.9
+    assert np.array_equal(columnar.decode_timestamps(columnar.encode_timestamps(micros), 1000), micros)
+    assert np.array_equal(columnar.decode_values(columnar.encode_values(values), 1000).view(np.uint64), values.view(np.uint64))
+    assert np.array_equal(columnar.decode_flags(columnar.encode_flags(flags), 1000), flags)
+    assert columnar.decode_timestamps(columnar.encode_timestamps([]), 0).size == 0
+
+def test_regular_readings_compress_well():
+    micros = np.arange(1440, dtype=np.int64) * 60_000_000 + 1_500_000_000_000_000
+    values = np.repeat(np.round(np.linspace(0, 5, 48), 2), 30)
+    stored = len(columnar.encode_timestamps(micros)) + len(columnar.encode_values(values))
+    assert 1440 * 16 / stored > 20
+
+@pytest.fixture(scope="module")
+def archived_source(energy_user):
+    user = energy_user("archive")
+    source_id = user.add_source("Archive")
+    user.ingest(source_id, [(START + datetime.timedelta(minutes=i), value) for i, value in enumerate(VALUES.tolist())])
+
+    db = database.SessionLocal()
+    for resolution in rollups.RESOLUTIONS:
+        db.merge(models.RollupState(resolution=resolution, closed_until=timeseries.to_epoch(START)))
+    db.commit()
+    db.close()
+    rollups.compute_rollups(now=MARCH)
+    partitions.maintain(now=MARCH)
+    archive.compact(now=timeseries.to_epoch(datetime.datetime(2018, 6, 1)))
+    return user, source_id
+
+def test_partition_is_replaced_by_chunks(archived_source):
+    _, source_id = archived_source
+    assert "energy_data_201801" not in inspect(database.engine).get_table_names()
+    db = database.SessionLocal()
+    chunks = db.execute(select(models.ArchiveChunk).where(models.ArchiveChunk.source_id == source_id)).scalars().all()
+    db.close()
+    assert [chunk.count for chunk in chunks] == [1440, 1440, 1440]
+
+def test_history_and_stats_read_archives(archived_source):
+    user, source_id = archived_source
+    params = {"source_id": source_id, "start": "2018-01-01T23:00:00", "end": "2018-01-02T01:00:00"}
+    points = user.client.get("/api/energy/history", params={**params, "points": 500}, headers=user.headers).json()["points"]
+    assert [point["generated_energy"] for point in points] == VALUES[1380:1500].tolist()
+    assert points[0]["timestamp"] == "2018-01-01T23:00:00Z"
+
+    hourly = user.client.get("/api/energy/history", params={**params, "points": 2}, headers=user.headers).json()
+    assert hourly["bucket_seconds"] == 3600
+    assert [point["max"] for point in hourly["points"]] == [VALUES[1380:1440].max(), VALUES[1440:1500].max()]
+
+    stats = user.client.get("/api/energy/stats", params=params, headers=user.headers).json()
+    assert stats["total"]["count"] == 120
+    assert stats["total"]["sum"] == pytest.approx(VALUES[1380:1500].sum())
+
+def test_rollup_rebuild_includes_archived_readings(archived_source):
+    user, source_id = archived_source
+    late = START + datetime.timedelta(hours=5, seconds=30)
+    user.ingest(source_id, [(late, 100.0)])
+    rollups.compute_rollups(now=MARCH)
+    db = database.SessionLocal()
+    hour = db.execute(select(models.EnergyRollup).where(
+        models.EnergyRollup.source_id == source_id,
+        models.EnergyRollup.resolution == rollups.HOUR,
+        models.EnergyRollup.bucket == timeseries.to_epoch(START) + 5 * 3600
+    )).scalars().one()
+    db.close()
+    assert hour.count == 61 and hour.max == 100.0
@@ -0,0 +1,50 @@
+import datetime
+from sqlalchemy import create_engine, text
+from app import migrations
+from benchmarks.common import percentile
+from benchmarks.suite import compare, median_result
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([], 99) == 0.0
+
+def test_compare_flags_regressions():
+    baseline = {"energy_current": {"p95_ms": 10.0, "throughput": 100.0, "errors": 0}}
+    assert compare({"energy_current": {"p95_ms": 12.0, "throughput": 90.0, "errors": 0}}, baseline, 0.3) == []
+    regressions = compare({"energy_current": {"p95_ms": 20.0, "throughput": 50.0, "errors": 1}}, baseline, 0.3)
+    assert len(regressions) == 3
+
+def test_fleet_series_is_seeded_and_has_gaps():
+    from benchmarks.generate_fleet import user_series
+    steps = 30 * 1440
+    offsets, values = user_series(7, 3, steps, 60)
+    again_offsets, again_values = user_series(7, 3, steps, 60)
+    assert (offsets == again_offsets).all() and (values == again_values).all()
+    assert 0 < len(offsets) < steps
+    assert (values >= -1).all()
+
+def test_fleet_load_writes_the_epoch_key(tmp_path):
+    from benchmarks.generate_fleet import epoch_seconds, load_sqlite, timestamp_strings, user_series
+    engine = create_engine(f"sqlite:///{tmp_path}/fleet.db")
+    migrations.upgrade(engine)
+    start = datetime.datetime(2024, 1, 1)
+    offsets, values = user_series(7, 3, 1440, 60)
+    raw = engine.raw_connection()
+    load_sqlite(raw, zip(timestamp_strings(start, offsets, 60).tolist(), epoch_seconds(start, offsets, 60).tolist(), values.tolist(), [1] * len(values)))
+    raw.commit()
+    raw.close()
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*), COUNT(ts) FROM energy_data")).one() == (len(values), len(values))
+        assert conn.execute(text("SELECT MIN(ts) FROM energy_data")).scalar() == 1704067200 + int(offsets[0]) * 60
+
+def test_compare_allows_the_spread_of_the_repeats():
+    result = median_result([
+        {"count": 10, "errors": 0, "p95_ms": p95, "throughput": 100.0} for p95 in (10.0, 12.0, 15.0)
+    ])
+    assert result["p95_ms"] == 12.0 and result["p95_ms_spread"] == 5.0 / 12.0
+    # 12 ms is 50% over a 8 ms baseline, but the repeats alone differed by 42%
+    assert compare({"energy_current": result}, {"energy_current": {"p95_ms": 8.0, "throughput": 100.0}}, 0.3) == []
+    assert len(compare({"energy_current": result}, {"energy_current": {"p95_ms": 6.0, "throughput": 100.0}}, 0.3)) == 1
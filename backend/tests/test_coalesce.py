@@ -0,0 +1,45 @@
+import asyncio
+import json
+from fastapi import HTTPException
+from app import schemas
+from app.services import coalesce
+
+def test_concurrent_identical_requests_share_one_computation(monkeypatch):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"generated_energy": 1.5, "count": 1, "timestamp": "2024-01-01T00:00:00"}
+
+    async def burst():
+        return await asyncio.gather(*(coalesce.shared(("test", 1), schemas.HistoryPoint, compute) for _ in range(50)))
+
+    responses = asyncio.run(burst())
+    assert len(calls) == 1
+    assert {response.body for response in responses} == {responses[0].body}
+    assert json.loads(responses[0].body)["timestamp"] == "2024-01-01T00:00:00Z"
+
+    # With a cache window, a finished response is reused by later requests too
+    monkeypatch.setattr(coalesce, "COALESCE_TTL_SECONDS", 60)
+    asyncio.run(burst())
+    asyncio.run(burst())
+    assert len(calls) == 2
+    coalesce.flights.clear()
+
+def test_failures_reach_every_waiter_and_are_not_reused(monkeypatch):
+    monkeypatch.setattr(coalesce, "COALESCE_TTL_SECONDS", 60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise HTTPException(status_code=404, detail="No energy data found")
+
+    async def burst():
+        return await asyncio.gather(*(coalesce.shared(("test", 2), schemas.EnergyData, compute) for _ in range(5)), return_exceptions=True)
+
+    assert all(isinstance(result, HTTPException) and result.status_code == 404 for result in asyncio.run(burst()))
+    asyncio.run(burst())
+    assert len(calls) == 2
+    assert ("test", 2) not in coalesce.flights
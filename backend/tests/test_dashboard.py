@@ -0,0 +1,27 @@
+import datetime
+
+def test_dashboard_returns_everything_in_one_request(energy_user):
+    user = energy_user("dashboard")
+    source_id = user.add_source("Dashboard")
+    now = datetime.datetime.utcnow().replace(second=0, microsecond=0)
+    user.ingest(source_id, [(now - datetime.timedelta(minutes=i), 2.0) for i in range(120, 0, -1)])
+
+    response = user.client.get("/api/dashboard", headers=user.headers)
+    assert response.status_code == 200, response.text
+    dashboard = response.json()
+    assert dashboard["user"]["email"] == "dashboard@example.com" and dashboard["user"]["is_onboarded"]
+    assert dashboard["current"] == user.client.get("/api/energy/current", headers=user.headers).json()
+    # Global readings from other tests may share the window
+    assert dashboard["stats"]["count"] >= 120 and dashboard["stats"]["max"] >= 2.0
+    points = dashboard["history"]["points"]
+    assert sum(point["count"] for point in points) == dashboard["stats"]["count"]
+    assert points == sorted(points, key=lambda point: point["timestamp"])
+
+def test_dashboard_before_onboarding_returns_profile_only(energy_user):
+    user = energy_user("dashboard-new", onboard=False)
+    dashboard = user.client.get("/api/dashboard", headers=user.headers).json()
+    assert dashboard["user"]["is_onboarded"] is False
+    assert dashboard["current"] is None and dashboard["history"] is None
+
+def test_dashboard_requires_a_token(test_client):
+    assert test_client.get("/api/dashboard").status_code == 401
@@ -0,0 +1,14 @@
+from sqlalchemy import text
+from app import database
+
+def test_sqlite_pragmas_applied():
+    with database.engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar().lower() == database.SQLITE_JOURNAL_MODE.lower()
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == database.SQLITE_BUSY_TIMEOUT_MS
+
+def test_pool_status_reports_checkouts():
+    with database.engine.connect():
+        status = database.pool_status()
+        assert status["primary"]["in_use"] >= 1
+    assert status["primary"]["checkouts"] >= 1
+    assert status["primary"]["size"] == database.POOL_SIZE
@@ -0,0 +1,93 @@
+import datetime
+import numpy as np
+import pytest
+from sqlalchemy import select, func
+from app import database, models
+from app.services import deadband, latest, rollups, timeseries
+
+START = datetime.datetime(2023, 11, 1)
+MINUTES = 6 * 60
+# A slow ramp up, a plateau and a ramp down, one reading a minute
+VALUES = np.round(np.interp(np.arange(MINUTES), [0, 120, 240, MINUTES - 1], [0.0, 6.0, 6.0, 1.0]), 4)
+
+def readings(values):
+    return [{"timestamp": START + datetime.timedelta(minutes=i), "generated_energy": value, "is_outlier": False}
+            for i, value in enumerate(values)]
+
+def test_compress_keeps_turning_points():
+    values = np.interp(np.arange(60), [0, 20, 40, 59], [0.0, 2.0, 2.0, 1.0]).tolist()
+    kept, state = deadband.compress(readings(values), 0.01, None)
+    # The first reading and the ends of both ramps; the last reading is still held
+    assert [row["timestamp"] for row in kept] == [START + datetime.timedelta(minutes=m) for m in (0, 20, 40)]
+    assert state["held"]["generated_energy"] == values[-1]
+    assert state["received"] == 60 and state["stored"] == 3
+
+def test_compress_stores_at_least_every_max_seconds():
+    kept, _ = deadband.compress(readings([1.0] * 180), 0.5, None)
+    assert len(kept) == 3
+
+@pytest.fixture(scope="module")
+def deadband_source(energy_user):
+    user = energy_user("deadband")
+    source_id = user.add_source("Deadband", interval_seconds=60, deadband=0.05)
+    noisy = VALUES + np.random.default_rng(5).uniform(-0.02, 0.02, size=MINUTES)
+    return user, source_id, user.ingest(source_id, [(START + datetime.timedelta(minutes=i), value) for i, value in enumerate(noisy.tolist())])
+
+def test_ingest_reports_compression(test_client, deadband_source):
+    user, source_id, result = deadband_source
+    assert result["accepted"] == MINUTES and result["stored"] < MINUTES / 20
+    assert result["compression_ratio"] > 20
+    source = next(s for s in test_client.get("/api/energy/sources", headers=user.headers).json() if s["id"] == source_id)
+    assert source["compression_ratio"] == result["compression_ratio"]
+
+def test_history_interpolates_between_stored_points(test_client, deadband_source):
+    user, source_id, _ = deadband_source
+    params = {"source_id": source_id, "start": START.isoformat(), "end": (START + datetime.timedelta(minutes=MINUTES)).isoformat(), "points": 1000}
+    body = test_client.get("/api/energy/history", params=params, headers=user.headers).json()
+    assert body["interpolated"] is True
+    points = body["points"]
+    assert len(points) == MINUTES
+    assert points[90]["timestamp"] == (START + datetime.timedelta(minutes=90)).isoformat() + "Z"
+    # Within the deadband of the noisy readings, which are within 0.02 of VALUES
+    assert np.abs(np.array([point["generated_energy"] for point in points]) - VALUES).max() < 0.07
+
+def test_rebuild_fills_the_interval_but_not_outages():
+    times, values = deadband.rebuild([0, 300, 300 + 2 * deadband.DEADBAND_MAX_SECONDS], [0.0, 5.0, 1.0], 60, 0, 10 ** 6)
+    assert times.tolist() == [0, 60, 120, 180, 240, 300, 300 + 2 * deadband.DEADBAND_MAX_SECONDS]
+    assert values.tolist() == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 1.0]
+
+def test_stats_and_buckets_count_every_reading_received(test_client, deadband_source):
+    user, source_id, _ = deadband_source
+    window = {"source_id": source_id, "start": START.isoformat(), "end": (START + datetime.timedelta(minutes=MINUTES)).isoformat()}
+    total = test_client.get("/api/energy/stats", params=window, headers=user.headers).json()["total"]
+    assert total["count"] == MINUTES
+    assert abs(total["sum"] - VALUES.sum()) < 0.07 * MINUTES
+    points = test_client.get("/api/energy/history", params={**window, "points": 6}, headers=user.headers).json()["points"]
+    assert [point["count"] for point in points] == [60] * 6
+
+def test_rollups_count_every_reading_received(deadband_source):
+    _, source_id, _ = deadband_source
+    db = database.SessionLocal()
+    rollups.rebuild(db, rollups.HOUR, timeseries.to_epoch(START), timeseries.to_epoch(START) + MINUTES * 60)
+    db.commit()
+    rolled = db.execute(select(func.sum(models.EnergyRollup.count), func.sum(models.EnergyRollup.sum)).where(
+        models.EnergyRollup.source_id == source_id, models.EnergyRollup.resolution == rollups.HOUR
+    )).one()
+    db.close()
+    assert rolled[0] == MINUTES and abs(rolled[1] - VALUES.sum()) < 0.07 * MINUTES
+
+def test_current_shows_the_held_reading(test_client, deadband_source, monkeypatch):
+    user, source_id, _ = deadband_source
+    # Newer than any other reading the user can see; the newest reading is always held
+    now = datetime.datetime.utcnow().replace(microsecond=0) - datetime.timedelta(seconds=1)
+    user.ingest(source_id, [(now, 7.0)])
+    for _ in ("shared table", "database"):
+        current = test_client.get("/api/energy/current", headers=user.headers).json()
+        assert current["timestamp"] == now.isoformat() + "Z"
+        assert current["generated_energy"] == 7.0 and current["id"] is None
+        monkeypatch.setattr(latest, "read", lambda user_id: (False, None))
+
+def test_negative_deadband_is_rejected(test_client, deadband_source):
+    user, _, _ = deadband_source
+    response = test_client.post("/api/energy/sources", json={"name": "Bad", "kind": "push", "deadband": -1}, headers=user.headers)
+    assert response.status_code == 400
@@ -0,0 +1,65 @@
+import datetime
+import pytest
+from app import database, models
+from app.services import history, rollups, timeseries
+
+START = datetime.datetime(2023, 9, 1)
+HOURS = 72
+
+@pytest.fixture(scope="module")
+def history_source(energy_user):
+    user = energy_user("history")
+    source_id = user.add_source("History", interval_seconds=60)
+    result = user.ingest(source_id, [(START + datetime.timedelta(minutes=i), float(i % 60)) for i in range(HOURS * 60)])
+    assert result["accepted"] == HOURS * 60
+    return user, source_id
+
+def get_history(user, source_id, start, end, points):
+    response = user.client.get("/api/energy/history", params={"source_id": source_id, "start": start.isoformat(), "end": end.isoformat(), "points": points}, headers=user.headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_choose_prefers_rollups_for_long_ranges():
+    day = rollups.DAY
+    closed = {rollups.HOUR: 30 * day, rollups.DAY: 30 * day}
+    # An hour of minute readings fits in 100 points: raw rows as-is
+    assert history.choose(0, 3600, 100, 1 / 60, 1, closed) == history.HistoryPlan("raw", None, [("raw", 0, 3600)], 60)
+    # A month at 100 points: 12 hour buckets, which only hourly rollups nest in
+    plan = history.choose(0, 30 * day, 100, 1 / 60, 1, closed)
+    assert plan.tier == "rollup" and plan.bucket == 12 * 3600
+    assert plan.segments == [(rollups.HOUR, 0, 30 * day)] and plan.estimated_rows == 720
+    # The open tail beyond closed_until is read raw
+    plan = history.choose(0, 32 * day, 100, 1 / 60, 1, closed)
+    assert plan.tier == "mixed" and plan.segments[-1] == ("raw", 30 * day, 32 * day)
+
+def test_short_range_returns_raw_readings(history_source):
+    user, source_id = history_source
+    body = get_history(user, source_id, START, START + datetime.timedelta(hours=1), 100)
+    assert body["tier"] == "raw" and body["bucket_seconds"] is None
+    assert [point["generated_energy"] for point in body["points"]] == [float(i) for i in range(60)]
+
+def test_long_range_downsamples(history_source):
+    user, source_id = history_source
+    end = START + datetime.timedelta(hours=HOURS)
+    raw = get_history(user, source_id, START, end, 72)
+    assert raw["tier"] == "raw" and raw["bucket_seconds"] == 3600
+
+    db = database.SessionLocal()
+    for resolution in rollups.RESOLUTIONS:
+        db.merge(models.RollupState(resolution=resolution, closed_until=timeseries.to_epoch(START)))
+    db.commit()
+    db.close()
+    rollups.compute_rollups(now=timeseries.to_epoch(end + datetime.timedelta(hours=1)))
+
+    rolled = get_history(user, source_id, START, end, 72)
+    assert rolled["tier"] == "rollup"
+    assert rolled["points"] == raw["points"]
+    assert [point["count"] for point in rolled["points"]] == [60] * HOURS
+    assert rolled["points"][0]["generated_energy"] == pytest.approx(29.5)
+    assert rolled["points"][0]["max"] == 59.0
+
+def test_history_without_range_keeps_last_readings(history_source):
+    user, _ = history_source
+    response = user.client.get("/api/energy/history", params={"limit": 5}, headers=user.headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 5
@@ -0,0 +1,88 @@
+import json
+import msgpack
+from starlette.testclient import TestClient
+from app import database, models
+from app.services import ingest
+
+def push_source(test_client: TestClient, auth_headers):
+    response = test_client.post("/api/energy/sources", json={"name": "Push", "kind": "push"}, headers=auth_headers)
+    assert response.status_code == 200
+    return response.json()["id"]
+
+def count_readings(source_id):
+    db = database.SessionLocal()
+    count = db.query(models.EnergyData).filter(models.EnergyData.source_id == source_id).count()
+    db.close()
+    return count
+
+def test_ndjson_stream_is_stored_in_batches(test_client: TestClient, auth_headers, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_BATCH_SIZE", 1000)
+    source_id = push_source(test_client, auth_headers)
+    lines = (json.dumps({"timestamp": 1704067200 + i * 60, "value": i / 1000, "unit": "MWh"}) + "\n" for i in range(20000))
+
+    response = test_client.post(
+        f"/api/energy/ingest?source_id={source_id}",
+        content=(line.encode() for line in lines),
+        headers={**auth_headers, "Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"accepted": 20000, "stored": 20000, "rejected": 0, "errors": []}
+    assert count_readings(source_id) == 20000
+
+def test_invalid_records_are_rejected_with_reasons(test_client: TestClient, auth_headers):
+    source_id = push_source(test_client, auth_headers)
+    records = [
+        {"timestamp": "2024-01-01T00:00:00Z", "value": 1.5},
+        {"timestamp": "2024-01-01T00:01:00Z", "value": 1500, "unit": "kWh"},
+        {"timestamp": "2024-01-01T00:02:00Z", "value": -1},
+        {"value": 2.0},
+    ]
+    body = b"".join(msgpack.packb(record) for record in records)
+
+    response = test_client.post(
+        f"/api/energy/ingest?source_id={source_id}",
+        content=body,
+        headers={**auth_headers, "Content-Type": "application/msgpack"}
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["accepted"] == 1 and result["rejected"] == 3
+    assert [error["record"] for error in result["errors"]] == [2, 3, 4]
+    assert "MWh" in result["errors"][0]["error"]
+
+def test_ingest_rejects_unknown_content_and_foreign_sources(test_client: TestClient, auth_headers):
+    source_id = push_source(test_client, auth_headers)
+    response = test_client.post(f"/api/energy/ingest?source_id={source_id}", content=b"{}", headers={**auth_headers, "Content-Type": "text/plain"})
+    assert response.status_code == 415
+    response = test_client.post("/api/energy/ingest?source_id=999999", content=b"", headers={**auth_headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 404
+
+def test_truncated_msgpack_stream_reports_error(test_client: TestClient, auth_headers):
+    source_id = push_source(test_client, auth_headers)
+    body = msgpack.packb({"timestamp": 1704067200, "value": 1.0}) + msgpack.packb({"timestamp": 1704067260, "value": 2.0})[:-3]
+    response = test_client.post(
+        f"/api/energy/ingest?source_id={source_id}",
+        content=body,
+        headers={**auth_headers, "Content-Type": "application/msgpack"}
+    )
+    assert response.status_code == 400
+    assert response.json()["accepted"] == 1
+
+def test_retried_push_stores_nothing_twice(test_client: TestClient, auth_headers, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_BATCH_SIZE", 3)
+    source_id = push_source(test_client, auth_headers)
+
+    def push(minutes):
+        body = "".join(json.dumps({"timestamp": 1704067200 + minute * 60, "value": 1.0}) + "\n" for minute in minutes)
+        return test_client.post(f"/api/energy/ingest?source_id={source_id}", content=body,
+                                headers={**auth_headers, "Content-Type": "application/x-ndjson"}).json()
+
+    assert push(range(5))["stored"] == 5
+    # The client lost the response and sends the request again, after a late reading
+    result = push([-1, 0, 1, 2, 3, 4])
+    assert (result["accepted"], result["stored"], result["rejected"]) == (1, 1, 5)
+    assert [error["record"] for error in result["errors"]] == [2, 3, 4, 5, 6]
+    assert count_readings(source_id) == 6
+    db = database.SessionLocal()
+    assert db.query(models.QuarantinedReading).filter(models.QuarantinedReading.source_id == source_id, models.QuarantinedReading.reason == "duplicate").count() == 5
+    db.close()
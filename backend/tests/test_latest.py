@@ -0,0 +1,102 @@
+import datetime
+import uuid
+from multiprocessing import shared_memory
+import pytest
+from app import database, models
+from app.services import latest
+
+@pytest.fixture
+def shared_table(monkeypatch):
+    monkeypatch.setattr(latest, "LATEST_SHM_NAME", f"energy_latest_test_{uuid.uuid4().hex[:8]}")
+    monkeypatch.setattr(latest, "LATEST_SLOTS", 1024)
+    assert latest.attach()
+    yield
+    name = latest.memory.name
+    latest.detach()
+    shared_memory.SharedMemory(name).unlink()
+
+@pytest.fixture(scope="module")
+def latest_user(energy_user):
+    return energy_user("latest")
+
+def test_current_is_answered_from_the_shared_table(latest_user, shared_table):
+    user = latest_user
+    source_id = user.add_source("Latest")
+    newest = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(minutes=1)
+    user.ingest(source_id, [(newest, 7.25)])
+
+    found, reading = latest.read(user.id)
+    assert found and reading.source_id == source_id and reading.generated_energy == 7.25
+    current = user.client.get("/api/energy/current", headers=user.headers).json()
+    assert current["timestamp"] == newest.isoformat() + "Z" and current["generated_energy"] == 7.25
+    # Same answer as the database, id included
+    latest.detach()
+    assert user.client.get("/api/energy/current", headers=user.headers).json() == current
+    latest.attach()
+
+    # Older readings never move a slot back
+    user.ingest(source_id, [(newest - datetime.timedelta(hours=1), 1.0)])
+    assert latest.read(user.id)[1].generated_energy == 7.25
+
+def test_torn_slot_falls_back_to_the_database(latest_user, shared_table):
+    user = latest_user
+    found, reading = latest.read(user.id)
+    assert found
+    # A writer in the middle of updating the slot
+    index = latest.slot(reading.source_id, reading.user_id)
+    latest.slots["seq"][index] += 1
+    assert latest.read(user.id) == (False, None)
+    latest.slots["seq"][index] += 1
+    assert latest.read(user.id)[0]
+
+def test_table_is_not_used_before_it_is_filled(latest_user, monkeypatch):
+    monkeypatch.setattr(latest, "LATEST_SHM_NAME", f"energy_latest_test_{uuid.uuid4().hex[:8]}")
+    assert latest.attach(warm=False)
+    try:
+        assert latest.read(latest_user.id) == (False, None)
+    finally:
+        name = latest.memory.name
+        latest.detach()
+        shared_memory.SharedMemory(name).unlink()
+
+def store_directly(user_id, timestamp, value):
+    # As bulk loads and manual SQL do, around store_readings
+    db = database.SessionLocal()
+    db.add(models.EnergyData(timestamp=timestamp, generated_energy=value, user_id=user_id))
+    db.commit()
+    db.close()
+
+def test_readings_without_a_source_are_kept_per_user(energy_user, monkeypatch):
+    first, second = energy_user("nosource-a", onboard=False).id, energy_user("nosource-b", onboard=False).id
+    newest = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(minutes=5)
+    store_directly(first, newest, 1.5)
+    store_directly(second, newest - datetime.timedelta(seconds=1), 2.5)
+    monkeypatch.setattr(latest, "LATEST_SHM_NAME", f"energy_latest_test_{uuid.uuid4().hex[:8]}")
+    assert latest.attach()
+    try:
+        assert latest.read(first)[1].generated_energy == 1.5
+        assert latest.read(second)[1].generated_energy == 2.5
+
+        # Written while no process had the table mapped: the next one to attach catches up
+        latest.detach()
+        store_directly(second, newest + datetime.timedelta(seconds=1), 3.5)
+        assert latest.attach()
+        found, reading = latest.read(second)
+        assert found and reading.generated_energy == 3.5 and reading.source_id is None and reading.user_id == second
+        assert latest.read(first)[1].generated_energy == 1.5
+    finally:
+        name = latest.memory.name
+        latest.detach()
+        shared_memory.SharedMemory(name).unlink()
+
+def test_slots_assigned_after_the_index_was_built_are_read(latest_user, shared_table):
+    user = latest_user
+    assert latest.read(user.id)[0]
+    built = latest.indexed
+    # A source of the user's the table has not seen yet, as another process would store it
+    newest = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(hours=1)
+    latest.update([{"id": 1, "source_id": 1000, "user_id": user.id, "timestamp": newest, "generated_energy": 4.5}])
+    found, reading = latest.read(user.id)
+    assert latest.indexed == built + 1
+    assert found and reading.source_id == 1000 and reading.generated_energy == 4.5
+    assert 1000 in latest.by_user[user.id]
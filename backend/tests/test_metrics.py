@@ -0,0 +1,32 @@
+from starlette.testclient import TestClient
+from app import metrics
+from app.services import scheduler
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "Test histogram.", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    histogram.observe(5, route="/a")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{route="/a"} 3' in lines
+
+def test_metrics_endpoint(test_client: TestClient):
+    from app import database, models
+    test_client.get("/")
+    db = database.SessionLocal()
+    source = models.EnergySource(name="Metrics source", kind="mock")
+    db.add(source)
+    db.commit()
+    scheduler.fetch_energy_data(source.id)
+    db.close()
+    response = test_client.get("/metrics")
+    assert response.status_code == 200
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/",status="200"}' in body
+    assert 'energy_ingest_readings_total{source="mock"}' in body
+    assert 'scheduler_job_duration_seconds_count{job="fetch_energy_data"}' in body
+    assert 'db_query_duration_seconds_count{engine="primary",operation="INSERT"}' in body
+    assert 'db_pool_connections_in_use{pool="primary"}' in body
@@ -0,0 +1,167 @@
+import datetime
+import os
+import pytest
+from sqlalchemy import create_engine, inspect, select, func, text
+from sqlalchemy.orm import Session
+from app import database, migrations, models
+from app.services import partitions, rollups, timeseries
+
+START = datetime.datetime(2019, 1, 1)
+HOURS = (31 + 28) * 24
+MARCH = timeseries.to_epoch(datetime.datetime(2019, 3, 1, 1))
+
+@pytest.fixture(scope="module")
+def partition_source(energy_user):
+    user = energy_user("partitions")
+    source_id = user.add_source("Partitions", interval_seconds=3600)
+    user.ingest(source_id, [(START + datetime.timedelta(hours=i), 1.0) for i in range(HOURS)])
+    return user, source_id
+
+def roll_up_and_seal():
+    db = database.SessionLocal()
+    for resolution in rollups.RESOLUTIONS:
+        db.merge(models.RollupState(resolution=resolution, closed_until=timeseries.to_epoch(START)))
+    db.commit()
+    db.close()
+    rollups.compute_rollups(now=MARCH)
+    partitions.maintain(now=MARCH)
+
+def stats_count(user, source_id, start, end):
+    response = user.client.get("/api/energy/stats", params={"source_id": source_id, "start": start.isoformat(), "end": end.isoformat()}, headers=user.headers)
+    assert response.status_code == 200, response.text
+    return response.json()["total"]["count"]
+
+def test_month_helpers():
+    january = timeseries.to_epoch(START)
+    assert partitions.month_start(january + 86400 * 40) == timeseries.to_epoch(datetime.datetime(2019, 2, 1))
+    assert partitions.next_month(timeseries.to_epoch(datetime.datetime(2019, 12, 1))) == timeseries.to_epoch(datetime.datetime(2020, 1, 1))
+    assert partitions.partition_name(january) == "energy_data_201901"
+
+def test_rolled_up_months_are_sealed(partition_source):
+    user, source_id = partition_source
+    window = (datetime.datetime(2019, 1, 31, 12), datetime.datetime(2019, 2, 1, 12))
+    assert stats_count(user, source_id, *window) == 24
+
+    roll_up_and_seal()
+    tables = inspect(database.engine).get_table_names()
+    assert "energy_data_201901" in tables and "energy_data_201902" in tables
+    db = database.SessionLocal()
+    assert db.scalar(select(func.count()).select_from(models.EnergyData).where(models.EnergyData.source_id == source_id)) == 0
+    db.close()
+    # Raw reads union the sealed months back in, across the month boundary
+    assert stats_count(user, source_id, *window) == 24
+    response = user.client.get("/api/energy/history", params={
+        "source_id": source_id, "start": window[0].isoformat(), "end": window[1].isoformat(), "points": 100
+    }, headers=user.headers)
+    assert len(response.json()["points"]) == 24
+
+def test_late_reading_for_a_sealed_month_stays_readable(partition_source):
+    user, source_id = partition_source
+    late = datetime.datetime(2019, 1, 10, 0, 30)
+    assert user.ingest(source_id, [(late, 2.0)])["accepted"] == 1
+    day = (datetime.datetime(2019, 1, 10), datetime.datetime(2019, 1, 11))
+    assert stats_count(user, source_id, *day) == 25
+
+    # The sealed table is not reopened, the reading stays in energy_data
+    roll_up_and_seal()
+    db = database.SessionLocal()
+    assert db.scalar(select(func.count()).select_from(models.EnergyData).where(models.EnergyData.source_id == source_id)) == 1
+    assert db.scalar(select(func.count()).select_from(partitions.partition_table("energy_data_201901"))) == 31 * 24
+    db.close()
+    assert stats_count(user, source_id, *day) == 25
+
+def test_retention_drops_partitions_but_keeps_rollups(partition_source, monkeypatch):
+    user, source_id = partition_source
+    monkeypatch.setattr(partitions, "RAW_RETENTION_DAYS", 30)
+    partitions.maintain(now=timeseries.to_epoch(datetime.datetime(2019, 4, 15)))
+    tables = inspect(database.engine).get_table_names()
+    assert "energy_data_201901" not in tables and "energy_data_201902" not in tables
+    db = database.SessionLocal()
+    assert db.get(models.EnergyPartition, "energy_data_201901") is None
+    db.close()
+    # Long windows are still answered from the rollups
+    assert stats_count(user, source_id, START, datetime.datetime(2019, 3, 1)) == HOURS + 1
+
+    # New readings from before the cutoff are quarantined rather than stored
+    monkeypatch.setattr(partitions, "retention_cutoff", lambda now=None: datetime.datetime(2019, 3, 16))
+    result = user.ingest(source_id, [(datetime.datetime(2019, 2, 2), 1.0)])
+    assert result["accepted"] == 0 and result["rejected"] == 1
+
+def test_upgrade_fills_epoch_key_of_existing_readings(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    models.EnergyPartition.__table__.create(engine)
+    with engine.begin() as conn:
+        for table in ("energy_data", "energy_data_201712"):
+            conn.execute(text(f"CREATE TABLE {table} (id INTEGER, timestamp DATETIME, generated_energy FLOAT, user_id INTEGER, source_id INTEGER, is_outlier BOOLEAN)"))
+            conn.execute(text(f"CREATE INDEX ix_{table}_timestamp ON {table} (timestamp)"))
+        conn.execute(text("INSERT INTO energy_data (id, timestamp, generated_energy) VALUES (1, '2018-01-01 00:00:59.500000', 1.0)"))
+        conn.execute(text("INSERT INTO energy_data_201712 (id, timestamp, generated_energy) VALUES (1, '2017-12-31 23:00:00.000000', 2.0)"))
+        # Stored twice in one second before readings were unique per source and second
+        conn.execute(text("INSERT INTO energy_data (id, timestamp, generated_energy, source_id) VALUES (2, '2018-01-01 00:01:00.100000', 1.0, 1), (3, '2018-01-01 00:01:00.700000', 1.0, 1)"))
+        conn.execute(text("INSERT INTO energy_partitions (name, period_start, period_end, native) VALUES ('energy_data_201712', 1512086400, 1514764800, 0)"))
+    migrations.upgrade(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT id FROM energy_data WHERE source_id = 1")).scalars().all() == [2]
+        assert conn.execute(text("SELECT ts FROM energy_data WHERE id = 1")).scalar() == timeseries.to_epoch(datetime.datetime(2018, 1, 1, 0, 0, 59))
+        assert conn.execute(text("SELECT ts FROM energy_data_201712")).scalar() == timeseries.to_epoch(datetime.datetime(2017, 12, 31, 23))
+    inspector = inspect(engine)
+    for table in ("energy_data", "energy_data_201712"):
+        indexes = {index["name"] for index in inspector.get_indexes(table)}
+        assert {f"ix_{table}_ts", f"uq_{table}_source_ts"} <= indexes and f"ix_{table}_timestamp" not in indexes
+
+def add_readings(engine, timestamps, source_id=1):
+    with engine.begin() as conn:
+        conn.execute(timeseries.insert_readings(engine.dialect.name), [
+            {"timestamp": timestamp, "ts": timeseries.to_epoch(timestamp), "generated_energy": 1.0, "source_id": source_id}
+            for timestamp in timestamps
+        ])
+
+def test_sealing_a_month_that_is_most_of_energy_data_renames_it(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/rotate.db")
+    migrations.upgrade(engine)
+    march = [datetime.datetime(2020, 3, 1) + datetime.timedelta(hours=i) for i in range(31 * 24)]
+    add_readings(engine, march + [datetime.datetime(2020, 1, 5), datetime.datetime(2020, 4, 1), datetime.datetime(2020, 4, 2)])
+    rotated = []
+    rotate = partitions.rotate
+    monkeypatch.setattr(partitions, "rotate", lambda db, start, end: rotated.append(start) or rotate(db, start, end))
+    with Session(engine) as db:
+        assert partitions.seal(db, timeseries.to_epoch(march[0]), timeseries.to_epoch(datetime.datetime(2020, 4, 1))) == 31 * 24
+    # Only the three readings of other months were copied
+    assert rotated == [timeseries.to_epoch(march[0])]
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM energy_data_202003")).scalar() == 31 * 24
+        assert conn.execute(text("SELECT COUNT(*) FROM energy_data")).scalar() == 3
+    inspector = inspect(engine)
+    assert {"ix_energy_data_202003_ts", "uq_energy_data_202003_source_ts"} <= {index["name"] for index in inspector.get_indexes("energy_data_202003")}
+    assert {"ix_energy_data_ts", "uq_energy_data_source_ts"} <= {index["name"] for index in inspector.get_indexes("energy_data")}
+    # The new energy_data still takes readings once per source and second
+    add_readings(engine, [datetime.datetime(2020, 4, 2), datetime.datetime(2020, 4, 3)])
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM energy_data")).scalar() == 4
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="needs a scratch PostgreSQL database in TEST_POSTGRES_URL")
+def test_postgres_months_get_their_own_partitions():
+    engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    # An energy_data from before partitioning
+    models.Base.metadata.create_all(engine)
+    add_readings(engine, [datetime.datetime(2020, 1, 31, 23), datetime.datetime(2020, 2, 1), datetime.datetime(2020, 2, 2)], source_id=None)
+    migrations.upgrade(engine)
+    with engine.connect() as conn:
+        partitioned = conn.execute(text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'energy_data'::regclass")).scalars().all()
+        assert set(partitioned) == {"energy_data_default", "energy_data_202001", "energy_data_202002"}
+        assert conn.execute(text("SELECT COUNT(*) FROM energy_data_202002")).scalar() == 2
+        assert conn.execute(text("SELECT COUNT(*) FROM energy_data_default")).scalar() == 0
+
+    # A reading for the current month that arrived before its partition
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    add_readings(engine, [now], source_id=None)
+    with Session(engine) as db:
+        partitions.create_ahead(db, timeseries.to_epoch(now))
+    current = partitions.partition_name(timeseries.to_epoch(now))
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {current}")).scalar() == 1
+        assert conn.execute(text("SELECT COUNT(*) FROM energy_data_default")).scalar() == 0
+        assert conn.execute(text("SELECT COUNT(*) FROM energy_partitions WHERE native")).scalar() == 3 + partitions.PARTITION_PREMAKE_MONTHS
@@ -0,0 +1,38 @@
+from starlette.testclient import TestClient
+from app import profiling
+
+def test_profile_requires_token(test_client: TestClient, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    response = test_client.get("/?profile=sample")
+    assert "x-profile-file" not in response.headers
+    response = test_client.get("/?profile=sample", headers={"X-Profile-Token": "wrong"})
+    assert "x-profile-file" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+def test_profile_writes_file(test_client: TestClient, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    headers = {"X-Profile-Token": "secret"}
+
+    response = test_client.get("/?profile=sample", headers=headers)
+    assert response.status_code == 200
+    assert (tmp_path / response.headers["x-profile-file"]).exists()
+
+    response = test_client.get("/", headers={**headers, "X-Profile": "cprofile"})
+    profile = tmp_path / response.headers["x-profile-file"]
+    assert profile.suffix == ".prof"
+    assert profile.stat().st_size > 0
+
+def test_overlapping_profiles_are_refused(test_client: TestClient, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    headers = {"X-Profile-Token": "secret", "X-Profile": "cprofile"}
+    # As if another request were being profiled
+    with profiling.profile_lock:
+        response = test_client.get("/", headers=headers)
+        assert response.status_code == 409
+        assert "x-profile-file" not in response.headers
+        # Unflagged requests are not held up
+        assert test_client.get("/").status_code == 200
+    assert test_client.get("/", headers=headers).status_code == 200
@@ -0,0 +1,27 @@
+import logging
+from sqlalchemy import text
+from starlette.testclient import TestClient
+from app import database, query_tracking
+
+def test_repeated_statements_flagged():
+    with query_tracking.track_queries("job", "test") as queries:
+        with database.engine.connect() as conn:
+            for i in range(query_tracking.N_PLUS_ONE_THRESHOLD):
+                conn.execute(text("SELECT id FROM users WHERE id = :id"), {"id": i})
+            conn.execute(text("SELECT count(*) FROM users"))
+    assert queries.count == query_tracking.N_PLUS_ONE_THRESHOLD + 1
+    assert queries.repeated_statements == [("SELECT id FROM users WHERE id = ?", query_tracking.N_PLUS_ONE_THRESHOLD)]
+
+def test_slow_query_logged_with_plan(monkeypatch, caplog):
+    monkeypatch.setattr(query_tracking, "SLOW_QUERY_MS", 0)
+    with caplog.at_level(logging.WARNING, logger="app.query_tracking"):
+        with database.engine.connect() as conn:
+            conn.execute(text("SELECT id FROM users WHERE email = :email"), {"email": "nobody@example.com"})
+    message = caplog.records[-1].getMessage()
+    assert "Slow query" in message
+    assert "nobody@example.com" in message
+    assert "users" in message.split("\n", 1)[1]
+
+def test_request_query_count_header(test_client: TestClient, auth_headers):
+    response = test_client.get("/api/auth/me", headers=auth_headers)
+    assert response.headers["X-Query-Count"] == "1"
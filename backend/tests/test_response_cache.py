@@ -0,0 +1,133 @@
+import asyncio
+import datetime
+import uuid
+from multiprocessing import shared_memory
+import pytest
+from app import schemas
+from app.services import response_cache, timeseries
+
+START = datetime.datetime(2023, 3, 1)
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_MAX_BYTES", 1024 * 1024)
+    name = f"energy_changes_test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_SHM_NAME", name)
+    assert response_cache.attach()
+    yield
+    response_cache.detach()
+    shared_memory.SharedMemory(name).unlink()
+
+@pytest.fixture(scope="module")
+def cache_sources(energy_user):
+    user = energy_user("cache")
+    sources = [user.add_source(name) for name in ("A", "B")]
+    for source_id in sources:
+        ingest(user, source_id, [START + datetime.timedelta(minutes=i) for i in range(0, 120, 2)])
+    return user, sources
+
+def ingest(user, source_id, timestamps):
+    user.ingest(source_id, [(timestamp, 1.0) for timestamp in timestamps])
+
+def stats_count(user, source_id, start, end):
+    params = {"source_id": source_id, "start": start.isoformat(), "end": end.isoformat(), "percentiles": "50"}
+    return user.client.get("/api/energy/stats", params=params, headers=user.headers).json()["total"]["count"]
+
+def test_closed_window_is_kept_until_a_reading_lands_in_it(cache_sources, cache):
+    user, (source_a, source_b) = cache_sources
+    first_hour = (START, START + datetime.timedelta(hours=1))
+    assert stats_count(user, source_a, *first_hour) == 30
+    assert len(response_cache.entries) == 1
+
+    # Later readings, and readings of another source, leave it cached
+    ingest(user, source_a, [START + datetime.timedelta(hours=3)])
+    ingest(user, source_b, [START + datetime.timedelta(minutes=31)])
+    assert stats_count(user, source_a, *first_hour) == 30
+    assert len(response_cache.entries) == 1
+
+    # A late reading inside the window replaces it
+    ingest(user, source_a, [START + datetime.timedelta(minutes=31)])
+    response_cache.catch_up()
+    assert not response_cache.entries
+    assert stats_count(user, source_a, *first_hour) == 31
+
+def test_all_sources_window_is_dropped_for_any_of_the_users_sources(cache_sources, cache):
+    user, (_, source_b) = cache_sources
+    params = {"start": START.isoformat(), "end": (START + datetime.timedelta(hours=2)).isoformat(), "points": 10}
+    before = user.client.get("/api/energy/history", params=params, headers=user.headers).json()
+    assert len(response_cache.entries) == 1
+    ingest(user, source_b, [START + datetime.timedelta(minutes=33)])
+    after = user.client.get("/api/energy/history", params=params, headers=user.headers).json()
+    assert sum(point["count"] for point in after["points"]) == sum(point["count"] for point in before["points"]) + 1
+
+def test_least_recently_used_entries_are_evicted(monkeypatch, cache):
+    async def fetch(n):
+        async def compute():
+            return {"timestamp": START, "generated_energy": float(n), "count": 1}
+        return await response_cache.cached(("test", n), response_cache.Scope(1, 1, 0, 60), schemas.HistoryPoint, compute)
+
+    async def run():
+        await fetch(1)
+        # Room for three entries like the first
+        monkeypatch.setattr(response_cache, "RESPONSE_CACHE_MAX_BYTES", 3 * response_cache.size)
+        for n in (2, 3):
+            await fetch(n)
+        await fetch(1)
+        await fetch(4)
+
+    asyncio.run(run())
+    assert list(response_cache.entries) == [("test", 3), ("test", 1), ("test", 4)]
+    assert response_cache.size <= response_cache.RESPONSE_CACHE_MAX_BYTES
+
+def test_changes_logged_by_other_processes_invalidate(monkeypatch, cache):
+    response_cache.detach()
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_SHM_NAME", f"energy_changes_test_{uuid.uuid4().hex[:8]}")
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_LOG_SIZE", 4)
+    assert response_cache.attach()
+    try:
+        minute = timeseries.to_epoch(START)
+        response_cache.add(("a",), response_cache.Scope(1, 7, minute, minute + 60), b"{}")
+        response_cache.add(("b",), response_cache.Scope(1, None, minute, minute + 60), b"{}")
+        # As written by a worker storing a reading of user 1's source 8
+        response_cache.publish(response_cache.Change(8, 1, minute + 30, minute + 31))
+        response_cache.catch_up()
+        assert list(response_cache.entries) == [("a",)]
+
+        # More changes than the ring holds: everything is dropped
+        for _ in range(5):
+            response_cache.publish(response_cache.Change(9, 2, 0, 1))
+        response_cache.catch_up()
+        assert not response_cache.entries
+    finally:
+        name = response_cache.memory.name
+        response_cache.detach()
+        shared_memory.SharedMemory(name).unlink()
+
+def fetch_constant(key):
+    async def compute():
+        return {"timestamp": START, "generated_energy": 1.0, "count": 1}
+    return response_cache.cached(key, response_cache.Scope(1, 1, 0, 60), schemas.HistoryPoint, compute)
+
+def test_nothing_is_cached_without_the_shared_ring(cache):
+    response_cache.detach()
+    asyncio.run(fetch_constant(("unshared",)))
+    assert not response_cache.entries
+
+def test_entry_computed_while_the_ring_was_overrun_is_not_kept(cache):
+    async def compute():
+        # Changes of other sources, but more than the ring holds: some may have been ours
+        for _ in range(len(response_cache.ring) + 1):
+            response_cache.publish(response_cache.Change(9, 2, 0, 1))
+        return {"timestamp": START, "generated_energy": 1.0, "count": 1}
+    asyncio.run(response_cache.cached(("overrun",), response_cache.Scope(1, 1, 0, 60), schemas.HistoryPoint, compute))
+    assert not response_cache.entries
+    asyncio.run(fetch_constant(("overrun",)))
+    assert list(response_cache.entries) == [("overrun",)]
+
+def test_windows_without_an_end_share_an_entry(cache_sources, cache):
+    user, (source_a, _) = cache_sources
+    body = user.client.get("/api/energy/stats", params={"source_id": source_a}, headers=user.headers).json()
+    end = datetime.datetime.fromisoformat(body["end"].replace("Z", "+00:00"))
+    assert end.second == 0 and end.microsecond == 0
+    assert end >= datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+    assert len(response_cache.entries) == 1
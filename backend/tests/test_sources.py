@@ -0,0 +1,184 @@
+import datetime
+import json
+import os
+import httpx
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from starlette.testclient import TestClient
+from app import database, migrations, models
+from app.services import adapters, scheduler
+
+def make_source(**fields):
+    db = database.SessionLocal()
+    source = models.EnergySource(name="Test source", **fields)
+    db.add(source)
+    db.commit()
+    db.refresh(source)
+    db.close()
+    return source
+
+def stored_readings(source_id):
+    db = database.SessionLocal()
+    rows = db.query(models.EnergyData).filter(models.EnergyData.source_id == source_id).order_by(models.EnergyData.timestamp).all()
+    db.close()
+    return [(row.timestamp, row.generated_energy) for row in rows]
+
+def test_csv_source_is_fetched_in_one_batch_and_converted_to_mwh(test_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(adapters, "SOURCE_FILE_ROOT", str(tmp_path))
+    path = tmp_path / "readings.csv"
+    path.write_text("timestamp,value\n2024-01-01T00:00:00Z,1500\n2024-01-01T00:01:00Z,2500\n")
+    source = make_source(kind="csv", endpoint_url=str(path), unit="kWh")
+
+    scheduler.fetch_energy_data(source.id)
+    assert stored_readings(source.id) == [
+        (datetime.datetime(2024, 1, 1, 0, 0), 1.5),
+        (datetime.datetime(2024, 1, 1, 0, 1), 2.5),
+    ]
+
+    # Only rows after the newest stored reading are taken on the next poll
+    with open(path, "a") as f:
+        f.write("2024-01-01T00:02:00Z,500\n")
+    scheduler.fetch_energy_data(source.id)
+    assert len(stored_readings(source.id)) == 3
+
+def test_file_drop_moves_files_after_commit(test_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(adapters, "SOURCE_FILE_ROOT", str(tmp_path))
+    (tmp_path / "a.ndjson").write_text('{"timestamp": 1704067200, "value": 1.0}\n{"timestamp": 1704067260, "value": 2.0}\n')
+    (tmp_path / "b.json").write_text(json.dumps({"readings": [{"timestamp": "2024-01-01T00:02:00", "value": 3.0}]}))
+    source = make_source(kind="file_drop", endpoint_url=str(tmp_path))
+
+    scheduler.fetch_energy_data(source.id)
+    assert [value for _, value in stored_readings(source.id)] == [1.0, 2.0, 3.0]
+    assert sorted(os.listdir(tmp_path / "processed")) == ["a.ndjson", "b.json"]
+    assert not (tmp_path / "a.ndjson").exists()
+
+def test_file_drop_stores_a_late_reading(test_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(adapters, "SOURCE_FILE_ROOT", str(tmp_path))
+    (tmp_path / "a.ndjson").write_text('{"timestamp": 1704067260, "value": 2.0}\n')
+    source = make_source(kind="file_drop", endpoint_url=str(tmp_path))
+    scheduler.fetch_energy_data(source.id)
+
+    # A file dropped later, with a reading older than the one already stored,
+    # and a repeat of that one
+    (tmp_path / "b.ndjson").write_text('{"timestamp": 1704067200, "value": 1.0}\n{"timestamp": 1704067260, "value": 2.0}\n')
+    scheduler.fetch_energy_data(source.id)
+    assert [value for _, value in stored_readings(source.id)] == [1.0, 2.0]
+    db = database.SessionLocal()
+    assert db.query(models.QuarantinedReading).filter(models.QuarantinedReading.source_id == source.id).count() == 0
+    db.close()
+
+def test_http_json_adapter_sends_since_and_credentials(monkeypatch):
+    monkeypatch.setenv("SOURCE_CRED_TEST", "secret")
+    monkeypatch.setattr(adapters, "SOURCE_ALLOWED_HOSTS", {"source.test"})
+    seen = {}
+
+    def handler(request):
+        seen["since"] = request.url.params.get("since")
+        seen["auth"] = request.headers.get("authorization")
+        return httpx.Response(200, json={"readings": [
+            {"timestamp": "2024-01-01T00:00:00", "value": 1},
+            {"timestamp": "2024-01-01T00:05:00", "value": 2},
+        ]})
+
+    adapter = adapters.HttpJsonAdapter()
+    adapter.client = httpx.Client(transport=httpx.MockTransport(handler))
+    source = models.EnergySource(id=1, kind="http_json", endpoint_url="http://source.test/readings", credentials_ref="SOURCE_CRED_TEST")
+    readings = adapter.fetch(source, datetime.datetime(2024, 1, 1, 0, 1))
+
+    assert seen == {"since": "2024-01-01T00:01:00", "auth": "Bearer secret"}
+    assert readings == [adapters.Reading(datetime.datetime(2024, 1, 1, 0, 5), 2.0)]
+
+def test_create_and_list_sources(test_client: TestClient, auth_headers, monkeypatch):
+    monkeypatch.setattr(adapters, "SOURCE_ALLOWED_HOSTS", {"inverter.local"})
+    response = test_client.post("/api/energy/sources", json={"name": "Roof", "kind": "ftp"}, headers=auth_headers)
+    assert response.status_code == 400
+    response = test_client.post("/api/energy/sources", json={
+        "name": "Roof", "kind": "http_json", "endpoint_url": "http://inverter.local/api", "unit": "kWh", "interval_seconds": 300
+    }, headers=auth_headers)
+    assert response.status_code == 200
+    created = response.json()
+    response = test_client.get("/api/energy/sources", headers=auth_headers)
+    assert created in response.json()
+
+def test_sources_cannot_reach_server_secrets_or_internal_hosts(test_client: TestClient, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(adapters, "SOURCE_FILE_ROOT", str(tmp_path))
+    rejected = [
+        {"kind": "http_json", "endpoint_url": "http://93.184.216.34/api", "credentials_ref": "SECRET_KEY"},
+        {"kind": "http_json", "endpoint_url": "http://127.0.0.1:8000/api"},
+        {"kind": "http_json", "endpoint_url": "http://localhost/api"},
+        {"kind": "http_json", "endpoint_url": "http://169.254.169.254/latest/meta-data"},
+        {"kind": "http_json", "endpoint_url": "http://10.0.0.5/api"},
+        {"kind": "http_json", "endpoint_url": "http://[::ffff:192.168.1.1]/api"},
+        {"kind": "http_json", "endpoint_url": "file:///etc/passwd"},
+        {"kind": "csv", "endpoint_url": "/etc/passwd"},
+        {"kind": "csv", "endpoint_url": "../outside.csv"},
+        {"kind": "file_drop", "endpoint_url": "/tmp"},
+    ]
+    for fields in rejected:
+        response = test_client.post("/api/energy/sources", json={"name": "Bad", **fields}, headers=auth_headers)
+        assert response.status_code == 400, fields
+
+    accepted = [
+        {"kind": "http_json", "endpoint_url": "https://93.184.216.34/api", "credentials_ref": "SOURCE_CRED_ROOF"},
+        {"kind": "csv", "endpoint_url": "plant/readings.csv"},
+        {"kind": "file_drop", "endpoint_url": str(tmp_path / "drop")},
+    ]
+    for fields in accepted:
+        response = test_client.post("/api/energy/sources", json={"name": "Good", **fields}, headers=auth_headers)
+        assert response.status_code == 200, fields
+
+    # Without a root, local sources are refused
+    monkeypatch.setattr(adapters, "SOURCE_FILE_ROOT", None)
+    response = test_client.post("/api/energy/sources", json={"name": "Bad", "kind": "file_drop", "endpoint_url": str(tmp_path)}, headers=auth_headers)
+    assert response.status_code == 400
+
+def test_sources_stored_before_the_checks_are_refused_on_fetch(monkeypatch):
+    monkeypatch.setenv("SECRET_KEY", "server secret")
+    adapter = adapters.HttpJsonAdapter()
+    adapter.client = httpx.Client(transport=httpx.MockTransport(lambda request: pytest.fail("request sent")))
+    for source in [
+        models.EnergySource(id=1, kind="http_json", endpoint_url="http://127.0.0.1/readings"),
+        models.EnergySource(id=1, kind="http_json", endpoint_url="http://93.184.216.34/readings", credentials_ref="SECRET_KEY"),
+    ]:
+        with pytest.raises(ValueError):
+            adapter.fetch(source, None)
+
+def test_upgrade_adds_missing_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE energy_data (id INTEGER PRIMARY KEY, timestamp DATETIME, generated_energy FLOAT, user_id INTEGER)"))
+    migrations.upgrade(engine)
+    inspector = inspect(engine)
+    assert "source_id" in {column["name"] for column in inspector.get_columns("energy_data")}
+    assert "ix_energy_data_source_id" in {index["name"] for index in inspector.get_indexes("energy_data")}
+    assert inspector.has_table("energy_sources")
+
+def test_readings_fetched_again_are_not_stored_again(test_client, monkeypatch):
+    source = make_source(kind="mock")
+    readings = [adapters.Reading(datetime.datetime(2024, 2, 1, 0, minute), 1.0) for minute in range(3)]
+    monkeypatch.setattr(adapters.ADAPTERS["mock"], "fetch", lambda source, since: readings)
+    scheduler.fetch_energy_data(source.id)
+    scheduler.fetch_energy_data(source.id)
+    # A restart forgets the in-memory high water mark
+    scheduler.high_water.clear()
+    scheduler.sources.clear()
+    scheduler.fetch_energy_data(source.id)
+    assert len(stored_readings(source.id)) == 3
+
+def test_fetch_connects_to_the_address_that_was_checked(monkeypatch):
+    # Public when checked, internal on any later lookup (DNS rebinding)
+    answers = iter(["93.184.216.34"])
+    monkeypatch.setattr(adapters.socket, "getaddrinfo", lambda host, *args, **kwargs: [
+        (None, None, None, "", (next(answers, "127.0.0.1"), 0))
+    ])
+    seen = {}
+
+    def handler(request):
+        seen.update(host=request.url.host, header=request.headers["host"], sni=request.extensions.get("sni_hostname"))
+        return httpx.Response(200, json=[{"timestamp": "2024-01-01T00:05:00", "value": 2}])
+
+    adapter = adapters.HttpJsonAdapter()
+    adapter.client = httpx.Client(transport=httpx.MockTransport(handler))
+    source = models.EnergySource(id=1, kind="http_json", endpoint_url="https://rebind.example:8443/readings")
+    assert adapter.fetch(source, None) == [adapters.Reading(datetime.datetime(2024, 1, 1, 0, 5), 2.0)]
+    assert seen == {"host": "93.184.216.34", "header": "rebind.example:8443", "sni": "rebind.example"}
@@ -0,0 +1,81 @@
+import datetime
+import os
+from sqlalchemy.exc import OperationalError
+from app import database, models
+from app.services import adapters, scheduler
+from app.services.spool import Spool
+
+def reading(minute, source_id=1):
+    return {"timestamp": datetime.datetime(2024, 1, 1, 0, minute), "generated_energy": float(minute), "user_id": None, "source_id": source_id}
+
+def test_segments_rotate_and_round_trip(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=300)
+    for minute in range(10):
+        spool.append([reading(minute)])
+    segments = spool.sealed_segments()
+    assert len(segments) > 1
+    rows = [row for path in segments for row in spool.read_segment(path)]
+    assert rows == [reading(minute) for minute in range(10)]
+    assert spool.synced == spool.written
+
+def test_torn_tail_is_skipped_after_crash(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append([reading(0), reading(1)])
+    with open(spool.path, "ab") as f:
+        f.write(b'{"timestamp": "2024-01-01T00:0')
+
+    # A new process finds the segment still open
+    restarted = Spool(str(tmp_path))
+    [segment] = restarted.sealed_segments()
+    assert restarted.read_segment(segment) == [reading(0), reading(1)]
+
+def test_outage_spools_then_replays(test_client, tmp_path, monkeypatch):
+    db = database.SessionLocal()
+    source = models.EnergySource(name="Spooled source", kind="mock")
+    db.add(source)
+    db.commit()
+    source_id = source.id
+    db.close()
+
+    # One reading per poll, a minute apart: a source stores one reading per second
+    polls = iter(range(3))
+    monkeypatch.setattr(adapters.ADAPTERS["mock"], "fetch", lambda source, since: [adapters.Reading(datetime.datetime(2024, 1, 1, 0, next(polls)), 1.0)])
+    monkeypatch.setattr(scheduler, "spool", Spool(str(tmp_path)))
+    store_readings = scheduler.store_readings
+    def database_down(*args):
+        raise OperationalError("INSERT", {}, Exception("database is down"))
+    monkeypatch.setattr(scheduler, "store_readings", database_down)
+    for _ in range(3):
+        scheduler.fetch_energy_data(source_id)
+    scheduler.replay_spool()
+    assert len(os.listdir(tmp_path)) == 1 # Replay deferred while the database is down
+
+    monkeypatch.setattr(scheduler, "store_readings", store_readings)
+    scheduler.replay_spool()
+    assert os.listdir(tmp_path) == []
+    db = database.SessionLocal()
+    assert db.query(models.EnergyData).filter(models.EnergyData.source_id == source_id).count() == 3
+    assert db.get(models.EnergySource, source_id).last_reading_at is not None
+    db.close()
+
+def test_segment_replayed_again_after_a_crash_is_not_stored_twice(test_client, tmp_path, monkeypatch):
+    db = database.SessionLocal()
+    source = models.EnergySource(name="Replayed source", kind="mock")
+    db.add(source)
+    db.commit()
+    source_id = source.id
+    db.close()
+
+    spooled = Spool(str(tmp_path))
+    spooled.append([reading(minute, source_id) for minute in range(5)])
+    monkeypatch.setattr(scheduler, "spool", spooled)
+    # The replay committed, then the process died before deleting the segment
+    scheduler.store_readings(spooled.read_segment(spooled.sealed_segments()[0]))
+    restarted = Spool(str(tmp_path))
+    monkeypatch.setattr(scheduler, "spool", restarted)
+    scheduler.replay_spool()
+
+    assert os.listdir(tmp_path) == []
+    db = database.SessionLocal()
+    assert db.query(models.EnergyData).filter(models.EnergyData.source_id == source_id).count() == 5
+    db.close()
@@ -0,0 +1,122 @@
+import datetime
+import math
+import numpy as np
+import pytest
+from app import database, models
+from app.services import rollups, sketch, stats, timeseries
+
+START = datetime.datetime(2023, 6, 1)
+MINUTES = 3 * 1440
+VALUES = np.round(np.random.default_rng(5).gamma(2.0, 1.5, size=MINUTES), 6)
+
+def nearest_rank(values, p):
+    ordered = np.sort(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)), 1) - 1]
+
+@pytest.fixture(scope="module")
+def stats_source(energy_user):
+    user = energy_user("stats")
+    source_id = user.add_source("Stats")
+    result = user.ingest(source_id, [(START + datetime.timedelta(minutes=i), value) for i, value in enumerate(VALUES.tolist())])
+    assert result["accepted"] == MINUTES
+    return user, source_id
+
+def get_stats(user, source_id, start, end, **params):
+    response = user.client.get("/api/energy/stats", params={"source_id": source_id, "start": start.isoformat(), "end": end.isoformat(), **params}, headers=user.headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_short_window_is_exact(stats_source):
+    user, source_id = stats_source
+    body = get_stats(user, source_id, START, START + datetime.timedelta(days=1), bucket_seconds=3600, percentiles="50,95")
+    assert body["tier"] == "raw" and not body["approximate"]
+    day = VALUES[:1440]
+    assert body["total"]["count"] == 1440
+    assert body["total"]["sum"] == pytest.approx(day.sum())
+    assert body["total"]["min"] == day.min() and body["total"]["max"] == day.max()
+    assert body["total"]["percentiles"] == {"p50": nearest_rank(day, 50), "p95": nearest_rank(day, 95)}
+    assert len(body["buckets"]) == 24
+    third_hour = VALUES[120:180]
+    assert body["buckets"][2]["count"] == 60
+    assert body["buckets"][2]["percentiles"]["p95"] == nearest_rank(third_hour, 95)
+
+def test_long_window_reads_rollups(stats_source):
+    user, source_id = stats_source
+    db = database.SessionLocal()
+    for resolution in rollups.RESOLUTIONS:
+        db.merge(models.RollupState(resolution=resolution, closed_until=timeseries.to_epoch(START)))
+    db.commit()
+    db.close()
+    rollups.compute_rollups(now=timeseries.to_epoch(START + datetime.timedelta(days=4)))
+
+    start = START - datetime.timedelta(hours=12)
+    body = get_stats(user, source_id, start, START + datetime.timedelta(days=3), bucket_seconds=86400)
+    assert body["tier"] == "rollup" and body["approximate"]
+    assert body["total"]["count"] == MINUTES
+    assert body["total"]["sum"] == pytest.approx(VALUES.sum())
+    assert body["total"]["max"] == VALUES.max()
+    for p in (50, 95, 99):
+        assert body["total"]["percentiles"][f"p{p}"] == pytest.approx(nearest_rank(VALUES, p), rel=0.02)
+    assert [bucket["count"] for bucket in body["buckets"]] == [1440, 1440, 1440]
+
+def test_late_reading_rebuilds_only_its_source(stats_source):
+    user, source_id = stats_source
+    db = database.SessionLocal()
+    closed = {state.resolution: state.closed_until for state in db.query(models.RollupState)}
+    db.close()
+    late = START + datetime.timedelta(days=1, hours=10, minutes=30, seconds=10)
+    user.ingest(source_id, [(late, 1.0)])
+
+    # The horizon stays, the source's range is recorded and read raw until it is rebuilt
+    db = database.SessionLocal()
+    assert {state.resolution: state.closed_until for state in db.query(models.RollupState)} == closed
+    assert [(record.source_id, record.period_start) for record in db.query(models.RollupDirty)] == [(source_id, timeseries.to_epoch(late))]
+    db.close()
+    window = (START, START + datetime.timedelta(days=3))
+    body = get_stats(user, source_id, *window, bucket_seconds=86400)
+    assert body["tier"] == "mixed" and body["total"]["count"] == MINUTES + 1
+
+    rollups.compute_rollups(now=timeseries.to_epoch(START + datetime.timedelta(days=4)))
+    db = database.SessionLocal()
+    assert db.query(models.RollupDirty).count() == 0
+    db.close()
+    body = get_stats(user, source_id, *window, bucket_seconds=86400)
+    assert body["tier"] == "rollup" and body["total"]["count"] == MINUTES + 1
+    assert [bucket["count"] for bucket in body["buckets"]] == [1440, 1441, 1440]
+
+def test_dirty_ranges_cover_whole_buckets_up_to_the_horizon():
+    hour = rollups.HOUR
+    assert rollups.dirty_buckets([(hour + 10, hour + 20), (2 * hour + 5, 2 * hour + 6), (9 * hour, 10 * hour)], hour, 5 * hour) == [[hour, 3 * hour]]
+
+def test_plan_uses_coarsest_tier_per_stretch():
+    day, hour = rollups.DAY, rollups.HOUR
+    closed = {hour: 10 * day + 5 * hour, day: 10 * day}
+    segments = stats.plan(day - 30 * 60, 10 * day + 6 * hour + 60, None, closed)
+    assert segments == [
+        ("raw", day - 30 * 60, day),
+        (day, day, 10 * day),
+        (hour, 10 * day, 10 * day + 5 * hour),
+        ("raw", 10 * day + 5 * hour, 10 * day + 6 * hour + 60),
+    ]
+    # Daily rollups cannot serve 6-hour buckets
+    assert all(tier != day for tier, _, _ in stats.plan(0, 20 * day, 6 * hour, closed))
+
+def test_sketch_percentiles_within_one_percent():
+    values = np.random.default_rng(3).lognormal(0, 2, size=100000)
+    index, counts = np.unique(sketch.bins(values), return_counts=True)
+    decoded = sketch.decode(sketch.encode(index, counts))
+    for p, estimate in zip((1, 50, 99.9), sketch.quantiles(*decoded, (1, 50, 99.9))):
+        assert estimate == pytest.approx(nearest_rank(values, p), rel=0.01)
+
+def test_mark_dirty_records_each_group_once():
+    rows = [
+        {"user_id": 1, "source_id": 7, "timestamp": START},
+        {"user_id": 1, "source_id": 7, "timestamp": START + datetime.timedelta(minutes=5)},
+        {"user_id": 1, "source_id": None, "timestamp": START},
+    ]
+    _, parameters = rollups.mark_dirty(rows, deadband_seconds=60)
+    epoch = timeseries.to_epoch(START)
+    assert parameters == [
+        {"user_id": 1, "source_id": 7, "start": epoch - 60, "end": epoch + 300 + 61},
+        {"user_id": 1, "source_id": None, "start": epoch - 60, "end": epoch + 61},
+    ]
@@ -0,0 +1,29 @@
+from app.services.timing_wheel import TimingWheel
+
+def test_keys_fire_once_per_interval():
+    wheel = TimingWheel(tick_seconds=1, size=60, now=0)
+    wheel.schedule("a", 5)
+    wheel.schedule("b", 150) # Longer than one revolution of the wheel
+    fired = {"a": [], "b": []}
+    for _ in range(300):
+        for key in wheel.advance():
+            fired[key].append(wheel.current_tick)
+    assert len(fired["a"]) == 60
+    assert all(b - a == 5 for a, b in zip(fired["a"], fired["a"][1:]))
+    assert len(fired["b"]) == 2 and fired["b"][1] - fired["b"][0] == 150
+
+def test_cancel_and_reschedule():
+    wheel = TimingWheel(tick_seconds=1, size=60, now=0)
+    wheel.schedule(1, 10)
+    wheel.cancel(1)
+    assert not any(wheel.advance() for _ in range(20))
+    assert len(wheel) == 0
+
+def test_load_spread_across_the_minute():
+    wheel = TimingWheel(tick_seconds=1, size=3600, now=0)
+    for source_id in range(100_000):
+        wheel.schedule(source_id, 60)
+    per_tick = [len(wheel.advance()) for _ in range(60)]
+    assert sum(per_tick) == 100_000
+    # An even spread is ~1667 per tick, allow a few percent either way
+    assert max(per_tick) < 1750 and min(per_tick) > 1580
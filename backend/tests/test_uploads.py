@@ -0,0 +1,76 @@
+import hashlib
+import os
+from starlette.testclient import TestClient
+from app.api import onboarding
+
+def test_chunked_upload_resume_and_finalize(test_client: TestClient, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(onboarding, "UPLOAD_ROOT", str(tmp_path))
+    monkeypatch.setattr(onboarding, "PARTIAL_DIR", str(tmp_path / ".partial"))
+    content = os.urandom(3000)
+
+    response = test_client.post("/api/onboarding/uploads", headers=auth_headers, json={
+        "kind": "doc",
+        "filename": "report.pdf",
+        "content_type": "application/pdf",
+        "total_size": len(content),
+        "sha256": hashlib.sha256(content).hexdigest()
+    })
+    assert response.status_code == 200
+    upload_id = response.json()["id"]
+
+    first = content[:1000]
+    headers = {**auth_headers, "X-Chunk-SHA256": hashlib.sha256(first).hexdigest()}
+    response = test_client.patch(f"/api/onboarding/uploads/{upload_id}?offset=0", headers=headers, content=first)
+    assert response.json()["received_size"] == 1000
+
+    # Re-sending the same chunk is a no-op, skipping ahead is rejected
+    response = test_client.patch(f"/api/onboarding/uploads/{upload_id}?offset=0", headers=headers, content=first)
+    assert response.status_code == 200
+    response = test_client.patch(f"/api/onboarding/uploads/{upload_id}?offset=2000", headers=auth_headers, content=content[2000:])
+    assert response.status_code == 409
+
+    bad = {**auth_headers, "X-Chunk-SHA256": "0" * 64}
+    response = test_client.patch(f"/api/onboarding/uploads/{upload_id}?offset=1000", headers=bad, content=content[1000:])
+    assert response.status_code == 400
+
+    response = test_client.get(f"/api/onboarding/uploads/{upload_id}", headers=auth_headers)
+    assert response.json()["received_size"] == 1000
+    response = test_client.patch(f"/api/onboarding/uploads/{upload_id}?offset=1000", headers=auth_headers, content=content[1000:])
+    assert response.json()["received_size"] == len(content)
+
+    response = test_client.post(f"/api/onboarding/uploads/{upload_id}/finalize", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["status"] == "complete"
+    stored = [p for p in tmp_path.rglob("supporting_doc.pdf")]
+    assert len(stored) == 1
+    assert stored[0].read_bytes() == content
+
+    response = test_client.get("/api/auth/me", headers=auth_headers)
+    assert response.json()["is_onboarded"] is True
+
+def test_chunked_upload_rejects_bad_type(test_client: TestClient, auth_headers):
+    response = test_client.post("/api/onboarding/uploads", headers=auth_headers, json={
+        "kind": "energy_pic",
+        "filename": "notes.txt",
+        "content_type": "text/plain",
+        "total_size": 10
+    })
+    assert response.status_code == 400
+
+def test_concurrent_chunk_at_the_same_offset_is_rejected(test_client: TestClient, auth_headers, tmp_path, monkeypatch):
+    monkeypatch.setattr(onboarding, "PARTIAL_DIR", str(tmp_path / ".partial"))
+    content = os.urandom(2000)
+    upload_id = test_client.post("/api/onboarding/uploads", headers=auth_headers, json={
+        "kind": "doc", "filename": "race.pdf", "content_type": "application/pdf", "total_size": len(content)
+    }).json()["id"]
+
+    # Another request is still writing the chunk at offset 0
+    writer = onboarding.open_partial(upload_id)
+    try:
+        response = test_client.patch(f"/api/onboarding/uploads/{upload_id}?offset=0", headers=auth_headers, content=content[:1000])
+        assert response.status_code == 409
+    finally:
+        writer.close()
+    response = test_client.patch(f"/api/onboarding/uploads/{upload_id}?offset=0", headers=auth_headers, content=content[:1000])
+    assert response.json()["received_size"] == 1000
+    assert (tmp_path / ".partial" / f"{upload_id}.part").read_bytes()[:1000] == content[:1000]
@@ -0,0 +1,54 @@
+import datetime
+import math
+import numpy as np
+from app.services import validation
+
+START = datetime.datetime(2024, 1, 1)
+
+def minutes(*offsets):
+    return [START + datetime.timedelta(minutes=offset) for offset in offsets]
+
+def reasons(checked):
+    return [validation.REASONS[code] if code != validation.ACCEPTED else None for code in checked.reason.tolist()]
+
+def test_units_are_converted_and_ranges_checked():
+    checked = validation.validate(minutes(0, 1, 2, 3, 4), [1500, 2.0, -1, math.inf, 5e6], [1e-3, math.nan, 1e-3, 1e-3, 1e-3])
+    assert reasons(checked) == [None, "unit", "negative", "not_finite", "above_max"]
+    assert checked.values[0] == 1.5
+
+def test_timestamps_must_increase():
+    checked = validation.validate(minutes(5, 6, 6, 4, 7), [1.0] * 5, 1.0, after=START + datetime.timedelta(minutes=4))
+    assert reasons(checked) == [None, None, "duplicate", "stale", None]
+    checked = validation.validate(minutes(1, 3, 2, 10**7), [1.0] * 4, 1.0)
+    assert reasons(checked) == [None, None, "out_of_order", "future"]
+    # One reading per second
+    half = datetime.timedelta(milliseconds=500)
+    checked = validation.validate([START - half / 5, START, START + half], [1.0] * 3, 1.0, after=START - half)
+    assert reasons(checked) == ["stale", None, "duplicate"]
+
+def test_replays_across_batches_are_stale():
+    # The poll path passes the newest reading of the previous batch as `after`
+    first = validation.validate(minutes(0, 1, 2), [1.0] * 3, 1.0)
+    assert reasons(first) == [None, None, None]
+    replay = validation.validate(minutes(1, 2, 3), [1.0] * 3, 1.0, after=minutes(2)[0])
+    assert reasons(replay) == ["stale", "stale", None]
+
+def test_outliers_are_flagged_not_rejected():
+    values = np.random.default_rng(1).normal(50, 1, size=200)
+    values[17] = 500
+    checked = validation.validate(minutes(*range(200)), values, 1.0)
+    assert (checked.reason == validation.ACCEPTED).all()
+    assert np.flatnonzero(checked.is_outlier).tolist() == [17]
+
+def test_partition_builds_rows_and_quarantine():
+    timestamps = minutes(0, 1)
+    checked = validation.validate(timestamps, [1.0, -2.0], 1.0)
+    rows, quarantined = validation.partition(checked, timestamps, [1.0, -2.0], "MWh", {"source_id": 3, "user_id": None})
+    assert rows == [{"source_id": 3, "user_id": None, "timestamp": timestamps[0], "generated_energy": 1.0, "is_outlier": False}]
+    assert quarantined[0]["reason"] == "negative" and quarantined[0]["value"] == -2.0
+
+def test_readings_past_retention_are_expired():
+    now = datetime.datetime(2024, 1, 1)
+    timestamps = [now - datetime.timedelta(days=40), now - datetime.timedelta(days=20)]
+    checked = validation.validate(timestamps, [1.0, 1.0], 1.0, now=now, oldest=now - datetime.timedelta(days=30))
+    assert reasons(checked) == ["expired", None]
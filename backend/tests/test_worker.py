@@ -0,0 +1,44 @@
+import json
+import urllib.error
+import urllib.request
+from app import worker
+
+def test_health_endpoint_reports_stopped_scheduler():
+    server = worker.start_health_server("127.0.0.1", 0)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/health"
+        try:
+            urllib.request.urlopen(url)
+            assert False, "expected 503 while the scheduler is not running"
+        except urllib.error.HTTPError as e:
+            assert e.code == 503
+            assert json.loads(e.read())["status"] == "stopped"
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            assert b"scheduler_job_duration_seconds" in response.read()
+    finally:
+        server.shutdown()
+
+def test_scheduler_jobs_persist_across_restarts():
+    from sqlalchemy import text
+    from app import database
+    from app.services import scheduler
+
+    scheduler.start()
+    try:
+        job = scheduler.scheduler.get_job("sync_sources")
+        assert job.max_instances == scheduler.JOB_MAX_INSTANCES
+        assert job.coalesce == scheduler.JOB_COALESCE
+        assert job.misfire_grace_time == scheduler.JOB_MISFIRE_GRACE_SECONDS
+        next_run = job.next_run_time
+    finally:
+        scheduler.shutdown()
+
+    with database.engine.connect() as conn:
+        assert conn.execute(text("SELECT id FROM apscheduler_jobs ORDER BY id")).scalars().all() == ["compact_archive", "compute_rollups", "maintain_partitions", "replay_spool", "sync_sources"]
+
+    scheduler.start()
+    try:
+        assert scheduler.scheduler.get_job("sync_sources").next_run_time == next_run
+    finally:
+        scheduler.shutdown()
@@ -11,9 +11,10 @@ function App() {
       <Routes>
         <Route path="/login" element={<Login />} />
         <Route path="/register" element={<Register />} />
+        {/* Checks the session itself, through its single /dashboard request */}
+        <Route path="/dashboard" element={<Dashboard />} />
 
         <Route element={<ProtectedRoute />}>
-          <Route path="/dashboard" element={<Dashboard />} />
           <Route path="/onboarding" element={<Onboarding />} />
         </Route>
 
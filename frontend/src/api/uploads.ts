@@ -0,0 +1,45 @@
+import axios from 'axios';
+import api from './client';
+
+const CHUNK_SIZE = 4 * 1024 * 1024; // 4MB
+const MAX_ATTEMPTS = 5;
+
+const sha256Hex = async (data: ArrayBuffer) => {
+    const digest = await crypto.subtle.digest('SHA-256', data);
+    return Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, '0')).join('');
+};
+
+// Uploads a file through the resumable chunked upload endpoints.
+// A failed chunk is retried from the offset the server last acknowledged.
+export const uploadResumable = async (file: File, kind: 'energy_pic' | 'doc') => {
+    const { data: session } = await api.post('/onboarding/uploads', {
+        kind,
+        filename: file.name,
+        content_type: file.type,
+        total_size: file.size,
+    });
+
+    let offset = 0;
+    let attempts = 0;
+    while (offset < file.size) {
+        const chunk = await file.slice(offset, offset + CHUNK_SIZE).arrayBuffer();
+        try {
+            const { data } = await api.patch(`/onboarding/uploads/${session.id}`, chunk, {
+                params: { offset },
+                headers: {
+                    'Content-Type': 'application/octet-stream',
+                    'X-Chunk-SHA256': await sha256Hex(chunk),
+                },
+            });
+            offset = data.received_size;
+            attempts = 0;
+        } catch (err) {
+            if (axios.isAxiosError(err) && err.response && err.response.status < 409) throw err;
+            if (++attempts >= MAX_ATTEMPTS) throw err;
+            const { data } = await api.get(`/onboarding/uploads/${session.id}`);
+            offset = data.received_size;
+        }
+    }
+
+    return api.post(`/onboarding/uploads/${session.id}/finalize`);
+};
@@ -1,29 +1,48 @@
 import React, { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts';
+import axios from 'axios';
 import api from '../api/client';
 
-interface EnergyData {
-    id: number;
+interface HistoryPoint {
     timestamp: string;
-    generated_energy: number;
+    generated_energy: number | null;
+}
+
+interface StatsSummary {
+    count: number;
+    sum: number | null;
+    mean: number | null;
 }
 
 const Dashboard: React.FC = () => {
     const [currentEnergy, setCurrentEnergy] = useState<number | null>(null);
-    const [history, setHistory] = useState<EnergyData[]>([]);
+    const [history, setHistory] = useState<HistoryPoint[]>([]);
+    const [summary, setSummary] = useState<StatsSummary | null>(null);
     const navigate = useNavigate();
 
+    // Profile, current reading, chart and summary in one request. It also stands
+    // in for ProtectedRoute's /auth/me check on this route.
     const fetchData = async () => {
+        if (!localStorage.getItem('token')) {
+            navigate('/login', { replace: true });
+            return;
+        }
         try {
-            const [currentRes, historyRes] = await Promise.all([
-                api.get('/energy/current'),
-                api.get('/energy/history')
-            ]);
-            setCurrentEnergy(currentRes.data.generated_energy);
-            // Reverse history to show oldest to newest in chart
-            setHistory(historyRes.data.reverse());
+            const res = await api.get('/dashboard');
+            if (!res.data.user.is_onboarded) {
+                navigate('/onboarding', { replace: true });
+                return;
+            }
+            setCurrentEnergy(res.data.current ? res.data.current.generated_energy : null);
+            // Points come oldest to newest
+            setHistory(res.data.history.points);
+            setSummary(res.data.stats);
         } catch (e) {
+            if (axios.isAxiosError(e) && e.response?.status === 401) {
+                navigate('/login', { replace: true });
+                return;
+            }
             console.error("Error fetching data", e);
         }
     };
@@ -53,6 +72,15 @@ const Dashboard: React.FC = () => {
                         {currentEnergy !== null ? `${currentEnergy.toFixed(2)} kWh` : 'Loading...'}
                     </div>
                 </div>
+                <div className="card">
+                    <h3 style={{ margin: 0, color: 'var(--text-muted)' }}>Last 24 Hours</h3>
+                    <div style={{ fontSize: '2.5rem', fontWeight: 'bold', marginTop: '0.5rem', color: 'var(--primary)' }}>
+                        {summary ? `${(summary.sum ?? 0).toFixed(2)} MWh` : 'Loading...'}
+                    </div>
+                    <div style={{ color: 'var(--text-muted)' }}>
+                        {summary && summary.mean !== null ? `${summary.count} readings, ${summary.mean.toFixed(2)} MWh average` : ''}
+                    </div>
+                </div>
             </div>
 
             <div className="card" style={{ height: '400px' }}>
@@ -1,8 +1,12 @@
 import React, { useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import api from '../api/client';
+import { uploadResumable } from '../api/uploads';
 import axios from 'axios';
 
+// Larger files go through the resumable chunked upload endpoints
+const SINGLE_UPLOAD_LIMIT = 5 * 1024 * 1024;
+
 const Onboarding: React.FC = () => {
     const [pic, setPic] = useState<File | null>(null);
     const [doc, setDoc] = useState<File | null>(null);
@@ -35,10 +39,12 @@ const Onboarding: React.FC = () => {
         setMessage('');
 
         const formData = new FormData();
-        if (pic) formData.append('energy_pic', pic);
-        if (doc) formData.append('doc', doc);
+        if (pic && pic.size <= SINGLE_UPLOAD_LIMIT) formData.append('energy_pic', pic);
+        if (doc && doc.size <= SINGLE_UPLOAD_LIMIT) formData.append('doc', doc);
 
         try {
+            if (pic && pic.size > SINGLE_UPLOAD_LIMIT) await uploadResumable(pic, 'energy_pic');
+            if (doc && doc.size > SINGLE_UPLOAD_LIMIT) await uploadResumable(doc, 'doc');
             await api.post('/onboarding/upload', formData, {
                 headers: { 'Content-Type': 'multipart/form-data' },
             });